@@ -4,48 +4,105 @@ from __future__ import unicode_literals
 
 import json
 import logging
+import os
 import sys
+import threading
 
 from flask import Flask, request
 
 from seabattle import dialog_manager as dm
-from seabattle import session
+from seabattle import metrics, session, startup
 
 
 logging.basicConfig(level=logging.DEBUG)
 
 app = Flask(__name__)
 log = logging.getLogger(__name__)
+# prefork запускает чистку сессий в одном из воркеров после fork
+if os.environ.get('SESSION_SWEEPER', '1') != '0':
+    session.start_sweeper()
+
+metrics.Gauge('seabattle_sessions', 'Сессии в хранилище', lambda: session.get_store().approximate_size())
+
+
+def start_warmup():
+    """Прогревает модель в фоне, пока сервер уже принимает запросы; /ready ответит 200 после прогрева"""
+    thread = threading.Thread(target=dm.warmup, name='nlu-warmup')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+warmup_thread = start_warmup() if os.environ.get('NLU_WARMUP', '1') != '0' else None
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = 200 if dm.is_ready() else 503
+    return json.dumps(startup.timer.report()), status, {'Content-Type': 'application/json'}
+
+
+def handle_request(json_body):
+    """Обрабатывает запрос Яндекс.Диалогов и возвращает тело ответа.
+
+    Общая часть Flask приложения и асинхронного сервера async_api. Алиса
+    повторяет запрос, не дождавшись ответа; повтор с теми же session_id и
+    message_id получает сохранённый в сессии ответ, и ход не делается дважды.
+    """
+    with metrics.span('request'):
+        log.info('Request: %r', json_body)
+
+        response = {
+            'version': json_body['version'],
+            'session': json_body['session'],
+        }
+
+        user_id = json_body['session']['user_id']
+        message_id = json_body['session'].get('message_id')
+        reply_key = None if message_id is None else [json_body['session'].get('session_id'), message_id]
+        message = json_body['request']['command'].strip()
+        if not message:
+            message = json_body['request']['original_utterance']
+
+        with session.locked(user_id):
+            with metrics.span('session_get'):
+                session_obj = session.get(user_id)
+            reply = session_obj.get('reply')
+            if reply_key is not None and reply is not None and reply['key'] == reply_key:
+                log.info('Replaying response to message %r', message_id)
+                response['response'] = reply['response']
+                return response
+            dm_obj = dm.DialogManager(session_obj)
+
+            dmresponse = dm_obj.handle_message(message)
+            response['response'] = {
+                'text': dmresponse.text,
+                'end_session': dmresponse.end_session,
+            }
+            if dmresponse.tts is not None:
+                response['response']['tts'] = dmresponse.tts
+            if reply_key is not None:
+                session_obj['reply'] = {'key': reply_key, 'response': response['response']}
+
+            with metrics.span('session_save'):
+                session.save(user_id, session_obj)
+
+        log.info('Response: %r', response)
+        return response
 
 
 @app.route('/', methods=['POST'])
 def main():
-    log.info('Request: %r', request.json)
-
-    response = {
-        'version': request.json['version'],
-        'session': request.json['session'],
-    }
-    json_body = request.json
-
-    user_id = json_body['session']['user_id']
-    session_obj = session.get(user_id)
-    dm_obj = dm.DialogManager(session_obj)
-
-    message = json_body['request']['command'].strip()
-    if not message:
-        message = json_body['request']['original_utterance']
-
-    dmresponse = dm_obj.handle_message(message)
-    response['response'] = {
-        'text': dmresponse.text,
-        'end_session': dmresponse.end_session,
-    }
-    if dmresponse.tts is not None:
-        response['response']['tts'] = dmresponse.tts
-
-    log.info('Response: %r', response)
-    return json.dumps(response)
+    with metrics.span('json_load'):
+        json_body = request.get_json()
+    response = handle_request(json_body)
+    with metrics.span('json_dump'):
+        return json.dumps(response)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+# coding: utf-8
+"""Асинхронный webhook для Яндекс.Диалогов на Twisted.
+
+    python -m seabattle.async_api --port 5000 --workers 8 --timeout 2.5
+
+Соединения обслуживает один поток с reactor, а разбор фразы и ход игры
+выполняются в пуле потоков или процессов, поэтому тысячи ожидающих
+запросов не занимают по потоку каждый. Контракт запроса и ответа тот же,
+что у api.py: оба сервера вызывают api.handle_request.
+
+Запрос, не уложившийся в --timeout, получает 504, но его задача в пуле
+доигрывает ход до конца. Алиса повторяет такой запрос с тем же
+message_id, и api.handle_request отвечает на повтор сохранённым ответом,
+не стреляя второй раз.
+
+С --executor process модель до fork готовится по правилам prefork:
+целиком прогревается только модель без TensorFlow, иначе процессы пула
+загружают её сами. Сессии чистит родитель, открывая базу после fork.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import functools
+import json
+import logging
+import os
+from concurrent import futures
+
+from twisted.internet import defer
+from twisted.web import resource, server
+
+from seabattle import metrics, prefork, session, startup
+from seabattle import dialog_manager as dm
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 2.5
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MAX_PENDING = 1000
+
+_worker_pid = None
+
+
+def _handle_request(json_body):
+    # api импортируется лениво: при импорте он запускает прогрев и чистку сессий в фоновых потоках
+    from seabattle import api
+    return api.handle_request(json_body)
+
+
+def _handle_in_process(json_body, warmup=False):
+    """Обработка запроса в процессе пула: после fork соединение с базой сессий и генераторы создаются заново"""
+    global _worker_pid
+    if _worker_pid != os.getpid():
+        _worker_pid = os.getpid()
+        prefork.after_fork(warmup=warmup)
+    return _handle_request(json_body)
+
+
+def deferred_from_future(future, reactor):
+    """Deferred, который сработает в потоке reactor, когда завершится future"""
+    d = defer.Deferred(lambda _: future.cancel())
+
+    def _resolve(f):
+        # по таймауту deferred уже отменён, а поток мог успеть доработать
+        if d.called:
+            return
+        error = f.exception()
+        if error is not None:
+            d.errback(error)
+        else:
+            d.callback(f.result())
+
+    def _done(f):
+        if not f.cancelled():
+            reactor.callFromThread(_resolve, f)
+
+    future.add_done_callback(_done)
+    return d
+
+
+class WebhookResource(resource.Resource):
+    """POST / – запрос Яндекс.Диалогов, GET /ready – готовность после прогрева, GET /metrics – метрики.
+
+    Одновременно выполняется не больше max_concurrency запросов, ещё
+    max_pending ждут своей очереди, остальным сразу отвечаем 503. Запрос,
+    не получивший ответа за timeout секунд, завершается с 504.
+    """
+
+    isLeaf = True
+
+    def __init__(self, executor, reactor, handler=_handle_request, timeout=DEFAULT_TIMEOUT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING):
+        resource.Resource.__init__(self)
+        self.executor = executor
+        self.reactor = reactor
+        self.handler = handler
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.semaphore = defer.DeferredSemaphore(max_concurrency)
+
+    def _reply(self, request, code, body):
+        request.setResponseCode(code)
+        request.setHeader(b'Content-Type', b'application/json')
+        with metrics.span('json_dump'):
+            data = json.dumps(body).encode('utf-8')
+        request.write(data)
+        request.finish()
+
+    def render_GET(self, request):
+        if request.postpath == [b'metrics']:
+            request.setHeader(b'Content-Type', metrics.CONTENT_TYPE.encode('ascii'))
+            return metrics.render().encode('utf-8')
+        if request.postpath not in ([b'ready'], [b'ready', b'']):
+            request.setResponseCode(404)
+            return b''
+        request.setResponseCode(200 if dm.is_ready() else 503)
+        request.setHeader(b'Content-Type', b'application/json')
+        return json.dumps(startup.timer.report()).encode('utf-8')
+
+    def render_POST(self, request):
+        try:
+            with metrics.span('json_load'):
+                json_body = json.loads(request.content.read().decode('utf-8'))
+        except ValueError:
+            request.setResponseCode(400)
+            return b''
+
+        if len(self.semaphore.waiting) >= self.max_pending:
+            log.warning('Too many pending requests, rejecting')
+            request.setResponseCode(503)
+            return b''
+
+        d = self.semaphore.run(self._execute, json_body)
+        d.addTimeout(self.timeout, self.reactor)
+
+        finished = []
+        request.notifyFinish().addBoth(finished.append)
+
+        def _ok(response):
+            if not finished:
+                self._reply(request, 200, response)
+
+        def _failed(failure):
+            if failure.check(defer.TimeoutError, defer.CancelledError):
+                log.warning('Request timed out after %.1fs', self.timeout)
+                code = 504
+            else:
+                log.error('Request failed: %s', failure.getTraceback())
+                code = 500
+            if not finished:
+                self._reply(request, code, {'error': code})
+
+        d.addCallbacks(_ok, _failed)
+        return server.NOT_DONE_YET
+
+    def _execute(self, json_body):
+        return deferred_from_future(self.executor.submit(self.handler, json_body), self.reactor)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Асинхронный webhook навыка для Яндекс.Диалогов')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread',
+                        help='где выполнять разбор фраз и ход игры')
+    parser.add_argument('--workers', type=int, default=8, help='размер пула потоков или процессов')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='секунд на один запрос')
+    parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING)
+    args = parser.parse_args(argv)
+
+    from twisted.internet import reactor
+
+    if args.executor == 'process':
+        if not os.environ.get('SESSION_DB'):
+            parser.error('--executor process needs SESSION_DB: memory sessions are not shared between processes')
+        # фоновые потоки api не переживают fork: модель готовит prepare_parent, сессии чистит родитель
+        os.environ['NLU_WARMUP'] = '0'
+        os.environ['SESSION_SWEEPER'] = '0'
+        from seabattle import api  # noqa: F401
+        worker_warmup = prefork.prepare_parent()
+        executor = futures.ProcessPoolExecutor(args.workers)
+        # пул запускает все процессы с первой задачей; база сессий в родителе открывается уже после fork
+        executor.submit(os.getpid).result()
+        session.start_sweeper()
+        handler = functools.partial(_handle_in_process, warmup=worker_warmup)
+    else:
+        from seabattle import api  # noqa: F401
+        executor = futures.ThreadPoolExecutor(args.workers)
+        handler = _handle_request
+
+    site = server.Site(WebhookResource(
+        executor, reactor, handler, timeout=args.timeout,
+        max_concurrency=args.max_concurrency, max_pending=args.max_pending,
+    ))
+    reactor.listenTCP(args.port, site)
+    reactor.addSystemEventTrigger('after', 'shutdown', executor.shutdown, False)
+    log.info('Listening on port %d with %d %s workers', args.port, args.workers, args.executor)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+# coding: utf-8
+"""Микробенчмарки движка игры и диалогового менеджера.
+
+    python -m seabattle.benchmark --save baseline.json
+    python -m seabattle.benchmark --compare baseline.json --threshold 0.1 --threshold do_shot_density=0.2
+
+Для каждого бенчмарка заранее готовятся независимые входные данные
+(например, N свежих партий), и замеряется только сам вызов: лучший из
+нескольких повторов даёт число операций в секунду. Память считается
+через tracemalloc (Python 3) или, если его нет, как прирост числа
+объектов под сборщиком мусора на операцию.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import collections
+import contextlib
+import fnmatch
+import gc
+import io
+import json
+import platform
+import sys
+import time
+
+from seabattle import placement
+from seabattle.game import BaseGame, DensityGame, Game, SHIP, HIT
+from seabattle.strategy import Strategy
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'setup', 'func', 'max_ops', 'context'])
+Benchmark.__new__.__defaults__ = (None, None)
+
+# партии готовятся дольше, чем делается выстрел, поэтому их число ограничено
+GAMES_MAX_OPS = 2000
+
+BENCHMARKS = []
+
+
+def benchmark(name, setup, max_ops=None, context=None):
+    """Регистрирует бенчмарк: setup(n) возвращает n входов, декорированная функция обрабатывает один.
+
+    context() – контекстный менеджер, внутри которого идут и подготовка, и замеры.
+    """
+    def register(func):
+        BENCHMARKS.append(Benchmark(name, setup, func, max_ops, context))
+        return func
+    return register
+
+
+def _positions(n):
+    positions = ['1 2', '10 10', 'восемь четыре', '7 10', 'два десять']
+    game = BaseGame()
+    return [(game, positions[i % len(positions)]) for i in range(n)]
+
+
+@benchmark('convert_to_position', _positions)
+def _convert_to_position(args):
+    game, position = args
+    game.convert_to_position(position)
+
+
+def _dead_ship(n):
+    game = BaseGame()
+    game.start_new_game(10, placement.generate_field(10, game.default_ships))
+    ship = [i for i, v in enumerate(game.field) if v == SHIP]
+    for i in ship:
+        game.field[i] = HIT
+    return [(game, ship[i % len(ship)]) for i in range(n)]
+
+
+@benchmark('is_dead_ship', _dead_ship)
+def _is_dead_ship(args):
+    game, index = args
+    game.is_dead_ship(index)
+
+
+@benchmark('generate_field', lambda n: [None] * n)
+def _generate_field(_):
+    placement.generate_field(10, BaseGame.default_ships)
+
+
+@benchmark('strategy_init', lambda n: [None] * n)
+def _strategy_init(_):
+    Strategy(10, 4)
+
+
+@benchmark('new_game', lambda n: [None] * n)
+def _new_game(_):
+    Game()
+
+
+def _games(n, game_class=Game, prepare=None):
+    games = []
+    for _ in range(n):
+        game = game_class()
+        game.start_new_game(10, placement.generate_field(10, game.default_ships), numbers=True)
+        if prepare is not None:
+            prepare(game)
+        games.append(game)
+    return games
+
+
+def _after_hit(game):
+    game.do_shot()
+    game.handle_enemy_reply('hit')
+
+
+def _one_decker(game):
+    game.strategy = game.one_decker_strategy
+
+
+def _late_game(game):
+    # конец партии: случайные выстрелы по последним двадцати клеткам
+    game.strategy = game.one_decker_strategy
+    for _ in range(80):
+        game.do_shot()
+        game.handle_enemy_reply('miss')
+
+
+@benchmark('do_shot_strategy', _games, GAMES_MAX_OPS)
+def _do_shot(game):
+    game.do_shot()
+
+
+@benchmark('do_shot_damaged', lambda n: _games(n, prepare=_after_hit), GAMES_MAX_OPS)
+def _do_shot_damaged(game):
+    game.do_shot()
+
+
+@benchmark('do_shot_random', lambda n: _games(n, prepare=_one_decker), GAMES_MAX_OPS)
+def _do_shot_random(game):
+    game.do_shot()
+
+
+@benchmark('do_shot_density', lambda n: _games(n, DensityGame), GAMES_MAX_OPS)
+def _do_shot_density(game):
+    game.do_shot()
+
+
+@benchmark('do_shot_late', lambda n: _games(n, prepare=_late_game), GAMES_MAX_OPS)
+def _do_shot_late(game):
+    game.do_shot()
+
+
+class _StubRouter(object):
+    """Роутер с готовым ответом вместо модели rasa"""
+
+    def extract(self, data):
+        return {'text': data['q']}
+
+    def parse(self, data):
+        return {
+            'text': data['text'],
+            'intent': {'name': 'miss', 'confidence': 0.95},
+            'entities': [{'entity': 'hit_entity', 'value': '5 5', 'start': 0, 'end': 3}],
+        }
+
+
+@contextlib.contextmanager
+def _stub_router():
+    """Роутер-заглушка и отключённый кэш NLU на время бенчмарка"""
+    from seabattle import dialog_manager as dm
+
+    router, cache = dm._router, dm.parse_cache
+    dm._router, dm.parse_cache = _StubRouter(), None
+    try:
+        yield
+    finally:
+        dm._router, dm.parse_cache = router, cache
+
+
+def _sessions(n):
+    sessions = []
+    for game in _games(n):
+        game.do_shot()
+        sessions.append({'game': game, 'opponent': 'Алиса', 'last': None})
+    return sessions
+
+
+def _handle_message(session_obj, message):
+    from seabattle import dialog_manager as dm
+
+    dm.DialogManager(session_obj).handle_message(message)
+
+
+@benchmark('handle_message_fastpath', _sessions, GAMES_MAX_OPS, _stub_router)
+def _handle_message_fastpath(session_obj):
+    _handle_message(session_obj, 'мимо, я хожу 5 5')
+
+
+@benchmark('handle_message_router', _sessions, GAMES_MAX_OPS, _stub_router)
+def _handle_message_router(session_obj):
+    _handle_message(session_obj, 'ну мимо, а я тогда пять пять')
+
+
+def _measure_memory(func, inputs):
+    """Прирост памяти на операцию: байты по tracemalloc или объекты под gc"""
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for args in inputs:
+            func(args)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'kind': 'tracemalloc_bytes', 'per_op': (current - before) / len(inputs),
+                'peak_per_op': (peak - before) / len(inputs)}
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for args in inputs:
+            func(args)
+        after = len(gc.get_objects())
+    finally:
+        if enabled:
+            gc.enable()
+    return {'kind': 'gc_objects', 'per_op': (after - before) / len(inputs)}
+
+
+def _time(func, inputs):
+    started = time.time()
+    for args in inputs:
+        func(args)
+    return time.time() - started
+
+
+def run_benchmark(bench, min_time=0.2, repeat=5, max_ops=100000):
+    """Замеряет один бенчмарк; число операций подбирается так, чтобы повтор длился не меньше min_time"""
+    if bench.context is not None:
+        with bench.context():
+            return run_benchmark(bench._replace(context=None), min_time, repeat, max_ops)
+
+    max_ops = bench.max_ops or max_ops
+    n = 10
+    while True:
+        elapsed = _time(bench.func, bench.setup(n))
+        if elapsed >= min_time or n >= max_ops:
+            break
+        n = min(max_ops, max(n * 2, int(n * min_time / max(elapsed, 1e-6) * 1.2)))
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, _time(bench.func, bench.setup(n)))
+
+    return {
+        'ops': n,
+        'ops_per_sec': n / best if best else float('inf'),
+        'mean_us': best / n * 1e6,
+        'memory': _measure_memory(bench.func, bench.setup(min(n, 1000))),
+    }
+
+
+def run(patterns=None, min_time=0.2, repeat=5, out=None):
+    results = collections.OrderedDict()
+    for bench in BENCHMARKS:
+        if patterns and not any(fnmatch.fnmatch(bench.name, p) for p in patterns):
+            continue
+        results[bench.name] = result = run_benchmark(bench, min_time, repeat)
+        if out is not None:
+            print('%-26s %12.0f ops/s %10.2f us/op %10.1f %s/op' % (
+                bench.name, result['ops_per_sec'], result['mean_us'],
+                result['memory']['per_op'], result['memory']['kind']), file=out)
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine()}
+
+
+def save(path, results):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'environment': environment(), 'results': results}, indent=2, ensure_ascii=False))
+
+
+def load(path):
+    with io.open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline, results, threshold=0.1, thresholds=None):
+    """Сравнивает ops/sec с базовыми. Возвращает (строки отчёта, список регрессий)"""
+    thresholds = thresholds or {}
+    lines = []
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            lines.append('%-26s new' % name)
+            continue
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        limit = thresholds.get(name, threshold)
+        status = 'ok'
+        if change < -limit:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif change > limit:
+            status = 'faster'
+        lines.append('%-26s %12.0f -> %12.0f ops/s %+7.1f%% (limit -%.0f%%) %s' % (
+            name, base['ops_per_sec'], result['ops_per_sec'], change * 100, limit * 100, status))
+    return lines, regressions
+
+
+def _parse_thresholds(values):
+    default = 0.1
+    per_name = {}
+    for value in values or []:
+        name, sep, limit = value.rpartition('=')
+        if sep:
+            per_name[name] = float(limit)
+        else:
+            default = float(limit)
+    return default, per_name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Микробенчмарки игры и диалогового менеджера')
+    parser.add_argument('patterns', nargs='*', help='имена бенчмарков, можно с * и ?')
+    parser.add_argument('--min-time', type=float, default=0.2, help='секунд на один повтор')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='сохранить результаты в JSON как базовые')
+    parser.add_argument('--compare', help='сравнить с базовыми результатами из JSON')
+    parser.add_argument('--threshold', action='append',
+                        help='допустимое замедление: 0.1 для всех или name=0.2 для одного бенчмарка')
+    args = parser.parse_args(argv)
+
+    results = run(args.patterns, args.min_time, args.repeat, out=sys.stdout)
+    if args.save:
+        save(args.save, results)
+    if args.compare:
+        default, per_name = _parse_thresholds(args.threshold)
+        lines, regressions = compare(load(args.compare), results, default, per_name)
+        print('\n'.join(lines))
+        if regressions:
+            print('Regressions: %s' % ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import collections
+
+
+Masks = collections.namedtuple('Masks', ['full', 'rows', 'cols', 'neighbours', 'line_neighbours'])
+
+_masks_cache = {}
+
+
+def get_masks(size):
+    """Возвращает предпосчитанные маски для поля заданного размера.
+
+    rows[y] и cols[x] – маски строк и столбцов (нумерация с нуля),
+    neighbours[i] – все восемь соседей клетки i,
+    line_neighbours[i] – только соседи по горизонтали и вертикали.
+    """
+    masks = _masks_cache.get(size)
+    if masks is not None:
+        return masks
+
+    rows = []
+    cols = []
+    for i in range(size):
+        rows.append(sum(1 << (i * size + x) for x in range(size)))
+        cols.append(sum(1 << (y * size + i) for y in range(size)))
+
+    neighbours = []
+    line_neighbours = []
+    for index in range(size ** 2):
+        x, y = index % size, index // size
+        mask = line_mask = 0
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = x + dx, y + dy
+                if (dx, dy) == (0, 0) or not (0 <= nx < size and 0 <= ny < size):
+                    continue
+                bit = 1 << (ny * size + nx)
+                mask |= bit
+                if dx == 0 or dy == 0:
+                    line_mask |= bit
+        neighbours.append(mask)
+        line_neighbours.append(line_mask)
+
+    masks = Masks(
+        full=(1 << size ** 2) - 1,
+        rows=tuple(rows),
+        cols=tuple(cols),
+        neighbours=tuple(neighbours),
+        line_neighbours=tuple(line_neighbours),
+    )
+    _masks_cache[size] = masks
+    return masks
+
+
+def iter_bits(mask):
+    """Перебирает индексы установленных битов маски"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitField(object):
+    """Игровое поле в виде набора битовых масок, по одной на каждое состояние клетки.
+
+    Снаружи ведёт себя как список: поддерживает индексацию, срезы, len и итерацию,
+    поэтому код, работающий со списком, продолжает работать без изменений.
+    Состояние 0 (пустая клетка) отдельной маски не имеет.
+    """
+
+    __slots__ = ('size', 'planes')
+
+    def __init__(self, size, planes=None):
+        self.size = size
+        self.planes = list(planes) if planes is not None else [0] * 5
+
+    @classmethod
+    def from_list(cls, size, values):
+        field = cls(size)
+        for index, value in enumerate(values):
+            if value:
+                field.planes[value] |= 1 << index
+        return field
+
+    def copy(self):
+        return BitField(self.size, self.planes)
+
+    def plane(self, value):
+        return self.planes[value]
+
+    def occupied(self):
+        mask = 0
+        for plane in self.planes[1:]:
+            mask |= plane
+        return mask
+
+    def set_mask(self, value, mask):
+        """Переводит все клетки маски в состояние value"""
+        for i in range(1, len(self.planes)):
+            if i != value:
+                self.planes[i] &= ~mask
+        if value:
+            self.planes[value] |= mask
+
+    def _get(self, index):
+        bit = 1 << index
+        for value in range(1, len(self.planes)):
+            if self.planes[value] & bit:
+                return value
+        return 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('BitField index out of range')
+        return self._get(index)
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('BitField assignment index out of range')
+        self.set_mask(value, 1 << index)
+
+    def __len__(self):
+        return self.size ** 2
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._get(index)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'BitField(%d, %r)' % (self.size, list(self))
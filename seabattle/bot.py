@@ -1,36 +1,59 @@
 # coding: utf-8
+"""Telegram бот для тестирования навыка.
+
+    TELEGRAM_TOKEN=... python -m seabattle.bot
+
+Получает обновления опросом (long polling). Webhook с параллельной
+обработкой чатов – в bot_webhook.py.
+"""
 
 from __future__ import unicode_literals
 
 import logging
 import os
 
-from telegram import ext as telegram_ext
-
 from seabattle import dialog_manager as dm
 from seabattle import session
 
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG
-)
 logger = logging.getLogger(__name__)
 
 
+def handle_text(chat_id, text):
+    """Ход диалога в чате chat_id; возвращает текст ответа"""
+    with session.locked(chat_id):
+        session_obj = session.get(chat_id)
+        dm_obj = dm.DialogManager(session_obj)
+        dmresponse = dm_obj.handle_message(text)
+        session.save(chat_id, session_obj)
+    return dmresponse.text
+
+
 def bot_handler(bot, update):
-    session_obj = session.get(update.message.chat_id)
-    dm_obj = dm.DialogManager(session_obj)
-    dmresponse = dm_obj.handle_message(update.message.text)
-    bot.send_message(chat_id=update.message.chat_id, text=dmresponse.text)
+    text = handle_text(update.message.chat_id, update.message.text)
+    bot.send_message(chat_id=update.message.chat_id, text=text)
 
 
 def error_handler(bot, update, error):
-    logger.error('Update "{0}" caused error "{1}"', update, error)
+    logger.error('Update "%s" caused error "%s"', update, error)
+
+
+def main():
+    from telegram import ext as telegram_ext
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.DEBUG
+    )
+    session.start_sweeper()
+    dm.warmup()
+    updater = telegram_ext.Updater(token=os.environ.get('TELEGRAM_TOKEN'))
+    dispatcher = updater.dispatcher
+    dispatcher.add_handler(telegram_ext.MessageHandler(telegram_ext.Filters.text, bot_handler))
+    dispatcher.add_error_handler(error_handler)
+    updater.start_polling()
+    updater.idle()
 
 
-updater = telegram_ext.Updater(token=os.environ.get('TELEGRAM_TOKEN'))
-dispatcher = updater.dispatcher
-dispatcher.add_handler(telegram_ext.MessageHandler(telegram_ext.Filters.text, bot_handler))
-updater.start_polling()
-updater.idle()
+if __name__ == '__main__':
+    main()
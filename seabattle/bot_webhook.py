@@ -0,0 +1,244 @@
+# coding: utf-8
+"""Telegram бот через webhook.
+
+    TELEGRAM_TOKEN=... python -m seabattle.bot_webhook --url https://example.com --port 8443 --workers 8
+
+Обновления принимает Twisted и сразу отвечает Telegram 200, а обработка
+идёт в пуле потоков: сообщения одного чата выполняются строго по
+порядку, разные чаты – параллельно, так что медленный разбор фразы в
+одном чате не задерживает остальные. Ответы уходят через пул постоянных
+HTTP соединений с Bot API.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import binascii
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from concurrent import futures
+
+try:
+    from http import client as http_client
+    from urllib.parse import urlparse
+    import queue
+except ImportError:
+    import httplib as http_client
+    from urlparse import urlparse
+    import Queue as queue
+
+from twisted.web import resource, server
+
+from seabattle import bot, metrics, session
+from seabattle import dialog_manager as dm
+
+
+log = logging.getLogger(__name__)
+
+API_URL = 'https://api.telegram.org'
+
+UPDATES = metrics.Counter('seabattle_telegram_updates_total', 'Обновления Telegram', ['status'])
+UPDATE_SECONDS = metrics.Histogram('seabattle_telegram_update_seconds',
+                                   'Время от получения обновления до отправки ответа')
+
+
+class TelegramError(Exception):
+    pass
+
+
+class TelegramClient(object):
+    """Вызовы Bot API через пул постоянных соединений, безопасно из разных потоков"""
+
+    def __init__(self, token, api_url=API_URL, pool_size=8, timeout=10):
+        parsed = urlparse(api_url)
+        self.connection_class = http_client.HTTPSConnection if parsed.scheme == 'https' else http_client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = '%s/bot%s/' % (parsed.path.rstrip('/'), token)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(pool_size)
+
+    def _connection(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def call(self, method, **params):
+        data = json.dumps(params).encode('utf-8')
+        connection = self._connection()
+        try:
+            connection.request('POST', self.path + method, data, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            payload = json.loads(response.read().decode('utf-8'))
+        except Exception:
+            # соединение могло остаться в непонятном состоянии
+            connection.close()
+            raise
+        self._release(connection)
+        if not payload.get('ok'):
+            raise TelegramError('%s failed: %s' % (method, payload.get('description')))
+        return payload.get('result')
+
+    def send_message(self, chat_id, text):
+        return self.call('sendMessage', chat_id=chat_id, text=text)
+
+    def set_webhook(self, url, max_connections=None):
+        # исправленное сообщение повторило бы старый ход против текущей партии
+        params = {'url': url, 'allowed_updates': ['message']}
+        if max_connections is not None:
+            params['max_connections'] = max_connections
+        return self.call('setWebhook', **params)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ChatDispatcher(object):
+    """Выполняет handler(chat_id, item) в пуле: по порядку внутри чата, параллельно между чатами.
+
+    У каждого чата своя очередь, и в пуле одновременно не больше одной
+    задачи на чат. Задача обрабатывает одно сообщение и, если в очереди
+    есть ещё, ставит себя в конец пула, чтобы длинная очередь одного чата
+    не занимала поток целиком.
+    """
+
+    def __init__(self, handler, workers=8, executor=None):
+        self.handler = handler
+        self.executor = executor or futures.ThreadPoolExecutor(workers)
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, chat_id, item):
+        with self._lock:
+            pending = self._queues.get(chat_id)
+            if pending is not None:
+                pending.append(item)
+                return
+            self._queues[chat_id] = collections.deque([item])
+        self.executor.submit(self._run, chat_id)
+
+    def _run(self, chat_id):
+        with self._lock:
+            item = self._queues[chat_id][0]
+        try:
+            self.handler(chat_id, item)
+        except Exception:
+            log.exception('Handler failed for chat %s', chat_id)
+        with self._lock:
+            pending = self._queues[chat_id]
+            pending.popleft()
+            if not pending:
+                del self._queues[chat_id]
+                if not self._queues:
+                    self._idle.notify_all()
+                return
+        self.executor.submit(self._run, chat_id)
+
+    def pending(self):
+        with self._lock:
+            return sum(len(pending) for pending in self._queues.values())
+
+    def shutdown(self, wait=True):
+        """Останавливает пул; с wait=True сначала дожидается всех принятых сообщений"""
+        if wait:
+            with self._lock:
+                while self._queues:
+                    self._idle.wait()
+        self.executor.shutdown(wait=wait)
+
+
+def make_handler(client, reply=bot.handle_text, clock=time.time):
+    """Обработчик обновления: ход диалога и отправка ответа в тот же чат"""
+    def handle(chat_id, update):
+        received, message = update
+        text = reply(chat_id, message['text'])
+        client.send_message(chat_id, text)
+        UPDATE_SECONDS.observe(clock() - received)
+    return handle
+
+
+class WebhookResource(resource.Resource):
+    """POST /<secret> – обновление от Telegram; путь с секретом отсекает чужие запросы"""
+
+    isLeaf = True
+
+    def __init__(self, dispatcher, secret, clock=time.time):
+        resource.Resource.__init__(self)
+        self.dispatcher = dispatcher
+        self.secret = secret.encode('utf-8')
+        self.clock = clock
+
+    def render_POST(self, request):
+        if request.postpath != [self.secret]:
+            request.setResponseCode(404)
+            return b''
+        try:
+            update = json.loads(request.content.read().decode('utf-8'))
+        except ValueError:
+            request.setResponseCode(400)
+            return b''
+
+        message = update.get('message')
+        if not message or not message.get('text'):
+            UPDATES.inc(['ignored'])
+            return b''
+        UPDATES.inc(['accepted'])
+        self.dispatcher.submit(message['chat']['id'], (self.clock(), message))
+        return b''
+
+    def render_GET(self, request):
+        if request.postpath == [b'metrics']:
+            request.setHeader(b'Content-Type', metrics.CONTENT_TYPE.encode('ascii'))
+            return metrics.render().encode('utf-8')
+        request.setResponseCode(404)
+        return b''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Telegram бот навыка через webhook')
+    parser.add_argument('--url', help='внешний адрес сервера для setWebhook, например https://example.com')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--workers', type=int, default=8, help='потоков для обработки сообщений')
+    parser.add_argument('--pool-size', type=int, default=8, help='постоянных соединений с Bot API')
+    parser.add_argument('--api-url', default=API_URL, help='адрес Bot API, например локальный фейк для тестов')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    token = os.environ['TELEGRAM_TOKEN']
+    # секрет в пути не совпадает с токеном, чтобы токен не попадал в логи прокси
+    secret = os.environ.get('TELEGRAM_WEBHOOK_SECRET') or binascii.hexlify(os.urandom(16)).decode('ascii')
+
+    from twisted.internet import reactor
+
+    session.start_sweeper()
+    dm.warmup()
+    client = TelegramClient(token, args.api_url, pool_size=args.pool_size)
+    dispatcher = ChatDispatcher(make_handler(client), workers=args.workers)
+    if args.url:
+        client.set_webhook('%s/%s' % (args.url.rstrip('/'), secret), max_connections=args.workers * 5)
+
+    reactor.listenTCP(args.port, server.Site(WebhookResource(dispatcher, secret)))
+    reactor.addSystemEventTrigger('after', 'shutdown', dispatcher.shutdown, False)
+    reactor.addSystemEventTrigger('after', 'shutdown', client.close)
+    log.info('Listening on port %d with %d workers', args.port, args.workers)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# coding: utf-8
+"""Словарь координат клетки во всех произносимых формах.
+
+Все варианты, которыми пользователь называет клетку («д 5», «d5», «дэ
+пять», «5 5», «уже 4»), собираются в таблицы один раз на размер поля
+(get_lexicon), поэтому разбор координаты – это поиск в словаре. Слова, которых нет в
+словаре, ищутся среди форм на расстоянии одной правки (ошибки
+распознавания речи вроде «чатыре» или «пят»). Строки ответа и TTS для
+каждой клетки тоже готовятся заранее.
+"""
+
+from __future__ import unicode_literals
+
+import re
+import string
+
+from transliterate import translit
+
+
+MAX_SIZE = 10
+
+LETTERS = ['а', 'б', 'в', 'г', 'д', 'е', 'ж', 'з', 'и', 'к']
+NUMBERS = ['один', 'два', 'три', 'четыре', 'пять', 'шесть', 'семь', 'восемь', 'девять', 'десять']
+
+# особые случаи неправильного распознавания STT
+LETTERS_MAPPING = {
+    'the': 'з',
+    'за': 'з',
+    'уже': 'ж',
+    'трень': '3',
+}
+
+# другие формы чисел и названия букв
+NUMBER_FORMS = {
+    'одна': 1, 'раз': 1, 'две': 2,
+}
+LETTER_NAMES = {
+    'бэ': 2, 'вэ': 3, 'гэ': 4, 'дэ': 5, 'жэ': 7, 'зэ': 8, 'ка': 10,
+}
+
+# нечёткий поиск только для длинных слов: короткие отличаются друг от друга одной буквой
+FUZZY_MIN_LENGTH = 3
+FUZZY_MIN_FORM_LENGTH = 4
+
+_GLUED = re.compile(r'^([a-zа-я]+)(\d+)$', re.UNICODE)
+
+
+def _deletes(word):
+    return set(word[:i] + word[i + 1:] for i in range(len(word)))
+
+
+class _Axis(object):
+    """Формы одной координаты: точный словарь и индекс удалений для нечёткого поиска"""
+
+    def __init__(self, forms):
+        self.forms = forms
+        self.fuzzy = {}
+        for form, value in forms.items():
+            if len(form) < FUZZY_MIN_FORM_LENGTH or form.isdigit():
+                continue
+            for key in _deletes(form) | {form}:
+                self.fuzzy.setdefault(key, set()).add(value)
+
+    def lookup(self, word):
+        value = self.forms.get(word)
+        if value is not None or len(word) < FUZZY_MIN_LENGTH:
+            return value
+        # замена, вставка или удаление одной буквы: у слова и формы есть общий вариант без одной буквы
+        values = set()
+        for key in _deletes(word) | {word}:
+            values |= self.fuzzy.get(key, set())
+        if len(values) == 1:
+            return values.pop()
+        return None
+
+
+class Lexicon(object):
+    def __init__(self, size=MAX_SIZE):
+        self.size = size
+
+        numbers = {}
+        for n in range(1, size + 1):
+            numbers['%d' % n] = n
+            numbers[NUMBERS[n - 1]] = n
+        numbers.update((word, n) for word, n in NUMBER_FORMS.items() if n <= size)
+
+        letters = {}
+        for n, letter in enumerate(LETTERS[:size], 1):
+            letters[letter] = n
+        letters.update((word, n) for word, n in LETTER_NAMES.items() if n <= size)
+        # латинские буквы, которые translit переводит в буквы поля
+        for latin in list(string.ascii_lowercase) + ['zh']:
+            cyrillic = translit(latin, 'ru')
+            if cyrillic in letters:
+                letters[latin] = letters[cyrillic]
+
+        for word, target in LETTERS_MAPPING.items():
+            for forms in (numbers, letters):
+                if target in forms:
+                    forms[word] = forms[target]
+
+        self.x = _Axis(dict(letters, **numbers))
+        self.y = _Axis(numbers)
+
+        self.phrases = {}
+        for x_word, x in self.x.forms.items():
+            for y_word, y in self.y.forms.items():
+                self.phrases['%s %s' % (x_word, y_word)] = (x, y)
+                if y_word.isdigit() and not x_word.isdigit():
+                    self.phrases['%s%s' % (x_word, y_word)] = (x, y)
+
+        self.texts = {}
+        self.tts = {}
+        for x in range(1, size + 1):
+            for y in range(1, size + 1):
+                for numbers_flag in (True, False):
+                    text = '%s, %s' % (x if numbers_flag else LETTERS[x - 1], y)
+                    self.texts[(x, y), numbers_flag] = text
+                    self.tts[text] = text.replace(', ', ' - - - - ')
+
+    def words(self):
+        """Все точные формы координат"""
+        return set(self.x.forms) | set(self.y.forms)
+
+    def parse(self, position):
+        """Координаты (x, y) по тексту; ValueError, если текст не разобран"""
+        position = position.lower().strip()
+        result = self.phrases.get(position)
+        if result is not None:
+            return result
+
+        bits = position.split()
+        if len(bits) == 1:
+            match = _GLUED.match(position)
+            bits = match.groups() if match is not None else bits
+        if len(bits) != 2:
+            raise ValueError('Can\'t parse entire position: %s' % position)
+
+        x = self.x.lookup(bits[0])
+        if x is None:
+            raise ValueError('Can\'t parse X point: %s' % bits[0])
+        y = self.y.lookup(bits[1])
+        if y is None:
+            raise ValueError('Can\'t parse Y point: %s' % bits[1])
+        return x, y
+
+    def render(self, position, numbers=False):
+        """Текст выстрела: «5, 7» или «д, 7»"""
+        text = self.texts.get((tuple(position), bool(numbers)))
+        if text is None:
+            raise ValueError('Wrong position: %s %s' % tuple(position))
+        return text
+
+    def render_tts(self, text):
+        return self.tts.get(text) or text.replace(', ', ' - - - - ')
+
+
+LEXICON = Lexicon()
+_lexicons = {MAX_SIZE: LEXICON}
+
+
+def get_lexicon(size=MAX_SIZE):
+    """Словарь координат поля size × size; строится один раз для каждого размера"""
+    lexicon = _lexicons.get(size)
+    if lexicon is None:
+        lexicon = _lexicons.setdefault(size, Lexicon(size))
+    return lexicon
@@ -3,16 +3,36 @@
 from __future__ import unicode_literals
 
 import collections
+import io
 import json
 import logging
+import os
+import threading
 
-from rasa_nlu.data_router import DataRouter
-
-from seabattle import game
+from seabattle import coordinates, fastpath, game, metrics, nlu_batch, nlu_cache, startup
 
 
 log = logging.getLogger(__name__)
-router = DataRouter('mldata/')
+MODEL_DIR = 'mldata/'
+parse_cache = nlu_cache.from_env(MODEL_DIR)
+# размер пачки для одновременных запросов, 1 – разбирать фразы по одной
+BATCH_SIZE = int(os.environ.get('NLU_BATCH_SIZE', 1))
+BATCH_WAIT = float(os.environ.get('NLU_BATCH_WAIT_MS', 5)) / 1000
+# перебор расстановок в конце партии (endgame.py), 1 – включить
+ENDGAME = os.environ.get('ENDGAME', '0') == '1'
+# артефакт seabattle.nlu_export: фразы разбираются на numpy без rasa_nlu
+NLU_ARTIFACT = os.environ.get('NLU_ARTIFACT')
+# фразы для прогрева: первая загружает модель, остальные проходят все ветки пайплайна
+WARMUP_MESSAGES = [
+    'новая игра c алисой',
+    'начинай',
+    'мимо я хожу д пять',
+    'я хожу 7 10',
+    'ты попала',
+    'корабль утонул',
+    'не поняла повтори последний ход',
+    'ура победа',
+]
 MESSAGE_TEMPLATES = {
     'miss': 'Мимо. Я хожу %(shot)s',
     'hit': 'Ты попала',
@@ -31,6 +51,11 @@ TTS_TEMPLATES = {
 }
 DMResponse = collections.namedtuple('DMResponse', ['key', 'text', 'tts', 'end_session'])
 
+INTENTS = metrics.Counter('seabattle_intents_total', 'Распознанные интенты', ['intent', 'source'])
+CONFIDENCE = metrics.Histogram('seabattle_intent_confidence', 'Уверенность в интенте', ['source'],
+                               buckets=(0.5, 0.8, 0.9, 0.95, 0.99, 1.0))
+RESPONSES = metrics.Counter('seabattle_responses_total', 'Ответы навыка по типу, в том числе dontunderstand', ['key'])
+
 
 def _get_entity(entities, entity_type):
     for e in entities:
@@ -44,8 +69,134 @@ def _get_entity(entities, entity_type):
         return None
 
 
+_router = None
+_router_lock = threading.Lock()
+# ComponentBuilder rasa_nlu с заранее загруженным spaCy (preload_spacy) или None
+_component_builder = None
+
+
+def model_pipelines(path=None, project='default'):
+    """[(каталог модели, pipeline из её metadata.json)] для всех моделей проекта"""
+    project_dir = os.path.join(path or MODEL_DIR, project)
+    if not os.path.isdir(project_dir):
+        return []
+    result = []
+    for name in sorted(os.listdir(project_dir)):
+        metadata = os.path.join(project_dir, name, 'metadata.json')
+        if os.path.isfile(metadata):
+            with io.open(metadata, encoding='utf-8') as f:
+                result.append((os.path.join(project_dir, name), json.load(f).get('pipeline', [])))
+    return result
+
+
+def preload_spacy():
+    """Загружает spaCy всех моделей в общий ComponentBuilder, не создавая сессий TensorFlow.
+
+    DataRouter, созданный позже (например, в воркере после fork), возьмёт
+    spaCy из кэша builder'а, а классификаторы, CRF и TensorFlow загрузит
+    сам. Использует ComponentBuilder и Metadata rasa_nlu 0.12.
+    """
+    global _component_builder
+    components = startup.timer.import_module('rasa_nlu.components')
+    model = startup.timer.import_module('rasa_nlu.model')
+    builder = components.ComponentBuilder(use_cache=True)
+    with startup.timer.phase('preload spaCy'):
+        for model_dir, pipeline in model_pipelines():
+            metadata = model.Metadata.load(model_dir)
+            for component_meta in pipeline:
+                if component_meta.get('name') != 'nlp_spacy':
+                    continue
+                component = builder.load_component(component_meta, model_dir, metadata)
+                # строки типовых фраз попадают в словарь spaCy до fork, и эти страницы остаются общими
+                for message in WARMUP_MESSAGES:
+                    component.nlp(message.lower())
+    _component_builder = builder
+
+
+def get_router():
+    """DataRouter создаётся при первом обращении, чтобы импорт модуля не тянул rasa_nlu.
+
+    С NLU_ARTIFACT вместо него загружается numpy_nlu.NumpyRouter.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None and NLU_ARTIFACT:
+                numpy_nlu = startup.timer.import_module('seabattle.numpy_nlu')
+                with startup.timer.phase('load numpy model'):
+                    _router = numpy_nlu.NumpyRouter(NLU_ARTIFACT)
+            if _router is None:
+                startup.timer.import_module('tensorflow', optional=True)
+                startup.timer.import_module('spacy', optional=True)
+                data_router = startup.timer.import_module('rasa_nlu.data_router')
+                with startup.timer.phase('create DataRouter'):
+                    _router = data_router.DataRouter(MODEL_DIR, component_builder=_component_builder)
+    return _router
+
+
+def warmup(messages=None):
+    """Загружает модель и прогоняет типовые фразы, после чего навык считается готовым"""
+    messages = messages or WARMUP_MESSAGES
+    get_router()
+    with startup.timer.phase('load model'):
+        _router_parse(messages[0])
+    with startup.timer.phase('warmup %d queries' % (len(messages) - 1)):
+        if BATCH_SIZE > 1:
+            nlu_batch.router_parse_batch(get_router(), messages[1:])
+        else:
+            for message in messages[1:]:
+                _router_parse(message)
+    startup.timer.mark_ready()
+
+
+def is_ready():
+    return startup.timer.ready
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def reset_after_fork():
+    """Поток MicroBatcher не переживает fork: в новом процессе он создаётся заново"""
+    global _batcher, _batcher_lock
+    _batcher = None
+    _batcher_lock = threading.Lock()
+
+
+def _parse_batch(messages):
+    return nlu_batch.router_parse_batch(get_router(), messages)
+
+
+def get_batcher():
+    """MicroBatcher для разбора одновременных запросов пачкой или None, если пачки выключены"""
+    global _batcher
+    if _batcher is None and BATCH_SIZE > 1:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = nlu_batch.MicroBatcher(_parse_batch, BATCH_SIZE, BATCH_WAIT)
+    return _batcher
+
+
+metrics.Gauge('seabattle_nlu_cache_hits', 'Ответы NLU из кэша',
+              lambda: parse_cache.hits if parse_cache is not None else None)
+metrics.Gauge('seabattle_nlu_cache_misses', 'Фразы, которых не было в кэше NLU',
+              lambda: parse_cache.misses if parse_cache is not None else None)
+metrics.Gauge('seabattle_nlu_cache_size', 'Фраз в кэше NLU',
+              lambda: len(parse_cache) if parse_cache is not None else None)
+
+
+def _router_parse(message):
+    batcher = get_batcher()
+    if batcher is not None:
+        return batcher.parse(message)
+    router = get_router()
+    data = router.extract({'q': message})
+    return router.parse(data)
+
+
 def _shot_to_tts(shot):
-    return shot.replace(', ', ' - - - - ')
+    return coordinates.LEXICON.render_tts(shot)
 
 
 class DialogManager(object):
@@ -83,7 +234,7 @@ class DialogManager(object):
         )
 
     def _handle_newgame(self, message, entities):
-        self.game = game.Game()
+        self.game = game.Game(endgame=ENDGAME)
         self.game.reset_last_shot()
         self.session['game'] = self.game
         self.game.start_new_game(numbers=True)
@@ -169,26 +320,42 @@ class DialogManager(object):
         self.session['last'] = self.last = dmresponse
 
     def handle_message(self, message):
-        data = router.extract({'q': message})
-        router_response = router.parse(data)
+        source = 'fastpath'
+        with metrics.span('fastpath'):
+            router_response = fastpath.parse(message)
+        if router_response is None:
+            source = 'rasa'
+            with metrics.span('nlu'):
+                if parse_cache is not None:
+                    router_response = parse_cache.parse(message, _router_parse)
+                else:
+                    router_response = _router_parse(message)
         log.info('Router response %s', json.dumps(router_response, indent=2))
 
-        if router_response['intent']['confidence'] < 0.8:
+        intent_name = router_response['intent']['name']
+        confidence = router_response['intent']['confidence']
+        INTENTS.inc((intent_name, source))
+        CONFIDENCE.observe(confidence, (source,))
+
+        if confidence < 0.8:
             dmresponse = self._get_dmresponse_by_key('dontunderstand')
+            RESPONSES.inc((dmresponse.key,))
             return dmresponse
 
-        intent_name = router_response['intent']['name']
         entities = router_response['entities']
         handler_method = getattr(self, '_handle_' + intent_name)
-        dmresponse = handler_method(message, entities)
+        with metrics.span('game'):
+            dmresponse = handler_method(message, entities)
+        RESPONSES.inc((dmresponse.key,))
         if dmresponse.key != 'dontunderstand':
             # сохраняем только последний осмысленный ответ в сессии не затыкались после нескольких повтори
             self._update_session(dmresponse)
 
         if self.session.get('game') is not None:
-            log.info('My field:')
-            self.session['game'].print_field()
-            log.info('Enemy field:')
-            self.session['game'].print_enemy_field()
+            with metrics.span('field_dump'):
+                log.info('My field:')
+                self.session['game'].print_field()
+                log.info('Enemy field:')
+                self.session['game'].print_enemy_field()
 
         return dmresponse
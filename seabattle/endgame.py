@@ -0,0 +1,258 @@
+# coding: utf-8
+"""Точная игра в конце партии.
+
+Когда кораблей и неоткрытых клеток остаётся мало, EndgameStrategy
+перебирает все расстановки оставшихся кораблей, совместимые с полем
+противника: каждая расстановка – набор масок из placement.get_placements,
+корабли не касаются друг друга и закрытых клеток. Выстрел выбирается так,
+чтобы минимизировать ожидаемое число выстрелов до конца партии: после
+выстрела расстановки делятся на исходы «мимо», «ранил» и «убил корабль M»,
+для каждого исхода задача решается рекурсивно.
+
+Полный перебор растёт экспоненциально, поэтому поиск идёт с
+ограничением глубины: за границей ожидаемое число выстрелов оценивается
+снизу числом ещё не подбитых клеток кораблей. Глубина увеличивается, пока
+не кончится время хода (budget секунд) или ответ не станет точным. На
+глубине 1 это выстрел в клетку, где корабль встречается чаще всего.
+
+Состояние (неоткрытые клетки, раненые клетки, длины кораблей) однозначно
+задаёт множество расстановок, поэтому результаты запоминаются по нему –
+общие для всех партий процесса – и переиспользуются на следующих ходах. Если кораблей, клеток или
+расстановок слишком много, стратегия возвращает None и Game стреляет по
+своей обычной стратегии.
+
+Выбор зависит от времени и от того, что уже запомнено, поэтому партия,
+восстановленная из snapshot, может стрелять иначе, чем исходная.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import time
+
+from seabattle.bitboard import iter_bits
+from seabattle.placement import get_placements
+from seabattle.strategy import AbstractStrategy, Point
+
+
+MAX_SHIPS = 6
+MAX_CELLS = 60
+MAX_CONFIGURATIONS = 1000
+MAX_MEMO = 200000
+DEFAULT_BUDGET = float(os.environ.get('ENDGAME_BUDGET_MS', 20)) / 1000
+
+
+_memos = {}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+def configurations(size, unknown, hit, lengths, limit=MAX_CONFIGURATIONS):
+    """Все расстановки кораблей lengths, совместимые с полем.
+
+    unknown – маска неоткрытых клеток, hit – маска раненых, но не убитых
+    клеток. Корабль стоит только на этих клетках и хотя бы одной клеткой на
+    неоткрытой (целиком подбитый корабль был бы убит), раненые клетки все
+    покрыты. Возвращает список (маска всех кораблей, кортеж Placement) или
+    None, если оценка числа расстановок больше limit.
+    """
+    allowed = unknown | hit
+    groups = []
+    estimate = 1
+    for length in sorted(set(lengths), reverse=True):
+        candidates = [p for p in get_placements(size, length) if not p.ship & ~allowed and p.ship & unknown]
+        count = lengths.count(length)
+        estimate *= _binomial(len(candidates), count)
+        if estimate > limit:
+            return None
+        groups.append((candidates, count))
+
+    result = []
+
+    def place(group, start, left, ships, halo, placed):
+        if group == len(groups):
+            if not hit & ~ships:
+                result.append((ships, placed))
+            return
+        candidates, count = groups[group]
+        if not left:
+            place(group + 1, 0, groups[group + 1][1] if group + 1 < len(groups) else 0, ships, halo, placed)
+            return
+        # одинаковые корабли ставим по возрастанию номера положения, чтобы не считать перестановки
+        for i in range(start, len(candidates) - left + 1):
+            placement = candidates[i]
+            if placement.ship & halo:
+                continue
+            place(group, i + 1, left - 1, ships | placement.ship, halo | placement.halo, placed + (placement,))
+
+    if groups:
+        place(0, 0, groups[0][1], 0, 0, ())
+    else:
+        result.append((0, ()))
+    return result
+
+
+def _hit_counts(configs, unknown):
+    counts = {}
+    for ships, _ in configs:
+        for cell in iter_bits(ships & unknown):
+            counts[cell] = counts.get(cell, 0) + 1
+    return counts
+
+
+def _remove_length(lengths, length):
+    lengths = list(lengths)
+    lengths.remove(length)
+    return tuple(lengths)
+
+
+class Solver(object):
+    """Минимум ожидаемого числа выстрелов с запоминанием по состоянию.
+
+    memo хранит для состояния (значение, клетка, глубина); глубина None
+    означает точное значение.
+    """
+
+    def __init__(self, size, memo=None):
+        self.size = size
+        self.memo = memo if memo is not None else {}
+        self.deadline = None
+
+    def _lower_bound(self, hit, lengths):
+        # в каждую ещё не подбитую клетку кораблей придётся выстрелить хотя бы раз
+        return sum(lengths) - _popcount(hit)
+
+    def _outcomes(self, cell, hit, configs):
+        bit = 1 << cell
+        miss, damaged, kills = [], [], {}
+        for config in configs:
+            ships, placed = config
+            if not ships & bit:
+                miss.append(config)
+                continue
+            for placement in placed:
+                if placement.ship & bit:
+                    break
+            if placement.ship & ~(hit | bit):
+                damaged.append(config)
+            else:
+                rest = tuple(p for p in placed if p is not placement)
+                kills.setdefault(placement, []).append((ships & ~placement.ship, rest))
+        return miss, damaged, kills
+
+    def choose(self, unknown, hit, lengths, configs, budget):
+        """Лучшая клетка, найденная за budget секунд; глубина 1 считается всегда"""
+        self.deadline = None
+        _, cell, exact = self.solve(unknown, hit, lengths, configs, 1)
+        self.deadline = time.time() + budget
+        depth = 2
+        try:
+            while not exact:
+                _, cell, exact = self.solve(unknown, hit, lengths, configs, depth)
+                depth += 1
+        except _Timeout:
+            pass
+        return cell
+
+    def solve(self, unknown, hit, lengths, configs, depth=None):
+        """(ожидаемое число выстрелов, лучшая клетка, точно ли) при поиске на depth ходов вперёд.
+
+        Неточное значение – оценка снизу.
+        """
+        if not lengths:
+            return 0.0, None, True
+        if depth == 0:
+            return self._lower_bound(hit, lengths), None, False
+        key = (unknown, hit, lengths)
+        cached = self.memo.get(key)
+        if cached is not None and (cached[2] is None or depth is not None and cached[2] >= depth):
+            return cached[0], cached[1], cached[2] is None
+        if self.deadline is not None and time.time() > self.deadline:
+            raise _Timeout()
+        child_depth = depth - 1 if depth is not None else None
+
+        total = float(len(configs))
+        counts = _hit_counts(configs, unknown)
+        # клетки без кораблей ничего не дают: исход известен заранее
+        cells = sorted(counts, key=lambda c: (-counts[c], c))
+        best, best_cell, best_exact = float('inf'), None, False
+        for cell in cells:
+            bit = 1 << cell
+            miss, damaged, kills = self._outcomes(cell, hit, configs)
+            children = []
+            if miss:
+                children.append((len(miss) / total, unknown & ~bit, hit, lengths, miss))
+            if damaged:
+                children.append((len(damaged) / total, unknown & ~bit, hit | bit, lengths, damaged))
+            for placement, rest in kills.items():
+                length = _popcount(placement.ship)
+                children.append((len(rest) / total, unknown & ~placement.halo, hit & ~placement.ship,
+                                 _remove_length(lengths, length), rest))
+
+            # оценки снизу заменяются точными значениями, пока клетка ещё может оказаться лучше
+            bounds = [p * self._lower_bound(h, ls) for p, _, h, ls, _ in children]
+            value = 1.0 + sum(bounds)
+            if value >= best:
+                continue
+            exact = True
+            for (p, u, h, ls, child_configs), bound in zip(children, bounds):
+                child_value, _, child_exact = self.solve(u, h, ls, child_configs, child_depth)
+                value += p * child_value - bound
+                exact = exact and child_exact
+                if value >= best:
+                    break
+            else:
+                best, best_cell, best_exact = value, cell, exact
+
+        if len(self.memo) >= MAX_MEMO:
+            self.memo.clear()
+        self.memo[key] = (best, best_cell, None if best_exact else depth)
+        return best, best_cell, best_exact
+
+
+class EndgameStrategy(AbstractStrategy):
+    """Выстрел по перебору расстановок или None, если до конца партии ещё далеко"""
+
+    __slots__ = ('game', 'budget')
+
+    def __init__(self, game, budget=DEFAULT_BUDGET):
+        self.game = game
+        self.budget = budget
+
+    def get_shoot_point(self, free=None, min_length=1):
+        game = self.game
+        free = free if free is not None else game.free_cells
+        lengths = game.remaining_enemy_ships()
+        if not lengths or len(lengths) > MAX_SHIPS or len(free) > MAX_CELLS:
+            return None
+
+        size = game.size
+        unknown = 0
+        for index in free:
+            unknown |= 1 << index
+        hit = 0
+        if game.damaged_ship_strategy is not None:
+            for point in game.damaged_ship_strategy.ship:
+                hit |= 1 << game.calc_index(point)
+
+        configs = configurations(size, unknown, hit, lengths)
+        if not configs:
+            return None
+
+        cell = Solver(size, _memos.setdefault(size, {})).choose(unknown, hit, lengths, configs, self.budget)
+        if cell is None:
+            return None
+        return Point(cell % size + 1, cell // size + 1)
@@ -0,0 +1,271 @@
+# coding: utf-8
+"""Сравнение профилей pipeline NLU по точности и задержке.
+
+    python -m seabattle.evaluate config/nlu_config.yml config/nlu_config_lite.yml --folds 3 --batch-size 8 --workers 4
+
+Фразы из intents_config.json делятся на --folds частей с одинаковой
+долей каждого намерения. Для каждой части каждый профиль обучается на
+остальных и разбирает её пачками по --batch-size фраз в --workers
+потоках, как под нагрузкой (nlu_batch.interpreter_parse_batch). В отчёте
+для профиля – точность по намерениям, доля ответов с уверенностью ниже
+порога диалогового менеджера (они становятся dontunderstand), precision,
+recall и F1 сущностей по совпадению (тип, начало, конец) и p50/p95/p99
+задержки каждого компонента на фразу. Время пачки делится поровну между
+её фразами. Потоки делят GIL, поэтому для чистых цифр по компонентам
+нужен --workers 1.
+
+Обучение идёт через rasa_nlu 0.12 (Trainer.train).
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import collections
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+from concurrent import futures
+
+from seabattle import nlu_batch
+from seabattle.dialog_manager import WARMUP_MESSAGES
+from seabattle.simulate import percentile
+
+
+log = logging.getLogger(__name__)
+
+TOTAL = 'всего'
+# ниже этой уверенности dialog_manager отвечает dontunderstand
+CONFIDENCE_THRESHOLD = 0.8
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def stratified_folds(examples, folds=3, seed=0, label=None):
+    """[(обучающие, проверочные)] для каждой из folds частей с одинаковой долей каждого намерения.
+
+    label(example) – намерение примера, по умолчанию example.get('intent').
+    """
+    label = label or (lambda example: example.get('intent'))
+    groups = collections.defaultdict(list)
+    for example in examples:
+        groups[label(example)].append(example)
+
+    rng = random.Random(seed)
+    parts = [[] for _ in range(folds)]
+    offset = 0
+    for intent in sorted(groups, key=lambda i: i or ''):
+        group = groups[intent]
+        rng.shuffle(group)
+        # продолжаем с той части, где закончилось предыдущее намерение, чтобы части были ровнее
+        for i, example in enumerate(group):
+            parts[(offset + i) % folds].append(example)
+        offset += len(group)
+
+    return [([e for j, part in enumerate(parts) if j != i for e in part], parts[i]) for i in range(folds)]
+
+
+def _spans(entities):
+    return set((e.get('entity'), e.get('start'), e.get('end')) for e in entities or [])
+
+
+def _f1(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+class Scores(object):
+    """Точность намерений и совпадение сущностей по всем проверочным фразам"""
+
+    def __init__(self, threshold=CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self.intents = collections.defaultdict(lambda: [0, 0])
+        self.unsure = 0
+        self.entities = collections.defaultdict(lambda: [0, 0, 0])
+
+    def add(self, gold_intent, gold_entities, output):
+        intent = output.get('intent') or {}
+        counts = self.intents[gold_intent]
+        counts[0] += intent.get('name') == gold_intent
+        counts[1] += 1
+        if (intent.get('confidence') or 0.0) < self.threshold:
+            self.unsure += 1
+
+        gold, predicted = _spans(gold_entities), _spans(output.get('entities'))
+        for span in gold | predicted:
+            counts = self.entities[span[0]]
+            if span in gold and span in predicted:
+                counts[0] += 1
+            elif span in predicted:
+                counts[1] += 1
+            else:
+                counts[2] += 1
+
+    @property
+    def total(self):
+        return sum(total for _, total in self.intents.values())
+
+    def accuracy(self):
+        return sum(correct for correct, _ in self.intents.values()) / self.total if self.total else 0.0
+
+    def intent_accuracy(self):
+        return dict((intent, correct / total) for intent, (correct, total) in self.intents.items())
+
+    def unsure_rate(self):
+        return self.unsure / self.total if self.total else 0.0
+
+    def entity_scores(self):
+        """{тип: (precision, recall, f1)} и те же числа по всем сущностям вместе"""
+        per_entity = dict((entity, _f1(*counts)) for entity, counts in self.entities.items())
+        micro = _f1(*[sum(counts[i] for counts in self.entities.values()) for i in range(3)])
+        return per_entity, micro
+
+
+class Latencies(object):
+    """Время на фразу по компонентам; подходит как timer для interpreter_parse_batch"""
+
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.order = []
+        self._lock = threading.Lock()
+
+    def __call__(self, name, seconds, count):
+        with self._lock:
+            if name not in self.samples:
+                self.order.append(name)
+            self.samples[name].extend([seconds / count] * count)
+
+    def percentiles(self, name, qs=PERCENTILES):
+        return [percentile(self.samples[name], q) for q in qs]
+
+
+class ProfileResult(object):
+    def __init__(self, name, threshold=CONFIDENCE_THRESHOLD):
+        self.name = name
+        self.scores = Scores(threshold)
+        self.latencies = Latencies()
+        self.train_seconds = []
+
+
+def evaluate_profile(name, config, folds, train, batch_size=8, workers=4,
+                     parse_batch=nlu_batch.interpreter_parse_batch, threshold=CONFIDENCE_THRESHOLD,
+                     warmup=WARMUP_MESSAGES):
+    """Обучает профиль на каждой части folds и разбирает её проверочные фразы.
+
+    train(config, examples) возвращает Interpreter. Перед замером через
+    модель без учёта времени проходят фразы warmup, как в навыке
+    (dialog_manager.warmup): первые вызовы tensorflow и spaCy в разы
+    медленнее и иначе попадают в p95.
+    """
+    result = ProfileResult(name, threshold)
+    latencies = result.latencies
+    for train_examples, test_examples in folds:
+        started = time.time()
+        interpreter = train(config, train_examples)
+        result.train_seconds.append(time.time() - started)
+        if warmup:
+            parse_batch(interpreter, list(warmup), timer=lambda *args: None)
+
+        def run(batch):
+            started = time.time()
+            outputs = parse_batch(interpreter, [m.text for m in batch], timer=latencies)
+            latencies(TOTAL, time.time() - started, len(batch))
+            return outputs
+
+        batches = [test_examples[i:i + batch_size] for i in range(0, len(test_examples), batch_size)]
+        with futures.ThreadPoolExecutor(workers) as executor:
+            for batch, outputs in zip(batches, executor.map(run, batches)):
+                for example, output in zip(batch, outputs):
+                    result.scores.add(example.get('intent'), example.get('entities'), output)
+    return result
+
+
+def _ms(values):
+    return ' '.join('%7.2f' % (v * 1000) for v in values)
+
+
+def format_result(result):
+    scores = result.scores
+    lines = ['Профиль %s: %d фраз, обучение %.1f с на часть' % (
+        result.name, scores.total, sum(result.train_seconds) / max(1, len(result.train_seconds)))]
+
+    lines.append('  намерения: точность %.3f, ниже порога %.2f – %.1f%%' % (
+        scores.accuracy(), scores.threshold, scores.unsure_rate() * 100))
+    accuracy = scores.intent_accuracy()
+    for intent in sorted(accuracy, key=lambda i: i or ''):
+        lines.append('    %-20s %4d %7.3f' % (intent, scores.intents[intent][1], accuracy[intent]))
+
+    per_entity, micro = scores.entity_scores()
+    lines.append('  сущности:                    P       R      F1')
+    for entity in sorted(per_entity):
+        lines.append('    %-20s %7.3f %7.3f %7.3f' % ((entity,) + per_entity[entity]))
+    lines.append('    %-20s %7.3f %7.3f %7.3f' % (('все',) + micro))
+
+    lines.append('  задержка на фразу, мс:     p50     p95     p99')
+    for name in result.latencies.order:
+        if name != TOTAL:
+            lines.append('    %-40s %s' % (name, _ms(result.latencies.percentiles(name))))
+    lines.append('    %-40s %s' % (TOTAL, _ms(result.latencies.percentiles(TOTAL))))
+    return '\n'.join(lines)
+
+
+def format_comparison(results):
+    lines = ['%-20s %9s %9s %9s %9s %9s' % ('профиль', 'точность', 'неувер.', 'F1', 'p50, мс', 'p95, мс')]
+    for result in results:
+        p50, p95 = result.latencies.percentiles(TOTAL, (0.5, 0.95))
+        lines.append('%-20s %9.3f %9.3f %9.3f %9.2f %9.2f' % (
+            result.name, result.scores.accuracy(), result.scores.unsure_rate(),
+            result.scores.entity_scores()[1][2], p50 * 1000, p95 * 1000))
+    return '\n'.join(lines)
+
+
+def profile_name(config):
+    name = os.path.splitext(os.path.basename(config))[0]
+    return name[len('nlu_config_'):] if name.startswith('nlu_config_') else name
+
+
+def _train_interpreter(config, examples, training_data=None):
+    from rasa_nlu import config as rasa_config
+    from rasa_nlu.model import Trainer
+    from rasa_nlu.training_data import TrainingData
+
+    data = TrainingData(examples, getattr(training_data, 'entity_synonyms', None),
+                        getattr(training_data, 'regex_features', None))
+    return Trainer(rasa_config.load(config)).train(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Точность и задержка профилей pipeline NLU')
+    parser.add_argument('configs', nargs='*', default=['config/nlu_config.yml', 'config/nlu_config_lite.yml'])
+    parser.add_argument('--data', default='config/intents_config.json')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threshold', type=float, default=CONFIDENCE_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    from rasa_nlu.training_data import load_data
+
+    logging.basicConfig(level=logging.WARNING)
+    training_data = load_data(args.data)
+    folds = stratified_folds(list(training_data.training_examples), args.folds, args.seed)
+    train = functools.partial(_train_interpreter, training_data=training_data)
+
+    results = []
+    for config in args.configs:
+        log.warning('Evaluating %s', config)
+        result = evaluate_profile(profile_name(config), config, folds, train, args.batch_size, args.workers,
+                                  threshold=args.threshold)
+        print(format_result(result))
+        print()
+        results.append(result)
+    print(format_comparison(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# coding: utf-8
+"""Быстрый разбор типовых реплик без rasa.
+
+Большая часть сообщений в партии – это «мимо, я хожу б 5», «попала» или
+«убила». Такие фразы разбираются грамматикой и возвращаются в том же
+виде, что и ответ router.parse. Всё, что грамматика не узнаёт целиком,
+остаётся rasa: parse возвращает None.
+"""
+
+from __future__ import unicode_literals
+
+import re
+
+from seabattle import coordinates
+
+
+EXTRACTOR = 'fastpath'
+
+_PUNCTUATION = re.compile(r'[^\w\s]+', re.UNICODE)
+_SPACES = re.compile(r'\s+', re.UNICODE)
+
+# варианты ответов, которые целиком означают один интент
+_PHRASES = {
+    'letsstart': {
+        'начинай', 'начинай ходить', 'начни', 'начни ходить', 'ходи', 'ходи первая', 'твой ход',
+    },
+    'hit': {
+        'ранил', 'ранила', 'ранен', 'попал', 'попала', 'попадание',
+        'ты ранил', 'ты ранила', 'ты попал', 'ты попала', 'как ты попала',
+    },
+    'kill': {
+        'убил', 'убила', 'убит', 'побил', 'побила', 'потопил', 'потопила',
+        'ты убил', 'ты убила', 'ты потопила', 'потопил корабль', 'потопила корабль',
+        'убила корабль', 'корабль утонул', 'корабль потоплен', 'утонул', 'потоплен',
+    },
+    'dontunderstand': {
+        'не понял', 'не поняла', 'я не понял', 'я не поняла', 'повтори', 'повтори последний ход',
+        'повтори последнюю', 'не понял повтори', 'не поняла повтори', 'не поняла повтори последний ход',
+        'не понял повтори последний ход',
+    },
+    'victory': {
+        'победа', 'ура победа', 'ура победил', 'ура победила', 'я победил', 'я победила',
+    },
+    'defeat': {
+        'поражение', 'проигрыш', 'я проиграл', 'я проиграла',
+    },
+}
+_INTENTS = dict((phrase, intent) for intent, phrases in _PHRASES.items() for phrase in phrases)
+
+_COORDINATE = '(?:%s)' % '|'.join(sorted(coordinates.LEXICON.words(), key=len, reverse=True))
+_LETTER = '[a-kа-к]'
+
+# «мимо я хожу б 5», «я ухожу в 7 9», «мимо б5»: без «мимо» или «хожу» координаты не принимаем
+_MISS = re.compile(
+    r'^(?:(?:мимо )?(?:я )?(?:хожу|ухожу)(?: в)?|мимо) '
+    r'(?P<shot>%(coord)s %(coord)s|%(letter)s(?:10|[1-9]))$' % {'coord': _COORDINATE, 'letter': _LETTER},
+    re.UNICODE,
+)
+_NEWGAME = re.compile(
+    r'^(?:(?:начни|начать|начинаем|запусти) )?(?:новую игру|новая игра)(?: соперник (?P<opponent>\w+))?$',
+    re.UNICODE,
+)
+
+
+def normalize(message):
+    """Нижний регистр, без знаков препинания и лишних пробелов"""
+    message = _PUNCTUATION.sub(' ', message.lower().replace('ё', 'е'))
+    return _SPACES.sub(' ', message).strip()
+
+
+def _entity(entity, match, group):
+    return {
+        'entity': entity,
+        'value': match.group(group),
+        'start': match.start(group),
+        'end': match.end(group),
+        'extractor': EXTRACTOR,
+    }
+
+
+def _response(text, intent, entities=None):
+    return {
+        'text': text,
+        'intent': {'name': intent, 'confidence': 1.0},
+        'entities': entities or [],
+    }
+
+
+def parse(message):
+    """Разбирает сообщение, если оно целиком совпадает с одной из типовых форм.
+
+    Возвращает словарь в формате router.parse или None.
+    """
+    text = normalize(message)
+
+    intent = _INTENTS.get(text)
+    if intent is not None:
+        return _response(text, intent)
+
+    match = _MISS.match(text)
+    if match is not None:
+        return _response(text, 'miss', [_entity('hit_entity', match, 'shot')])
+
+    match = _NEWGAME.match(text)
+    if match is not None:
+        entities = []
+        if match.group('opponent'):
+            entities.append(_entity('opponent_entity', match, 'opponent'))
+        return _response(text, 'newgame', entities)
+
+    return None
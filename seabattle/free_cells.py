@@ -0,0 +1,220 @@
+# coding: utf-8
+"""Индекс непростреленных клеток поля противника.
+
+Проверка клетки стоит O(1), удаление и выбор k-й по порядку свободной
+клетки – O(log n) по дереву Фенвика. Выбор идёт по порядку индексов, а
+не по истории выстрелов, поэтому партия, восстановленная из snapshot,
+стреляет так же, как исходная. Для каждой свободной клетки хранятся
+границы её свободных отрезков в строке и столбце: запрос стоит O(1), а
+discard переписывает границы только у клеток двух разрезанных отрезков.
+
+FreeOrder – те же свободные клетки в чужом порядке (план Strategy).
+Индекс сам вычёркивает из него простреленные клетки, так что стратегия
+получает следующую свободную клетку плана за O(log n) и никогда не видит
+простреленных.
+"""
+
+from __future__ import unicode_literals
+
+import random
+from array import array
+
+from seabattle.strategy import Point
+
+
+_empty_trees = {}
+_empty_runs = {}
+_field_points = {}
+
+
+def _empty_tree(n):
+    """Дерево Фенвика со всеми свободными клетками: tree[i] = i & -i"""
+    tree = _empty_trees.get(n)
+    if tree is None:
+        tree = _empty_trees[n] = array('h', (i & -i for i in range(n + 1)))
+    return tree
+
+
+def _tree_discard(tree, i):
+    """Убирает из дерева элемент с номером i"""
+    i += 1
+    while i < len(tree):
+        tree[i] -= 1
+        i += i & -i
+
+
+def _tree_count(tree, i):
+    """Число элементов с номерами меньше i"""
+    count = 0
+    while i:
+        count += tree[i]
+        i &= i - 1
+    return count
+
+
+def _tree_select(tree, k):
+    """Номер k-го (с нуля) элемента дерева"""
+    position = 0
+    step = 1 << (len(tree) - 1).bit_length()
+    while step:
+        following = position + step
+        if following < len(tree) and tree[following] <= k:
+            position = following
+            k -= tree[following]
+        step >>= 1
+    return position
+
+
+def _empty_run(size):
+    """Границы отрезков пустого поля: (1, size) у каждой клетки"""
+    run = _empty_runs.get(size)
+    if run is None:
+        run = _empty_runs[size] = (bytearray([1]) * size ** 2, bytearray([size]) * size ** 2)
+    return run
+
+
+def _points(size):
+    """Point каждой клетки поля; Point неизменяемы, поэтому общие для всех партий"""
+    points = _field_points.get(size)
+    if points is None:
+        points = _field_points[size] = tuple(Point(i % size + 1, i // size + 1) for i in range(size ** 2))
+    return points
+
+
+class FreeOrder(object):
+    """Свободные клетки индекса в порядке order; ranks[index] – номер клетки в order или -1.
+
+    Строится через FreeCells.ordered, дальше индекс обновляет его в discard.
+    """
+
+    __slots__ = ('order', 'ranks', 'flags', 'tree')
+
+    def __init__(self, order, ranks, flags):
+        self.order = order
+        self.ranks = ranks
+        # по flags стратегия узнаёт, что индекс построили заново
+        self.flags = flags
+        self.tree = _empty_tree(len(order))[:]
+
+    def discard(self, index):
+        rank = self.ranks[index]
+        if rank >= 0:
+            _tree_discard(self.tree, rank)
+
+    def last_before(self, stop):
+        """Наибольший номер свободной клетки order меньше stop или -1"""
+        count = _tree_count(self.tree, stop)
+        return _tree_select(self.tree, count - 1) if count else -1
+
+
+class FreeCells(object):
+    __slots__ = ('size', 'field', 'count', 'flags', 'tree', 'row_start', 'row_end', 'col_start', 'col_end',
+                 'orders', 'points')
+
+    def __init__(self, size, field=None):
+        self.size = size
+        self.field = field
+        n = size ** 2
+        self.count = n
+        self.flags = bytearray([1]) * n
+        self.tree = _empty_tree(n)[:]
+        self.orders = []
+        self.points = _points(size)
+        # координаты с единицы; у закрытых клеток значения устаревшие
+        start, end = _empty_run(size)
+        self.row_start, self.row_end = start[:], end[:]
+        self.col_start, self.col_end = start[:], end[:]
+        if field is not None and self._has_shots(field):
+            for index, value in enumerate(field):
+                # 0 – пустая клетка поля
+                if value != 0:
+                    self.discard(index)
+
+    @staticmethod
+    def _has_shots(field):
+        occupied = getattr(field, 'occupied', None)
+        if occupied is not None:
+            return occupied() != 0
+        return field.count(0) != len(field)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, index):
+        return self.flags[index] == 1
+
+    def __iter__(self):
+        """Свободные клетки по возрастанию индекса"""
+        flags = self.flags
+        return (index for index in range(len(flags)) if flags[index])
+
+    def discard(self, index):
+        """Убирает клетку из свободных; возвращает False, если её там уже не было"""
+        if not self.flags[index]:
+            return False
+        self.flags[index] = 0
+        self.count -= 1
+        _tree_discard(self.tree, index)
+        self._split_runs(index)
+        for order in self.orders:
+            order.discard(index)
+        return True
+
+    def _split_runs(self, index):
+        # отрезки строки и столбца через клетку распадаются на части по обе стороны от неё
+        size = self.size
+        y, x = divmod(index, size)
+        left, right = x - self.row_start[index] + 1, self.row_end[index] - x - 1
+        up, down = y - self.col_start[index] + 1, self.col_end[index] - y - 1
+        self.row_end[index - left:index] = bytearray([x]) * left
+        self.row_start[index + 1:index + 1 + right] = bytearray([x + 2]) * right
+        self.col_end[index - up * size:index:size] = bytearray([y]) * up
+        self.col_start[index + size:index + (down + 1) * size:size] = bytearray([y + 2]) * down
+
+    def has_point(self, point):
+        """Клетка Point(x, y) внутри поля и ещё не прострелена"""
+        x, y = point
+        return 1 <= x <= self.size and 1 <= y <= self.size and self.flags[(y - 1) * self.size + x - 1] == 1
+
+    def select(self, k):
+        """k-я (с нуля) свободная клетка по возрастанию индекса"""
+        if not 0 <= k < self.count:
+            raise IndexError(k)
+        return _tree_select(self.tree, k)
+
+    def ordered(self, order, ranks):
+        """FreeOrder по этому индексу; discard будет вычёркивать из него клетки"""
+        view = FreeOrder(order, ranks, self.flags)
+        if self.count < len(self.flags):
+            for index in order:
+                if not self.flags[index]:
+                    view.discard(index)
+        self.orders.append(view)
+        return view
+
+    def choice(self, rng=random):
+        return self.select(rng.randrange(self.count))
+
+    def point(self, index):
+        return self.points[index]
+
+    def index(self, point):
+        return (point[1] - 1) * self.size + point[0] - 1
+
+    def row_run(self, index):
+        """Свободный отрезок строки через клетку: (x_start, x_end) или None, если клетка закрыта"""
+        if not self.flags[index]:
+            return None
+        return self.row_start[index], self.row_end[index]
+
+    def col_run(self, index):
+        """Свободный отрезок столбца через клетку: (y_start, y_end) или None, если клетка закрыта"""
+        if not self.flags[index]:
+            return None
+        return self.col_start[index], self.col_end[index]
+
+    def max_run(self, index):
+        """Длина самого длинного свободного отрезка через клетку: больший корабль в ней не поместится"""
+        if not self.flags[index]:
+            return 0
+        return max(self.row_end[index] - self.row_start[index], self.col_end[index] - self.col_start[index]) + 1
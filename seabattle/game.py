@@ -2,13 +2,14 @@
 
 from __future__ import unicode_literals
 
-import random
-import re
 import logging
+from array import array
 
-from transliterate import translit
-
-from seabattle.strategy import Strategy, DamagedShipStrategy, Point, RandomStrategy
+from seabattle import coordinates, placement
+from seabattle.bitboard import BitField, get_masks, iter_bits
+from seabattle.endgame import EndgameStrategy
+from seabattle.free_cells import FreeCells
+from seabattle.strategy import Strategy, DamagedShipStrategy, DensityStrategy, Point, RandomStrategy
 EMPTY = 0
 SHIP = 1
 BLOCKED = 2
@@ -19,23 +20,15 @@ log = logging.getLogger(__name__)
 
 
 class BaseGame(object):
-    position_patterns = [re.compile('^([a-zа-я]+)(\d+)$', re.UNICODE),  # a1
-                         re.compile('^([a-zа-я]+)\s+(\w+)$', re.UNICODE),  # a 1; a один
-                         re.compile('^(\w+)\s+(\w+)$', re.UNICODE),  # a 1; a один; 7 10
-                         ]
-
-    str_letters = ['а', 'б', 'в', 'г', 'д', 'е', 'ж', 'з', 'и', 'к']
-    str_numbers = ['один', 'два', 'три', 'четыре', 'пять', 'шесть', 'семь', 'восемь', 'девять', 'десять']
-
-    letters_mapping = {
-        'the': 'з',
-        'за': 'з',
-        'уже': 'ж',
-        'трень': '3',
-    }
+    str_letters = coordinates.LETTERS
+    str_numbers = coordinates.NUMBERS
+    letters_mapping = coordinates.LETTERS_MAPPING
 
     default_ships = [4, 3, 3, 2, 2, 2, 1, 1, 1, 1]
 
+    __slots__ = ('size', 'ships', 'field', 'enemy_field', 'ships_count', 'enemy_ships_count',
+                 'last_shot_position', 'last_enemy_shot_position', 'numbers', 'bitboard', '__weakref__')
+
     def __init__(self):
         self.size = 0
         self.ships = None
@@ -48,13 +41,15 @@ class BaseGame(object):
         self.last_shot_position = None
         self.last_enemy_shot_position = None
         self.numbers = None
+        self.bitboard = None
 
-    def start_new_game(self, size=10, field=None, ships=None, numbers=None):
+    def start_new_game(self, size=10, field=None, ships=None, numbers=None, bitboard=None):
         assert(size <= 10)
         assert(len(field) == size ** 2 if field is not None else True)
 
         self.size = size
         self.numbers = numbers if numbers is not None else False
+        self.bitboard = bitboard if bitboard is not None else False
 
         if ships is None:
             self.ships = self.default_ships
@@ -66,7 +61,13 @@ class BaseGame(object):
         else:
             self.field = field
 
-        self.enemy_field = [EMPTY] * self.size ** 2
+        if self.bitboard:
+            if not isinstance(self.field, BitField):
+                self.field = BitField.from_list(self.size, self.field)
+            self.enemy_field = BitField(self.size)
+        else:
+            self.field = array('b', self.field)
+            self.enemy_field = array('b', [EMPTY]) * self.size ** 2
 
         self.ships_count = self.enemy_ships_count = len(self.ships)
 
@@ -113,6 +114,9 @@ class BaseGame(object):
             return 'miss'
 
     def is_dead_ship(self, last_index):
+        if isinstance(self.field, BitField):
+            return self._is_dead_ship_bitboard(last_index)
+
         x, y = self.calc_position(last_index)
         x -= 1
         y -= 1
@@ -135,6 +139,24 @@ class BaseGame(object):
             _line_is_dead(self.field[y * self.size:(y + 1) * self.size], x)
         )
 
+    def _is_dead_ship_bitboard(self, last_index):
+        masks = get_masks(self.size)
+        ship = self.field.plane(SHIP)
+        hit = self.field.plane(HIT)
+        start = 1 << last_index
+        row = masks.rows[last_index // self.size]
+        col = masks.cols[last_index % self.size]
+
+        # идём от клетки в каждую из четырёх сторон, пока встречаются подбитые клетки
+        for step, line in ((1, row), (self.size, col)):
+            for shift in (lambda bit: bit << step, lambda bit: bit >> step):
+                bit = shift(start)
+                while bit & line & hit:
+                    bit = shift(bit)
+                if bit & line & ship:
+                    return False
+        return True
+
     def is_end_game(self):
         return self.is_victory() or self.is_defeat()
 
@@ -171,7 +193,7 @@ class BaseGame(object):
     def calc_index(self, position):
         x, y = position
 
-        if x > self.size or y > self.size:
+        if not (1 <= x <= self.size and 1 <= y <= self.size):
             raise ValueError('Wrong position: %s %s' % (x, y))
 
         return (y - 1) * self.size + x - 1
@@ -182,74 +204,30 @@ class BaseGame(object):
 
         return x, y
 
-    def convert_to_position(self, position):
-        position = position.lower()
-        for pattern in self.position_patterns:
-            match = pattern.match(position)
-
-            if match is not None:
-                break
-        else:
-            raise ValueError('Can\'t parse entire position: %s' % position)
-
-        bits = match.groups()
-
-        def _try_letter(bit):
-            # проверяем особые случаи неправильного распознования STT
-            bit = self.letters_mapping.get(bit, bit)
-
-            # преобразуем в кириллицу
-            bit = translit(bit, 'ru')
-
-            try:
-                return self.str_letters.index(bit) + 1
-            except ValueError:
-                raise
-
-        def _try_number(bit):
-            # проверяем особые случаи неправильного распознования STT
-            bit = self.letters_mapping.get(bit, bit)
-
-            if bit.isdigit():
-                return int(bit)
-            else:
-                try:
-                    return self.str_numbers.index(bit) + 1
-                except ValueError:
-                    raise
-
-        x = bits[0].strip()
-        try:
-            x = _try_number(x)
-        except ValueError:
-            raise ValueError('Can\'t parse X point: %s' % x)
-
-        y = bits[1].strip()
-        try:
-            y = _try_number(y)
-        except ValueError:
-            raise ValueError('Can\'t parse Y point: %s' % y)
+    @property
+    def lexicon(self):
+        # до start_new_game размер поля ещё не задан
+        return coordinates.get_lexicon(self.size or coordinates.MAX_SIZE)
 
-        return x, y
+    def convert_to_position(self, position):
+        return self.lexicon.parse(position)
 
     def convert_from_position(self, position, numbers=None):
         numbers = numbers if numbers is not None else self.numbers
-
-        if numbers:
-            x = position[0]
-        else:
-            x = self.str_letters[position[0] - 1]
-
-        y = position[1]
-
-        return '%s, %s' % (x, y)
+        return self.lexicon.render(position, numbers)
 
 
 class Game(BaseGame):
     """Реализация игры с ипользованием обычного random"""
 
-    def __init__(self):
-        self.strategy = Strategy(region_size=4)
+    __slots__ = ('density_strategy', 'endgame_strategy', 'strategy', 'damaged_ship_strategy', '_free_cells',
+                 'four_decker_count', 'three_decker_count', 'two_decker_count', 'one_decker_count',
+                 'four_decker_strategy', 'three_decker_strategy', 'two_decker_strategy', 'one_decker_strategy')
+
+    def __init__(self, density=False, endgame=False):
+        self.density_strategy = DensityStrategy(game=self) if density else None
+        self.endgame_strategy = EndgameStrategy(game=self) if endgame else None
+        self.strategy = self.density_strategy or Strategy(region_size=4)
         self.damaged_ship_strategy = None
 
         self.four_decker_count = 1
@@ -257,73 +235,56 @@ class Game(BaseGame):
         self.two_decker_count = 3
         self.one_decker_count = 4
 
-        self.four_decker_strategy = Strategy(region_size=4)
-        self.three_decker_strategy = Strategy(region_size=3)
-        self.two_decker_strategy = Strategy(region_size=2)
+        # порядки для оставшихся кораблей строятся в _set_strategy, когда понадобятся
+        self.four_decker_strategy = None
+        self.three_decker_strategy = None
+        self.two_decker_strategy = None
         self.one_decker_strategy = RandomStrategy(game=self)
+        self._free_cells = None
         super(Game, self).__init__()
 
+    @property
+    def free_cells(self):
+        """Индекс непростреленных клеток; строится заново, если поле противника заменили"""
+        free = self._free_cells
+        if free is None or free.field is not self.enemy_field:
+            free = self._free_cells = FreeCells(self.size, self.enemy_field)
+        return free
 
+    def _mark_enemy_cell(self, index, value):
+        self.enemy_field[index] = value
+        self.free_cells.discard(index)
 
-    def generate_field(self):
-        """Метод генерации поля"""
-        self.field = [0] * self.size ** 2
-
-        for length in self.ships:
-            self.place_ship(length)
-
-        for i in range(len(self.field)):
-            if self.field[i] == BLOCKED:
-                self.field[i] = EMPTY
-
-    def place_ship(self, length):
-        def _try_to_place():
-            x = random.randint(1, self.size)
-            y = random.randint(1, self.size)
-            direction = random.choice([1, self.size])
-
-            index = self.calc_index((x, y))
-            values = self.field[index:None if direction == self.size else index + self.size - index % self.size:direction][:length]
-
-            if len(values) < length or any(values):
-                return False
-
-            for i in range(length):
-                current_index = index + direction * i
-
-                for j in [0, 1, -1]:
-                    if (j != 0
-                            and current_index % self.size in (0, self.size - 1)
-                            and (current_index + j) % self.size in (0, self.size - 1)):
-                        continue
-
-                    for k in [0, self.size, -self.size]:
-                        neighbour_index = current_index + k + j
-
-                        if (neighbour_index < 0
-                                or neighbour_index >= len(self.field)
-                                or self.field[neighbour_index] == SHIP):
-                            continue
+    def start_new_game(self, *args, **kwargs):
+        super(Game, self).start_new_game(*args, **kwargs)
+        self._free_cells = FreeCells(self.size, self.enemy_field)
+        if self.density_strategy is not None:
+            self.density_strategy.reset()
 
-                        self.field[neighbour_index] = BLOCKED
-
-                self.field[current_index] = SHIP
-
-            return True
-
-        while not _try_to_place():
-            pass
+    def generate_field(self):
+        """Метод генерации поля: берём готовое поле из пула"""
+        self.field = placement.take_field(self.size, self.ships)
 
     def do_shot(self):
+        free = self.free_cells
+        if self.endgame_strategy is not None and self.strategy is not self.damaged_ship_strategy:
+            # в конце партии перебор расстановок заменяет любую стратегию поиска
+            point_to_shoot = self.endgame_strategy.get_shoot_point(free)
+            if point_to_shoot is not None:
+                self.last_shot_position = point_to_shoot
+                return self.convert_from_position(self.last_shot_position)
+        # клетки, в которых не поместится даже самый короткий из оставшихся кораблей, стратегии пропускают
+        min_length = self.smallest_enemy_ship()
         while True:
-            point_to_shoot = self.strategy.get_shoot_point()
+            point_to_shoot = self.strategy.get_shoot_point(free, min_length)
             if point_to_shoot is None:
-                print('Не найдено точек для выстрела')
-                self._set_strategy()
+                if self.strategy is self.one_decker_strategy:
+                    raise ValueError('No cells left to shoot')
+                log.info('Не найдено точек для выстрела')
+                self.strategy = self.one_decker_strategy
                 continue
-            if self.enemy_field[self.calc_index(point_to_shoot)] == EMPTY:
-                self.last_shot_position = self.strategy.get_shoot_point()
-                return self.convert_from_position(self.last_shot_position)
+            self.last_shot_position = point_to_shoot
+            return self.convert_from_position(self.last_shot_position)
 
     def handle_enemy_reply(self, message):
         if self.last_shot_position is None:
@@ -332,24 +293,40 @@ class Game(BaseGame):
         index = self.calc_index(self.last_shot_position)
 
         if message in ['hit', 'kill']:
-            self.enemy_field[index] = SHIP
+            self._mark_enemy_cell(index, SHIP)
             if self.damaged_ship_strategy is None:
                 self.damaged_ship_strategy = DamagedShipStrategy()
-                self.damaged_ship_strategy.add_ship_point(self.last_shot_position)
                 self.strategy = self.damaged_ship_strategy
+            self.damaged_ship_strategy.add_ship_point(Point(*self.last_shot_position))
 
             if message == 'kill':
                 self.enemy_ships_count -= 1
 
+                if self.density_strategy is not None:
+                    self.density_strategy.mark_kill(self.damaged_ship_strategy.ship)
                 self._mark_nearby_ship_points_as_miss()
                 self.reduce_enemy_ships_count(len(self.damaged_ship_strategy.ship))
                 self.damaged_ship_strategy = None
                 self._set_strategy()
 
         elif message == 'miss':
-            self.enemy_field[index] = MISS
+            self._mark_enemy_cell(index, MISS)
+            if self.density_strategy is not None:
+                self.density_strategy.mark_miss(self.last_shot_position)
 
     def _mark_nearby_ship_points_as_miss(self):
+        if isinstance(self.enemy_field, BitField):
+            masks = get_masks(self.size)
+            nearby = 0
+            for point in self.damaged_ship_strategy.ship:
+                nearby |= masks.neighbours[self.calc_index(point)]
+            nearby &= ~self.enemy_field.occupied()
+            self.enemy_field.set_mask(MISS, nearby)
+            free = self.free_cells
+            for index in iter_bits(nearby):
+                free.discard(index)
+            return
+
         for point in self.damaged_ship_strategy.get_nearby_ship_points():
             try:
                 index = self.calc_index(point)
@@ -357,18 +334,44 @@ class Game(BaseGame):
                 continue
 
             if self.enemy_field[index] == EMPTY:
-                self.enemy_field[index] = MISS
+                self._mark_enemy_cell(index, MISS)
 
     def _set_strategy(self):
-        if self.four_decker_count:
+        if self.density_strategy is not None:
+            self.strategy = self.density_strategy
+        elif self.four_decker_count:
+            if self.four_decker_strategy is None:
+                self.four_decker_strategy = Strategy(self.size, region_size=4)
             self.strategy = self.four_decker_strategy
         elif self.three_decker_count:
+            if self.three_decker_strategy is None:
+                self.three_decker_strategy = Strategy(self.size, region_size=3)
             self.strategy = self.three_decker_strategy
         elif self.two_decker_count:
+            if self.two_decker_strategy is None:
+                self.two_decker_strategy = Strategy(self.size, region_size=2)
             self.strategy = self.two_decker_strategy
         else:
             self.strategy = self.one_decker_strategy
 
+    def remaining_enemy_ships(self):
+        """Длины ещё не убитых кораблей противника по убыванию"""
+        counts = ((4, self.four_decker_count), (3, self.three_decker_count),
+                  (2, self.two_decker_count), (1, self.one_decker_count))
+        return tuple(length for length, count in counts for _ in range(max(count, 0)))
+
+    def smallest_enemy_ship(self):
+        """Длина самого короткого из неубитых кораблей противника, 1 – если их не осталось"""
+        if self.one_decker_count > 0:
+            return 1
+        if self.two_decker_count > 0:
+            return 2
+        if self.three_decker_count > 0:
+            return 3
+        if self.four_decker_count > 0:
+            return 4
+        return 1
+
     def reduce_enemy_ships_count(self, deckers):
         if deckers == 4:
             self.four_decker_count -= 1
@@ -378,3 +381,21 @@ class Game(BaseGame):
             self.two_decker_count -= 1
         if deckers == 1:
             self.one_decker_count -= 1
+
+
+class DensityGame(Game):
+    """Игра, которая ищет корабли по карте вероятностей"""
+
+    __slots__ = ()
+
+    def __init__(self):
+        super(DensityGame, self).__init__(density=True)
+
+
+class EndgameGame(Game):
+    """Игра, которая в конце партии стреляет по перебору расстановок (endgame.py)"""
+
+    __slots__ = ()
+
+    def __init__(self):
+        super(EndgameGame, self).__init__(endgame=True)
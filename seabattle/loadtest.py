@@ -0,0 +1,354 @@
+# coding: utf-8
+"""Нагрузочное тестирование webhook'а навыка.
+
+    python -m seabattle.loadtest --url http://localhost:5000/ --steps 1,8,32 --duration 30
+    python -m seabattle.loadtest --local --steps 4 --games 10 --record traffic.jsonl
+    python -m seabattle.loadtest --url http://localhost:5000/ --replay traffic.jsonl --steps 16
+
+Виртуальные пользователи играют полные партии: у каждого своё поле,
+на выстрелы навыка они отвечают честно и сами стреляют с помощью Game.
+Для каждого уровня одновременности печатаются пропускная способность,
+p50/p95/p99 задержки и доля ошибок. Записанный трафик (по JSON запроса
+на строку) можно проиграть снова: запросы одного пользователя уходят по
+порядку, разные пользователи – параллельно. Навык стреляет случайно,
+поэтому при повторе его ответы расходятся с записанными репликами, и
+часть запросов может завершиться ошибкой: повтор воспроизводит нагрузку,
+а не сами партии.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import collections
+import io
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+try:
+    from http import client as http_client
+    from urllib.parse import urlparse
+except ImportError:
+    import httplib as http_client
+    from urlparse import urlparse
+
+from seabattle import fastpath, placement
+from seabattle.game import BaseGame, Game
+from seabattle.simulate import percentile
+
+
+log = logging.getLogger(__name__)
+
+# навык ходит: «Я хожу 5, 7» или «Мимо. Я хожу 5, 7», иногда с обращением к сопернику
+_SHOT = re.compile(r'я хожу (\d+), (\d+)', re.UNICODE)
+MAX_MESSAGES_PER_GAME = 600
+
+
+class HttpTransport(object):
+    """POST запросов на webhook с постоянным соединением в каждом потоке"""
+
+    def __init__(self, url, timeout=10):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or '/'
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http_client.HTTPConnection(self.host, self.port,
+                                                                             timeout=self.timeout)
+        return connection
+
+    def post(self, body):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            connection = self._connection()
+            connection.request('POST', self.path, data, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            payload = response.read()
+        except (http_client.HTTPException, IOError):
+            self._local.connection = None
+            raise
+        if response.status != 200:
+            return response.status, None
+        return response.status, json.loads(payload.decode('utf-8'))
+
+
+class LocalTransport(object):
+    """Запросы к Flask приложению api.py в том же процессе, без сети"""
+
+    def __init__(self):
+        from seabattle import api
+        self.app = api.app
+        self._local = threading.local()
+
+    def post(self, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post('/', data=json.dumps(body), content_type='application/json')
+        if response.status_code != 200:
+            return response.status_code, None
+        return response.status_code, json.loads(response.get_data(as_text=True))
+
+
+class StepStats(object):
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = 0
+        self.dontunderstand = 0
+        self.games = 0
+        self.started = time.time()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, latency, ok=True, dontunderstand=False):
+        with self._lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+            if dontunderstand:
+                self.dontunderstand += 1
+
+    def add_game(self):
+        with self._lock:
+            self.games += 1
+
+    def finish(self):
+        self.elapsed = time.time() - self.started
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def as_dict(self):
+        return {
+            'concurrency': self.concurrency,
+            'requests': self.requests,
+            'games': self.games,
+            'rps': self.requests / self.elapsed if self.elapsed else 0.0,
+            'p50_ms': percentile(self.latencies, 0.5) * 1000,
+            'p95_ms': percentile(self.latencies, 0.95) * 1000,
+            'p99_ms': percentile(self.latencies, 0.99) * 1000,
+            'error_rate': self.errors / self.requests if self.requests else 0.0,
+            'dontunderstand_rate': self.dontunderstand / self.requests if self.requests else 0.0,
+        }
+
+
+class _Recorder(object):
+    def __init__(self, path):
+        self._file = io.open(path, 'w', encoding='utf-8') if path else None
+        self._lock = threading.Lock()
+
+    def write(self, body):
+        if self._file is not None:
+            with self._lock:
+                self._file.write(json.dumps(body, ensure_ascii=False) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def make_request(user_id, session_id, message_id, text):
+    """Тело запроса Яндекс.Диалогов: command приходит без регистра и знаков препинания"""
+    return {
+        'meta': {'locale': 'ru-RU', 'timezone': 'Europe/Moscow', 'client_id': 'loadtest'},
+        'request': {'command': fastpath.normalize(text), 'original_utterance': text, 'type': 'SimpleUtterance'},
+        'session': {'new': message_id == 0, 'message_id': message_id, 'session_id': session_id,
+                    'skill_id': 'loadtest', 'user_id': user_id},
+        'version': '1.0',
+    }
+
+
+class VirtualUser(object):
+    """Игрок, который проводит с навыком полные партии"""
+
+    def __init__(self, transport, user_id, stats, recorder=None, rng=None):
+        self.transport = transport
+        self.user_id = user_id
+        self.stats = stats
+        self.recorder = recorder
+        self.rng = rng or random.Random()
+        self.games = 0
+
+    def _say(self, session_id, message_id, text):
+        body = make_request(self.user_id, session_id, message_id, text)
+        if self.recorder is not None:
+            self.recorder.write(body)
+        started = time.time()
+        try:
+            status, response = self.transport.post(body)
+        except Exception:
+            log.exception('Request failed')
+            status, response = None, None
+        reply = response['response']['text'] if response is not None else None
+        self.stats.add(time.time() - started, ok=response is not None,
+                       dontunderstand=reply is not None and reply.startswith('Не поняла'))
+        return reply
+
+    def play_game(self):
+        """Играет одну партию; возвращает True, если она дошла до конца"""
+        self.games += 1
+        session_id = '%s-%d' % (self.user_id, self.games)
+        referee = BaseGame()
+        referee.start_new_game(10, placement.generate_field(10, referee.default_ships, self.rng))
+        shooter = Game()
+        shooter.start_new_game(numbers=True)
+
+        self._say(session_id, 0, 'новая игра')
+        text = 'начинай'
+        for message_id in range(1, MAX_MESSAGES_PER_GAME):
+            reply = self._say(session_id, message_id, text)
+            if reply is None:
+                return False
+            reply = reply.lower()
+
+            if reply.endswith('я проиграла') or 'ура, победа' in reply:
+                self.stats.add_game()
+                return True
+            if reply.startswith('не поняла'):
+                continue
+
+            if 'ты попала' in reply or 'корабль утонул' in reply:
+                shooter.handle_enemy_reply('kill' if 'утонул' in reply else 'hit')
+                if shooter.is_victory():
+                    text = 'ура победа'
+                    continue
+                text = 'я хожу %s' % shooter.do_shot().replace(',', '')
+                continue
+
+            match = _SHOT.search(reply)
+            if match is None:
+                log.warning('Unexpected reply: %s', reply)
+                return False
+            if 'мимо' in reply:
+                shooter.handle_enemy_reply('miss')
+            answer = referee.handle_enemy_shot((int(match.group(1)), int(match.group(2))))
+            if answer == 'miss':
+                text = 'мимо, я хожу %s' % shooter.do_shot().replace(',', '')
+            elif referee.is_defeat():
+                text = 'я проиграл'
+            else:
+                text = {'hit': 'попала', 'kill': 'убила'}[answer]
+        return False
+
+
+def run_step(transport, concurrency, duration=None, games=None, recorder=None, seed=0):
+    """Запускает concurrency пользователей на duration секунд или по games партий на каждого"""
+    stats = StepStats(concurrency)
+    deadline = time.time() + duration if duration else None
+
+    def _user(index):
+        user = VirtualUser(transport, 'loadtest-%d-%d' % (concurrency, index), stats, recorder,
+                           random.Random('%s-%s' % (seed, index)))
+        while True:
+            if games is not None and user.games >= games:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+            user.play_game()
+
+    threads = [threading.Thread(target=_user, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.finish()
+    return stats
+
+
+def load_traffic(path):
+    """Записанные запросы, сгруппированные по пользователям с сохранением порядка"""
+    by_user = collections.OrderedDict()
+    with io.open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                body = json.loads(line)
+                by_user.setdefault(body['session']['user_id'], []).append(body)
+    return list(by_user.values())
+
+
+def replay(transport, traffic, concurrency):
+    """Проигрывает записанный трафик в concurrency потоков"""
+    stats = StepStats(concurrency)
+    queue = list(reversed(traffic))
+    lock = threading.Lock()
+
+    def _worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                requests = queue.pop()
+            for body in requests:
+                started = time.time()
+                try:
+                    status, response = transport.post(body)
+                except Exception:
+                    response = None
+                reply = response['response']['text'] if response is not None else ''
+                stats.add(time.time() - started, ok=response is not None,
+                          dontunderstand=reply.startswith('Не поняла'))
+
+    threads = [threading.Thread(target=_worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.finish()
+    return stats
+
+
+def format_stats(stats):
+    return ('concurrency %(concurrency)4d: %(requests)7d requests, %(games)5d games, %(rps)8.1f req/s, '
+            'p50 %(p50_ms)7.1f ms, p95 %(p95_ms)7.1f ms, p99 %(p99_ms)7.1f ms, '
+            'errors %(error_rate)6.2f%%, dontunderstand %(dontunderstand_rate)6.2f%%') % dict(
+        stats.as_dict(), error_rate=stats.as_dict()['error_rate'] * 100,
+        dontunderstand_rate=stats.as_dict()['dontunderstand_rate'] * 100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование webhook\'а навыка')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='адрес webhook\'а, например http://localhost:5000/')
+    target.add_argument('--local', action='store_true', help='запросы к api.py в этом же процессе')
+    parser.add_argument('--steps', default='1,4,16', help='уровни одновременности через запятую')
+    parser.add_argument('--duration', type=float, default=None, help='секунд на каждый уровень')
+    parser.add_argument('--games', type=int, default=None, help='партий на пользователя на каждом уровне')
+    parser.add_argument('--replay', help='проиграть записанный трафик вместо партий')
+    parser.add_argument('--record', help='записать отправленные запросы в файл')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    transport = LocalTransport() if args.local else HttpTransport(args.url)
+    # без локального режима логи навыка сюда не попадают, а с ним заглушают отчёт
+    logging.getLogger().setLevel(logging.WARNING)
+    steps = [int(s) for s in args.steps.split(',')]
+
+    if args.replay:
+        traffic = load_traffic(args.replay)
+        for concurrency in steps:
+            print(format_stats(replay(transport, traffic, concurrency)))
+        return
+
+    if args.duration is None and args.games is None:
+        args.games = 1
+    recorder = _Recorder(args.record)
+    try:
+        for concurrency in steps:
+            print(format_stats(run_step(transport, concurrency, args.duration, args.games, recorder, args.seed)))
+    finally:
+        recorder.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# coding: utf-8
+"""Счётчики и гистограммы в текстовом формате Prometheus.
+
+    REQUESTS = metrics.Counter('requests_total', 'Запросы', ['intent'])
+    REQUESTS.inc(['hit'])
+    with metrics.span('nlu'):
+        ...
+    metrics.render()
+
+METRICS=0 выключает сбор: span возвращает пустой контекстный менеджер,
+а inc и observe сразу выходят.
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import os
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Registry(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics):
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(enabled=os.environ.get('METRICS', '1') != '0')
+
+
+def _escape(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=(), registry=registry):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.registry = registry
+        self._lock = threading.Lock()
+        registry.register(self)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=registry):
+        super(Counter, self).__init__(name, help, labels, registry)
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        if not self.registry.enabled:
+            return
+        labels = tuple(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return ['%s%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(value))
+                for labels, value in items]
+
+
+class Gauge(_Metric):
+    """Значение, которое вычисляется при выгрузке: callback возвращает число или {labels: число}"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, callback, labels=(), registry=registry):
+        super(Gauge, self).__init__(name, help, labels, registry)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        if value is None:
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        return ['%s%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(v))
+                for labels, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=registry):
+        super(Histogram, self).__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        if not self.registry.enabled:
+            return
+        labels = tuple(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # счётчики по корзинам, последняя – +Inf, затем сумма
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, labels=()):
+        counts = self._values.get(tuple(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        lines = []
+        for labels, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                total += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name, _format_labels(self.labels, labels, [('le', _format_value(float(bound)))]), total))
+            lines.append('%s_sum%s %r' % (self.name, _format_labels(self.labels, labels), counts[-1]))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(self.labels, labels), total))
+        return lines
+
+
+STAGE_SECONDS = Histogram('seabattle_stage_seconds', 'Время этапов обработки запроса', ['stage'])
+
+
+class _Span(object):
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.time() - self.started, self.labels)
+
+
+class _NoopSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage, histogram=STAGE_SECONDS):
+    """Замеряет время этапа в гистограмму seabattle_stage_seconds"""
+    if not histogram.registry.enabled:
+        return _NOOP_SPAN
+    return _Span(histogram, (stage,))
+
+
+def render():
+    return registry.render()
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,289 @@
+# coding: utf-8
+"""Пакетный разбор фраз.
+
+Под нагрузкой фразы разных пользователей приходят почти одновременно.
+MicroBatcher собирает их в пачку (до max_batch_size фраз или max_wait
+секунд от первой) и разбирает её одним вызовом: классификаторы sklearn
+и tensorflow считают все фразы одной матрицей. Остальные компоненты
+пайплайна проходят фразы по очереди, так что результат совпадает с
+router.parse. spaCy тоже разбирает фразы по одной: в spaCy 2.0
+nlp.pipe не записывает в doc.tensor выход NER, и doc.vector, из
+которого intent_featurizer_spacy берёт признаки, остаётся пустым.
+
+Пакетные обработчики опираются на внутренности компонентов rasa_nlu 0.12
+(REQUIRED_ATTRIBUTES). Если у компонента их нет, например в другой
+версии rasa, он разбирает фразы по одной через process.
+"""
+
+from __future__ import division, unicode_literals
+
+import collections
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from seabattle import metrics
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PROJECT = 'default'
+INTENT_RANKING_LENGTH = 10
+
+BATCH_SIZE = metrics.Histogram('seabattle_nlu_batch_size', 'Размер пачки фраз',
+                               buckets=(1, 2, 4, 8, 16, 32, 64))
+QUEUE_DELAY = metrics.Histogram('seabattle_nlu_queue_delay_seconds', 'Ожидание фразы в очереди до разбора пачки')
+
+
+def _stack_features(messages):
+    import numpy as np
+    return np.vstack([m.get('text_features').reshape(1, -1) for m in messages])
+
+
+def _set_intent(message, names, confidences):
+    ranking = [{'name': name, 'confidence': confidence}
+               for name, confidence in list(zip(names, confidences))[:INTENT_RANKING_LENGTH]]
+    intent = ranking[0] if ranking else {'name': None, 'confidence': 0.0}
+    message.set('intent', intent, add_to_output=True)
+    message.set('intent_ranking', ranking, add_to_output=True)
+
+
+def _process_sklearn(component, messages, context):
+    import numpy as np
+    if not component.clf:
+        for message in messages:
+            message.set('intent', None, add_to_output=True)
+            message.set('intent_ranking', [], add_to_output=True)
+        return
+    probabilities = component.predict_prob(_stack_features(messages))
+    for message, row in zip(messages, probabilities):
+        order = np.argsort(row)[::-1]
+        _set_intent(message, list(component.transform_labels_num2str(order)), list(row[order]))
+
+
+def _process_embedding(component, messages, context):
+    if component.session is None:
+        for message in messages:
+            component.process(message, **context)
+        return
+    X = _stack_features(messages)
+    similarities = component.session.run(component.similarity_op, feed_dict={
+        component.embedding_placeholder: X,
+        component.intent_placeholder: component._create_all_Y(X.shape[0]),
+    })
+    for message, row in zip(messages, similarities):
+        order = row.argsort()[::-1]
+        _set_intent(message, [component.inv_intent_dict[i] for i in order], row[order].tolist())
+
+
+# компоненты, которые умеют обрабатывать пачку целиком
+BATCH_PROCESSORS = {
+    'intent_classifier_sklearn': _process_sklearn,
+    'intent_classifier_tensorflow_embedding': _process_embedding,
+}
+
+# атрибуты компонентов rasa_nlu 0.12, которыми пользуются пакетные обработчики
+REQUIRED_ATTRIBUTES = {
+    'intent_classifier_sklearn': ('clf', 'predict_prob', 'transform_labels_num2str'),
+    'intent_classifier_tensorflow_embedding': ('session', 'similarity_op', 'embedding_placeholder',
+                                               'intent_placeholder', '_create_all_Y', 'inv_intent_dict'),
+}
+
+_unbatched = set()
+
+
+def batch_processor(component):
+    """Пакетный обработчик компонента или None, если его нет или у компонента не те внутренности"""
+    processor = BATCH_PROCESSORS.get(component.name)
+    if processor is None:
+        return None
+    missing = [name for name in REQUIRED_ATTRIBUTES.get(component.name, ()) if not hasattr(component, name)]
+    if missing:
+        if component.name not in _unbatched:
+            _unbatched.add(component.name)
+            log.warning('%s has no %s, parsing messages one by one', component.name, ', '.join(missing))
+        return None
+    return processor
+
+
+def interpreter_parse_batch(interpreter, texts, timer=None):
+    """Пакетная версия Interpreter.parse: компоненты по очереди, каждый над всей пачкой.
+
+    timer(имя компонента, секунды, число фраз) вызывается после каждого компонента.
+    """
+    from rasa_nlu.training_data import Message
+
+    messages = [Message(text, interpreter.default_output_attributes()) for text in texts if text]
+    for component in interpreter.pipeline:
+        started = time.time()
+        processor = batch_processor(component)
+        if processor is not None:
+            processor(component, messages, interpreter.context)
+        else:
+            for message in messages:
+                component.process(message, **interpreter.context)
+        if timer is not None and messages:
+            timer(component.name, time.time() - started, len(messages))
+
+    outputs = []
+    messages = iter(messages)
+    for text in texts:
+        output = interpreter.default_output_attributes()
+        if text:
+            output.update(next(messages).as_dict(only_output_properties=True))
+        else:
+            output['text'] = ''
+        outputs.append(output)
+    return outputs
+
+
+def _interpreter(router, project=DEFAULT_PROJECT):
+    """Загруженный Interpreter проекта или None, если модель ещё не загружалась.
+
+    Использует внутренности rasa_nlu 0.12 (Project._models), поэтому при
+    любом несовпадении возвращаем None и разбираем фразы по одной.
+    """
+    project_store = getattr(router, 'project_store', None)
+    if not hasattr(project_store, 'get'):
+        return None
+    models = getattr(project_store.get(project), '_models', None)
+    if not hasattr(models, 'values'):
+        return None
+    loaded = [interpreter for interpreter in models.values() if interpreter is not None]
+    if len(loaded) != 1 or not hasattr(loaded[0], 'pipeline'):
+        return None
+    return loaded[0]
+
+
+def router_parse_batch(router, texts):
+    """Разбирает пачку фраз; до загрузки модели или при нескольких моделях – по одной через router"""
+    parse_batch = getattr(router, 'parse_batch', None)
+    if parse_batch is not None:
+        # numpy_nlu.NumpyRouter разбирает пачку сам
+        return parse_batch(texts)
+    interpreter = _interpreter(router)
+    if interpreter is None:
+        return [router.parse(router.extract({'q': text})) for text in texts]
+    return interpreter_parse_batch(interpreter, texts)
+
+
+class BatchStats(object):
+    """Размеры пачек и время ожидания фраз в очереди"""
+
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.sizes = collections.Counter()
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, delays):
+        BATCH_SIZE.observe(len(delays))
+        for delay in delays:
+            QUEUE_DELAY.observe(delay)
+        with self._lock:
+            self.batches += 1
+            self.requests += len(delays)
+            self.sizes[len(delays)] += 1
+            self.queue_delay_total += sum(delays)
+            self.queue_delay_max = max([self.queue_delay_max] + delays)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'batch_sizes': dict(self.sizes),
+                'mean_queue_delay': self.queue_delay_total / self.requests if self.requests else 0.0,
+                'max_queue_delay': self.queue_delay_max,
+            }
+
+
+class _Request(object):
+    __slots__ = ('text', 'submitted', 'done', 'result', 'error')
+
+    def __init__(self, text, submitted):
+        self.text = text
+        self.submitted = submitted
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Собирает фразы из разных потоков в пачки для batch_parse(texts) -> responses.
+
+    parse блокирует вызывающий поток до готовности ответа; пачки
+    разбирает один фоновый поток.
+    """
+
+    def __init__(self, batch_parse, max_batch_size=16, max_wait=0.005, clock=time.time):
+        self.batch_parse = batch_parse
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.clock = clock
+        self.stats = BatchStats()
+
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='nlu-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def parse(self, text):
+        request = _Request(text, self.clock())
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stop(self):
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = self.clock() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self.clock()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._stopped = True
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = self.clock()
+            self.stats.add([started - r.submitted for r in batch])
+            try:
+                results = self.batch_parse([r.text for r in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                log.exception('Batch of %d messages failed', len(batch))
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,152 @@
+# coding: utf-8
+"""Кэш ответов NLU.
+
+Игроки повторяют одни и те же короткие фразы, поэтому ответы rasa
+запоминаются по нормализованному тексту. Кэш ограничен по размеру и
+может сохраняться на диск.
+
+DataRouter загружает модель один раз и не подхватывает новую, пока
+процесс не перезапустят, поэтому и кэш живёт столько же. Сохранённый на
+диск кэш помечен отпечатком каталога моделей и при запуске с другой
+моделью не загружается.
+"""
+
+from __future__ import unicode_literals
+
+import atexit
+import collections
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+
+from seabattle.fastpath import normalize
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10000
+
+
+def model_fingerprint(directory):
+    """Отпечаток каталога с моделями по путям, размерам и времени изменения файлов"""
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(('%s:%d:%d\n' % (os.path.relpath(path, directory), stat.st_size,
+                                           int(stat.st_mtime * 1000))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class NLUCache(object):
+    """LRU-кэш ответов router.parse по нормализованной фразе.
+
+    Отпечаток model_dir снимается один раз при создании. Если задан path,
+    содержимое читается оттуда, когда отпечаток совпадает, и записывается
+    методом save.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, model_dir=None, path=None):
+        self.max_size = max_size
+        self.model_dir = model_dir
+        self.path = path
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = model_fingerprint(model_dir) if model_dir else None
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, message):
+        key = normalize(message)
+        with self._lock:
+            response = self._entries.pop(key, None)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries[key] = response
+            self.hits += 1
+            return copy.deepcopy(response)
+
+    def put(self, message, response):
+        key = normalize(message)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = copy.deepcopy(response)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def parse(self, message, parser):
+        """Ответ из кэша или parser(нормализованная фраза) с сохранением результата"""
+        response = self.get(message)
+        if response is None:
+            response = parser(normalize(message))
+            self.put(message, response)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(total) if total else 0.0,
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'fingerprint': self._fingerprint, 'entries': list(self._entries.items())}
+        tmp_path = '%s.tmp' % self.path
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False))
+        os.rename(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            log.exception('Can\'t read NLU cache from %s', self.path)
+            return
+        if data.get('fingerprint') != self._fingerprint:
+            log.info('NLU cache in %s was built for another model, ignoring it', self.path)
+            return
+        with self._lock:
+            for key, response in data['entries'][-self.max_size:]:
+                self._entries[key] = response
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def from_env(model_dir, environ=os.environ):
+    """Создаёт кэш по переменным окружения.
+
+    NLU_CACHE_SIZE – число фраз в кэше (0 – без кэша),
+    NLU_CACHE_PATH – файл, в который кэш сохраняется при выходе.
+    """
+    max_size = int(environ.get('NLU_CACHE_SIZE', DEFAULT_MAX_SIZE))
+    if not max_size:
+        return None
+    cache = NLUCache(max_size, model_dir=model_dir, path=environ.get('NLU_CACHE_PATH'))
+    if cache.path:
+        atexit.register(cache.save)
+    return cache
@@ -0,0 +1,367 @@
+# coding: utf-8
+"""Экспорт обученной модели NLU в артефакт для seabattle.numpy_nlu.
+
+    python -m seabattle.nlu_export --path mldata/ --out mldata/numpy/
+
+Загружает последнюю модель проекта (или --model) и разбирает ею фразы
+обучающей выборки и --extra (по фразе на строку). Классификатор
+намерений numpy_nlu обучается гребневой регрессией повторять оценки
+модели по всем намерениям на этих фразах; веса атрибутов и переходов
+ner_crf переносятся как есть. Готовый артефакт открывается через
+NumpyRouter и проверяется на тех же фразах: токены совпадают с
+токенами spaCy, намерение то же и по ту же сторону порога уверенности
+DialogManager, сущности те же.
+
+Совпадение на фразах обучения не говорит, как модель поведёт себя на
+новых, поэтому согласие с rasa меряется и на отложенных фразах: каждая
+часть из --folds (с одинаковой долей намерений) разбирается моделью,
+обученной без неё, а фразы --holdout – итоговой моделью, которая их не
+видела. Доля отложенных фраз без расхождений записывается в meta.json
+(validation.heldout_agreement). Если на фразах обучения что-то не
+совпало или согласие ниже --min-agreement, артефакт не сохраняется
+(--force сохраняет всё равно).
+
+Использует внутренности rasa_nlu 0.12: компоненты Interpreter.pipeline,
+CRF из sklearn_crfsuite в ner_crf.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from seabattle import numpy_nlu
+from seabattle.evaluate import CONFIDENCE_THRESHOLD, stratified_folds
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ALPHA = 1e-3
+DEFAULT_FOLDS = 5
+DEFAULT_MIN_AGREEMENT = 0.9
+# уверенность сущности может разойтись с rasa на ошибку округления float32
+ENTITY_CONFIDENCE_TOLERANCE = 1e-4
+
+
+def find_model(path, project=numpy_nlu.DEFAULT_PROJECT):
+    """Последний каталог модели проекта с metadata.json или None"""
+    project_dir = os.path.join(path, project)
+    if not os.path.isdir(project_dir):
+        return None
+    candidates = []
+    for name in os.listdir(project_dir):
+        metadata = os.path.join(project_dir, name, 'metadata.json')
+        if os.path.isfile(metadata):
+            candidates.append((os.path.getmtime(metadata), os.path.join(project_dir, name)))
+    return max(candidates)[1] if candidates else None
+
+
+def _component(interpreter, name):
+    for component in interpreter.pipeline:
+        if component.name == name:
+            return component
+    return None
+
+
+def teacher_scores(outputs):
+    """Имена намерений и матрица оценок модели (фразы × намерения) по intent_ranking"""
+    intents = set()
+    for output in outputs:
+        intents.update(item['name'] for item in output.get('intent_ranking') or [] if item['name'])
+        if (output.get('intent') or {}).get('name'):
+            intents.add(output['intent']['name'])
+    intents = sorted(intents)
+    index = dict((name, i) for i, name in enumerate(intents))
+
+    scores = np.zeros((len(outputs), len(intents)))
+    for row, output in enumerate(outputs):
+        ranking = output.get('intent_ranking') or [output['intent']]
+        known = dict((item['name'], item['confidence']) for item in ranking if item['name'] in index)
+        # намерения, не попавшие в ranking, получают худшую оценку фразы
+        scores[row] = min(known.values()) if known else 0.0
+        for name, confidence in known.items():
+            scores[row, index[name]] = confidence
+    return intents, scores
+
+
+def fit_intents(token_lists, scores, alpha=DEFAULT_ALPHA):
+    """Словарь признаков, веса и сдвиг линейной модели, повторяющей scores.
+
+    Фраз мало, а признаков много, поэтому задача решается в двойственной
+    форме: W = Xᵀ (X Xᵀ + alpha I)⁻¹ (Y - среднее).
+    """
+    features = sorted(set(name for tokens in token_lists for name in numpy_nlu.intent_features(tokens)))
+    index = dict((name, i) for i, name in enumerate(features))
+    X = np.zeros((len(token_lists), len(features)))
+    for row, tokens in enumerate(token_lists):
+        indices, values = numpy_nlu.intent_vector(tokens, index)
+        X[row, indices] = values
+
+    bias = scores.mean(axis=0)
+    dual = np.linalg.solve(X.dot(X.T) + alpha * np.eye(len(token_lists)), scores - bias)
+    return features, X.T.dot(dual), bias
+
+
+def export_crf(component):
+    """Описание для meta.json, веса атрибутов (атрибуты × метки) и переходов ner_crf"""
+    config = component.component_config
+    features = [list(group) for group in config['features']]
+    unsupported = set(name for group in features for name in group) - set(numpy_nlu.CRF_FEATURES)
+    if unsupported:
+        raise ValueError('ner_crf features %s are not supported' % ', '.join(sorted(unsupported)))
+    if not config.get('BILOU_flag'):
+        raise ValueError('ner_crf without BILOU_flag is not supported')
+
+    crf = component.ent_tagger
+    labels = list(crf.classes_)
+    label_index = dict((label, i) for i, label in enumerate(labels))
+    attributes = sorted(set(attribute for attribute, _ in crf.state_features_))
+    attribute_index = dict((attribute, i) for i, attribute in enumerate(attributes))
+
+    state = np.zeros((len(attributes), len(labels)))
+    for (attribute, label), weight in crf.state_features_.items():
+        state[attribute_index[attribute], label_index[label]] = weight
+    transitions = np.zeros((len(labels), len(labels)))
+    for (previous, following), weight in crf.transition_features_.items():
+        transitions[label_index[previous], label_index[following]] = weight
+
+    meta = {
+        'labels': labels,
+        'attributes': attributes,
+        'features': features,
+        'pos_features': any('pos' in group or 'pos2' in group for group in features),
+        # у xx_ent_wiki_sm нет теггера: тег каждого токена пустой, это проверяется при экспорте
+        'pos_value': '',
+    }
+    return meta, state, transitions
+
+
+def _spacy_tokens(component, text):
+    if not component.component_config.get('case_sensitive'):
+        text = text.lower()
+    return [(token.text, token.idx, token.tag_) for token in component.nlp(text)]
+
+
+def _write_meta(directory, meta):
+    with io.open(os.path.join(directory, numpy_nlu.META), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(meta, indent=2, sort_keys=True, ensure_ascii=False))
+
+
+def _write(directory, meta, arrays):
+    os.makedirs(directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), np.asarray(array, dtype=np.float32))
+    _write_meta(directory, meta)
+
+
+def _entity_key(entity):
+    return entity['entity'], entity['start'], entity['end'], entity['value']
+
+
+def compare(expected, actual, threshold=CONFIDENCE_THRESHOLD):
+    """Расхождения ответа NumpyRouter с ответом модели rasa для одной фразы"""
+    problems = []
+    expected_intent, actual_intent = expected.get('intent') or {}, actual.get('intent') or {}
+    if expected_intent.get('name') != actual_intent.get('name'):
+        problems.append('intent %s != %s' % (actual_intent.get('name'), expected_intent.get('name')))
+    elif (expected_intent.get('confidence', 0.0) >= threshold) != (actual_intent.get('confidence', 0.0) >= threshold):
+        problems.append('confidence %.3f vs %.3f across threshold %.2f' % (
+            actual_intent.get('confidence', 0.0), expected_intent.get('confidence', 0.0), threshold))
+
+    expected_entities = dict((_entity_key(e), e) for e in expected.get('entities') or [])
+    actual_entities = dict((_entity_key(e), e) for e in actual.get('entities') or [])
+    if set(expected_entities) != set(actual_entities):
+        problems.append('entities %s != %s' % (sorted(actual_entities), sorted(expected_entities)))
+    else:
+        for key, entity in expected_entities.items():
+            difference = abs(entity.get('confidence', 0.0) - actual_entities[key].get('confidence', 0.0))
+            if difference > ENTITY_CONFIDENCE_TOLERANCE:
+                problems.append('entity %s confidence differs by %.6f' % (key[0], difference))
+    return problems
+
+
+class ExportResult(object):
+    """Итог экспорта: расхождения на фразах обучения и на отложенных фразах"""
+
+    def __init__(self):
+        # {фраза: [расхождения]} на фразах, на которых обучалась модель
+        self.problems = {}
+        # то же на отложенных фразах
+        self.heldout = {}
+        self.heldout_total = 0
+        self.saved = False
+
+    @property
+    def agreement(self):
+        """Доля отложенных фраз без расхождений или None, если их не было"""
+        if not self.heldout_total:
+            return None
+        return 1 - len(self.heldout) / self.heldout_total
+
+
+def cross_validate(texts, token_lists, expected, intents, scores, folds=DEFAULT_FOLDS, alpha=DEFAULT_ALPHA,
+                   threshold=CONFIDENCE_THRESHOLD, seed=0):
+    """{фраза: [расхождения]} для фраз, разобранных моделью, обученной без их части, и число таких фраз"""
+    problems = {}
+    total = 0
+    if folds < 2 or len(texts) < folds:
+        return problems, total
+    splits = stratified_folds(list(range(len(texts))), folds, seed, label=lambda i: expected[i]['intent']['name'])
+    for train, test in splits:
+        if not train or not test:
+            continue
+        features, weights, bias = fit_intents([token_lists[i] for i in train], scores[train], alpha)
+        index = dict((name, i) for i, name in enumerate(features))
+        predicted = numpy_nlu.intent_scores([token_lists[i] for i in test], index, weights, bias)
+        for i, row in zip(test, predicted):
+            # сущности размечает та же CRF, что и в rasa, поэтому сравнивается только намерение
+            intent, _ = numpy_nlu.rank_intents(intents, row)
+            found = compare({'intent': expected[i]['intent']}, {'intent': intent}, threshold)
+            if found:
+                problems[texts[i]] = found
+            total += 1
+    return problems, total
+
+
+def export(interpreter, texts, out, model_name=None, alpha=DEFAULT_ALPHA, force=False,
+           threshold=CONFIDENCE_THRESHOLD, holdout=(), folds=DEFAULT_FOLDS, min_agreement=DEFAULT_MIN_AGREEMENT):
+    """Строит артефакт из interpreter на texts, проверяет его и кладёт в out.
+
+    holdout – фразы только для проверки. Возвращает ExportResult; при
+    расхождениях на texts или согласии на отложенных фразах ниже
+    min_agreement артефакт без force не сохраняется.
+    """
+    out = out.rstrip(os.sep)
+    texts = sorted(set(text for text in texts if text))
+    holdout = sorted(set(text for text in holdout if text) - set(texts))
+    expected = [interpreter.parse(text) for text in texts]
+    nlp = _component(interpreter, 'nlp_spacy')
+    case_sensitive = bool(nlp is not None and nlp.component_config.get('case_sensitive'))
+    token_lists = [numpy_nlu.tokenize(text if case_sensitive else text.lower()) for text in texts]
+
+    result = ExportResult()
+    problems = result.problems
+    crf_component = _component(interpreter, 'ner_crf')
+    crf_meta = None
+    arrays = {}
+    if crf_component is not None:
+        crf_meta, arrays['crf_state'], arrays['crf_transitions'] = export_crf(crf_component)
+
+    if nlp is not None:
+        for text, tokens in zip(texts, token_lists):
+            spacy_tokens = _spacy_tokens(nlp, text)
+            if [(t, i) for t, i, _ in spacy_tokens] != tokens:
+                problems.setdefault(text, []).append('tokens %s != spaCy %s' % (
+                    [t for t, _ in tokens], [t for t, _, _ in spacy_tokens]))
+            if crf_meta is not None and crf_meta['pos_features'] and any(tag for _, _, tag in spacy_tokens):
+                raise ValueError('ner_crf pos features need a spaCy model without a tagger')
+
+    intents, scores = teacher_scores(expected)
+    result.heldout, result.heldout_total = cross_validate(texts, token_lists, expected, intents, scores, folds,
+                                                          alpha, threshold)
+    features, arrays['intent_weights'], arrays['intent_bias'] = fit_intents(token_lists, scores, alpha)
+    meta = {
+        'version': numpy_nlu.VERSION,
+        'model': model_name,
+        'created': datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+        'case_sensitive': case_sensitive,
+        'intents': intents,
+        'features': features,
+        'crf': crf_meta,
+    }
+
+    build_dir = out + '.building'
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    _write(build_dir, meta, arrays)
+
+    router = numpy_nlu.NumpyRouter(build_dir)
+    for text, output, actual in zip(texts, expected, router.parse_batch(texts)):
+        found = compare(output, actual, threshold)
+        if found:
+            problems.setdefault(text, []).extend(found)
+    for text, actual in zip(holdout, router.parse_batch(holdout)):
+        found = compare(interpreter.parse(text), actual, threshold)
+        if found:
+            result.heldout[text] = found
+        result.heldout_total += 1
+
+    meta['validation'] = {
+        'texts': len(texts),
+        'folds': folds,
+        'holdout_texts': len(holdout),
+        'heldout_texts': result.heldout_total,
+        'heldout_agreement': result.agreement,
+    }
+    _write_meta(build_dir, meta)
+
+    agreed = result.agreement is not None and result.agreement >= min_agreement
+    if (problems or not agreed) and not force:
+        shutil.rmtree(build_dir)
+        return result
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    os.rename(build_dir, out)
+    result.saved = True
+    return result
+
+
+def _read_lines(path):
+    with io.open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Экспорт модели NLU в артефакт для numpy_nlu')
+    parser.add_argument('--path', default='mldata/')
+    parser.add_argument('--project', default=numpy_nlu.DEFAULT_PROJECT)
+    parser.add_argument('--model', default=None, help='каталог модели, по умолчанию последняя модель проекта')
+    parser.add_argument('--data', default='config/intents_config.json')
+    parser.add_argument('--extra', default=None, help='файл с дополнительными фразами для обучения и проверки')
+    parser.add_argument('--holdout', default=None, help='файл с фразами только для проверки')
+    parser.add_argument('--out', default='mldata/numpy/')
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA)
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS)
+    parser.add_argument('--min-agreement', type=float, default=DEFAULT_MIN_AGREEMENT,
+                        help='наименьшая доля отложенных фраз, на которых артефакт согласен с моделью')
+    parser.add_argument('--force', action='store_true', help='сохранить артефакт, даже если он расходится с моделью')
+    args = parser.parse_args(argv)
+
+    from rasa_nlu.model import Interpreter
+    from rasa_nlu.training_data import load_data
+
+    logging.basicConfig(level=logging.INFO)
+    model_dir = args.model or find_model(args.path, args.project)
+    if model_dir is None:
+        parser.error('no trained model in %s' % args.path)
+    texts = [example.text for example in load_data(args.data).training_examples]
+    if args.extra:
+        texts.extend(_read_lines(args.extra))
+    holdout = _read_lines(args.holdout) if args.holdout else ()
+
+    result = export(Interpreter.load(model_dir), texts, args.out, os.path.basename(model_dir.rstrip(os.sep)),
+                    args.alpha, args.force, holdout=holdout, folds=args.folds, min_agreement=args.min_agreement)
+    for text in sorted(result.problems):
+        print('%s: %s' % (text, '; '.join(result.problems[text])))
+    for text in sorted(result.heldout):
+        print('held out %s: %s' % (text, '; '.join(result.heldout[text])))
+    if result.agreement is None:
+        print('no held-out phrases, use --folds or --holdout')
+    else:
+        print('agreement on %d held-out phrases: %.3f' % (result.heldout_total, result.agreement))
+    if not result.saved:
+        print('%d phrases differ from %s, artifact is not saved' % (len(result.problems), model_dir))
+        sys.exit(1)
+    log.info('Artifact saved to %s', args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+# coding: utf-8
+"""Разбор фраз обученной моделью без rasa_nlu, spaCy и TensorFlow.
+
+Артефакт собирает seabattle.nlu_export из модели в mldata/. Это каталог
+с meta.json (словари признаков и атрибутов CRF, имена намерений и меток)
+и матрицами .npy, которые открываются через mmap: загрузка занимает
+миллисекунды, а процессы prefork делят одни и те же страницы памяти.
+
+Намерение считает линейная модель над словами, парами слов и
+буквенными n-граммами – она обучена повторять оценки классификатора
+rasa (дистилляция), поэтому уверенность сравнима с порогом
+DialogManager. Сущности размечаются CRF с весами из ner_crf: признаки
+токенов, маргинальные вероятности меток и разбор BILOU повторяют
+rasa_nlu 0.12. Токенизация приближает правила spaCy; совпадение
+токенов, намерений и сущностей с исходной моделью проверяется при
+экспорте.
+
+NumpyRouter отвечает на extract/parse так же, как DataRouter, поэтому
+подключается в dialog_manager переменной NLU_ARTIFACT.
+"""
+
+from __future__ import division, unicode_literals
+
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+
+META = 'meta.json'
+VERSION = 1
+DEFAULT_PROJECT = 'default'
+INTENT_RANKING_LENGTH = 10
+
+# слова, числа и знаки препинания; дефис, точка и запятая внутри слова пока не разделяют его
+_CHUNK = re.compile(r'\w+(?:[-.,:/]\w+)*|[^\w\s]', re.UNICODE)
+# инфиксы spaCy: знак между цифрами, дефис, точка или запятая между буквами
+_INFIX = re.compile(r'(?<=\d)[-+*^](?=\d)|(?<=[^\W\d_])[-.,](?=[^\W\d_])', re.UNICODE)
+
+
+def tokenize(text):
+    """[(токен, смещение)] по правилам, близким к токенизатору spaCy"""
+    tokens = []
+    for chunk in _CHUNK.finditer(text):
+        start = chunk.start()
+        position = 0
+        word = chunk.group()
+        for infix in _INFIX.finditer(word):
+            if infix.start() > position:
+                tokens.append((word[position:infix.start()], start + position))
+            tokens.append((infix.group(), start + infix.start()))
+            position = infix.end()
+        tokens.append((word[position:], start + position))
+    return tokens
+
+
+def intent_features(tokens):
+    """Признаки фразы для классификатора намерений: {имя: вес}"""
+    words = [token.lower() for token, _ in tokens]
+    features = {}
+    for i, word in enumerate(words):
+        names = ['w:' + word]
+        if i:
+            names.append('b:%s %s' % (words[i - 1], word))
+        padded = '<%s>' % word
+        for n in (2, 3, 4):
+            names.extend('c:' + padded[j:j + n] for j in range(len(padded) - n + 1))
+        for name in names:
+            features[name] = features.get(name, 0.0) + 1.0
+    return features
+
+
+def intent_vector(tokens, index):
+    """Номера известных признаков фразы по словарю index и их веса, нормированные на единичную длину"""
+    known = sorted((index[name], value) for name, value in intent_features(tokens).items() if name in index)
+    if not known:
+        return [], np.zeros(0)
+    indices, values = zip(*known)
+    values = np.array(values)
+    return list(indices), values / np.sqrt((values ** 2).sum())
+
+
+# признаки токена ner_crf; токен – (текст, тег spaCy)
+CRF_FEATURES = {
+    'low': lambda token: token[0].lower(),
+    'title': lambda token: token[0].istitle(),
+    'word3': lambda token: token[0][-3:],
+    'word2': lambda token: token[0][-2:],
+    'pos': lambda token: token[1],
+    'pos2': lambda token: token[1][:2],
+    'bias': lambda token: 'bias',
+    'upper': lambda token: token[0].isupper(),
+    'digit': lambda token: token[0].isdigit(),
+}
+
+
+def crf_attributes(tokens, features):
+    """Атрибуты crfsuite для каждого токена: [[(атрибут, значение)]].
+
+    Окно вокруг токена задаёт features, как в CRFEntityExtractor._sentence_to_features;
+    строковый признак превращается в атрибут «имя:значение» с весом 1.
+    """
+    half_span = len(features) // 2
+    result = []
+    for index in range(len(tokens)):
+        attributes = {}
+        for offset in range(-half_span, half_span + 1):
+            if index + offset >= len(tokens):
+                attributes['EOS'] = True
+            elif index + offset < 0:
+                attributes['BOS'] = True
+            else:
+                token = tokens[index + offset]
+                for name in features[offset + half_span]:
+                    attributes['%d:%s' % (offset, name)] = CRF_FEATURES[name](token)
+        items = []
+        for name, value in attributes.items():
+            if isinstance(value, (bool, int, float)):
+                items.append((name, float(value)))
+            else:
+                items.append(('%s:%s' % (name, value), 1.0))
+        result.append(items)
+    return result
+
+
+def _logsumexp(values, axis):
+    top = values.max(axis=axis)
+    return top + np.log(np.exp(values - np.expand_dims(top, axis)).sum(axis=axis))
+
+
+def crf_marginals(state, transitions):
+    """Маргинальные вероятности меток линейной CRF прямым и обратным проходом.
+
+    state – (токены × метки) суммы весов атрибутов, transitions – (метка × следующая метка).
+    """
+    length = state.shape[0]
+    alpha = np.empty_like(state)
+    beta = np.zeros_like(state)
+    alpha[0] = state[0]
+    for t in range(1, length):
+        alpha[t] = state[t] + _logsumexp(alpha[t - 1][:, None] + transitions, axis=0)
+    for t in range(length - 2, -1, -1):
+        beta[t] = _logsumexp(transitions + (state[t + 1] + beta[t + 1])[None, :], axis=1)
+    log_z = _logsumexp(alpha[-1], axis=0)
+    return np.exp(alpha + beta - log_z)
+
+
+def _bilou(label):
+    if len(label) >= 2 and label[1] == '-':
+        return label[0].upper()
+    return None
+
+
+def bilou_entities(labels, marginals):
+    """(первый токен, последний токен, сущность, уверенность) как в CRFEntityExtractor с BILOU_flag"""
+
+    def most_likely(index):
+        if index >= len(marginals):
+            return '', 0.0
+        row = marginals[index]
+        best = int(row.argmax())
+        label = labels[best]
+        # вероятности B-, I-, L- и U- одной сущности складываются
+        return label, float(sum(p for l, p in zip(labels, row) if l[2:] == label[2:]))
+
+    spans = []
+    index = 0
+    while index < len(marginals):
+        label, confidence = most_likely(index)
+        tag = _bilou(label)
+        end = None
+        if tag == 'U':
+            end = index
+        elif tag == 'B':
+            end = index + 1
+            while True:
+                following, following_confidence = most_likely(end)
+                confidence = min(confidence, following_confidence)
+                if _bilou(following) == 'L':
+                    break
+                elif _bilou(following) == 'I':
+                    end += 1
+                else:
+                    # сущность не закрыта меткой L
+                    end -= 1
+                    break
+        if end is None:
+            index += 1
+            continue
+        spans.append((index, end, label[2:], confidence))
+        index = end + 1
+    return spans
+
+
+def intent_scores(token_lists, index, weights, bias):
+    """Оценки намерений (фразы × намерения) линейной моделью со словарём признаков index"""
+    scores = np.tile(np.asarray(bias, dtype=np.float64), (len(token_lists), 1))
+    for row, tokens in enumerate(token_lists):
+        indices, values = intent_vector(tokens, index)
+        if indices:
+            scores[row] += values.dot(weights[indices])
+    return scores
+
+
+def rank_intents(intents, scores):
+    """Лучшее намерение и intent_ranking по строке оценок"""
+    order = np.argsort(-scores, kind='mergesort')[:INTENT_RANKING_LENGTH]
+    ranking = [{'name': intents[i], 'confidence': min(1.0, float(scores[i]))} for i in order]
+    intent = ranking[0] if ranking else {'name': None, 'confidence': 0.0}
+    return intent, ranking
+
+
+def _open(path, name):
+    return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+
+class NumpyModel(object):
+    """Артефакт seabattle.nlu_export, открытый через mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with io.open(os.path.join(path, META), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != VERSION:
+            raise ValueError('Unsupported artifact version %r in %s' % (self.meta.get('version'), path))
+
+        self.intents = self.meta['intents']
+        self.features = dict((name, i) for i, name in enumerate(self.meta['features']))
+        self.intent_weights = _open(path, 'intent_weights')
+        self.intent_bias = _open(path, 'intent_bias')
+
+        self.crf = self.meta.get('crf')
+        if self.crf is not None:
+            self.crf_labels = self.crf['labels']
+            self.crf_index = dict((name, i) for i, name in enumerate(self.crf['attributes']))
+            self.crf_state = _open(path, 'crf_state')
+            self.crf_transitions = np.array(_open(path, 'crf_transitions'), dtype=np.float64)
+
+    def intent_scores(self, token_lists):
+        """Оценки намерений (фразы × намерения) для пачки токенизированных фраз"""
+        return intent_scores(token_lists, self.features, self.intent_weights, self.intent_bias)
+
+    def intent(self, scores):
+        return rank_intents(self.intents, scores)
+
+    def entities(self, text, tokens):
+        if self.crf is None or not tokens:
+            return []
+        crf_tokens = [(token, self.crf.get('pos_value', '')) for token, _ in tokens]
+        state = np.zeros((len(tokens), len(self.crf_labels)))
+        for t, attributes in enumerate(crf_attributes(crf_tokens, self.crf['features'])):
+            for name, value in attributes:
+                index = self.crf_index.get(name)
+                if index is not None and value:
+                    state[t] += value * self.crf_state[index]
+        marginals = crf_marginals(state, self.crf_transitions)
+
+        entities = []
+        for first, last, entity, confidence in bilou_entities(self.crf_labels, marginals):
+            start = tokens[first][1]
+            end = tokens[last][1] + len(tokens[last][0])
+            if self.crf.get('pos_features'):
+                # документ spaCy: значение – отрезок текста
+                value = text[start:end]
+            else:
+                # токены rasa: значение склеивается из токенов без пробелов
+                value = ''.join(token for token, _ in tokens[first:last + 1])
+            entities.append({'start': start, 'end': end, 'value': value, 'entity': entity,
+                             'confidence': confidence, 'extractor': 'ner_crf'})
+        return entities
+
+    def parse_batch(self, texts):
+        texts = [text or '' for text in texts]
+        if not self.meta.get('case_sensitive'):
+            texts = [text.lower() for text in texts]
+        token_lists = [tokenize(text) for text in texts]
+        scores = self.intent_scores(token_lists)
+        outputs = []
+        for text, tokens, row in zip(texts, token_lists, scores):
+            intent, ranking = self.intent(row)
+            outputs.append({'intent': intent, 'intent_ranking': ranking,
+                            'entities': self.entities(text, tokens)})
+        return outputs
+
+
+class NumpyRouter(object):
+    """Замена rasa DataRouter для dialog_manager: extract, parse и пакетный parse_batch"""
+
+    def __init__(self, path):
+        self.model = NumpyModel(path)
+        self.model_name = self.model.meta.get('model')
+
+    def extract(self, data):
+        return {'text': data['q'], 'project': data.get('project', DEFAULT_PROJECT)}
+
+    def _output(self, text, parsed, project=DEFAULT_PROJECT):
+        parsed.update({'text': text, 'project': project, 'model': self.model_name})
+        return parsed
+
+    def parse(self, data):
+        return self._output(data['text'], self.model.parse_batch([data['text']])[0],
+                            data.get('project', DEFAULT_PROJECT))
+
+    def parse_batch(self, texts):
+        return [self._output(text, parsed) for text, parsed in zip(texts, self.model.parse_batch(texts))]
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import atexit
+import collections
+import logging
+import os
+import random
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from seabattle.bitboard import get_masks
+
+
+log = logging.getLogger(__name__)
+
+Placement = collections.namedtuple('Placement', ['ship', 'halo'])
+
+POOL_SIZE = int(os.environ.get('FIELD_POOL_SIZE', 32))
+
+_placements_cache = {}
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_placements(size, length):
+    """Все возможные положения корабля заданной длины на пустом поле.
+
+    ship – маска клеток корабля, halo – маска клеток корабля вместе с соседними,
+    которые после установки корабля становятся недоступны для остальных.
+    """
+    key = (size, length)
+    placements = _placements_cache.get(key)
+    if placements is not None:
+        return placements
+
+    masks = get_masks(size)
+    directions = [1] if length == 1 else [1, size]
+    placements = []
+    for index in range(size ** 2):
+        x, y = index % size, index // size
+        for direction in directions:
+            if direction == 1 and x + length > size or direction == size and y + length > size:
+                continue
+
+            ship = halo = 0
+            for i in range(length):
+                cell = index + direction * i
+                ship |= 1 << cell
+                halo |= masks.neighbours[cell]
+            placements.append(Placement(ship, halo | ship))
+
+    placements = tuple(placements)
+    _placements_cache[key] = placements
+    return placements
+
+
+def generate_ships_mask(size, ships, rng=random):
+    """Расставляет корабли, выбирая каждый раз только из оставшихся допустимых положений"""
+    while True:
+        blocked = ships_mask = 0
+        for length in sorted(ships, reverse=True):
+            valid = [p for p in get_placements(size, length) if not p.ship & blocked]
+            if not valid:
+                # тупик: оставшиеся корабли уже некуда поставить, начинаем заново
+                break
+            placement = rng.choice(valid)
+            blocked |= placement.halo
+            ships_mask |= placement.ship
+        else:
+            return ships_mask
+
+
+def generate_field(size, ships, rng=random):
+    """Возвращает поле списком: 1 – клетка корабля, 0 – пустая клетка"""
+    ships_mask = generate_ships_mask(size, ships, rng)
+    return [1 if ships_mask >> i & 1 else 0 for i in range(size ** 2)]
+
+
+class FieldPool(object):
+    """Пул заранее сгенерированных полей, который пополняется в фоновом потоке"""
+
+    def __init__(self, size, ships, capacity=POOL_SIZE):
+        self.size = size
+        self.ships = list(ships)
+        self.capacity = capacity
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        # свой генератор, чтобы фоновый поток не сбивал последовательность
+        # глобального random в коде, который его сидирует
+        self._random = random.Random()
+
+    def _generate(self):
+        return generate_field(self.size, self.ships, self._random)
+
+    def _refill(self):
+        try:
+            while not self._stopped:
+                self._queue.put(self._generate())
+        except:  # noqa: E722
+            # при остановке интерпретатора модули и даже builtins уже выгружены,
+            # поэтому ловим всё без поиска имён и молча завершаемся
+            if not self._stopped:
+                raise
+
+    def stop(self):
+        self._stopped = True
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.capacity > 0:
+                self._thread = threading.Thread(target=self._refill, name='field-pool-%d' % self.size)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def take(self):
+        self.start()
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            log.debug('Field pool is empty, generating field synchronously')
+            return self._generate()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+def get_pool(size, ships):
+    key = (size, tuple(ships))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = FieldPool(size, ships)
+    return pool
+
+
+@atexit.register
+def _stop_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.stop()
+
+
+def reset_pools():
+    """Забывает пулы: после fork их потоки не работают, а генераторы совпадают с родительскими"""
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    _pools.clear()
+
+
+def take_field(size, ships):
+    return get_pool(size, ships).take()
@@ -0,0 +1,288 @@
+# coding: utf-8
+"""Сервер из нескольких процессов с одной загрузкой модели.
+
+    SESSION_DB=/data/sessions.db python -m seabattle.prefork --port 5000 --workers 8
+
+Родитель импортирует api.py, загружает и прогревает модель, открывает
+сокет и только потом запускает воркеры через fork. Страницы с моделью
+остаются общими, пока их никто не меняет (copy-on-write), поэтому
+каждый следующий воркер стоит только своей собственной памяти. Родитель
+перезапускает упавшие воркеры и периодически пишет в лог их память:
+USS (только своя), PSS и RSS из /proc/<pid>/smaps.
+
+Сессии должны лежать в SQLite: запросы одного пользователя попадают в
+разные процессы. Чистку сессий ведёт воркер с номером 0 на своём
+соединении с базой.
+
+Внутренние пулы потоков TensorFlow не переживают fork, поэтому модель
+целиком прогревается в родителе, только если это артефакт numpy_nlu
+(NLU_ARTIFACT) или в её pipeline нет компонентов TensorFlow. Иначе
+родитель загружает только spaCy (самую большую часть модели), а
+классификаторы, CRF и сессию TensorFlow каждый воркер загружает и
+прогревает сам после fork.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import errno
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import time
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REPORT_INTERVAL = 60
+# компоненты, чьи сессии и пулы потоков не переживают fork
+TENSORFLOW_COMPONENTS = frozenset(['intent_classifier_tensorflow_embedding'])
+
+
+def parse_smaps(lines):
+    """Суммирует Rss, Pss и частные страницы (USS) из smaps или smaps_rollup; значения в байтах"""
+    usage = {'rss': 0, 'pss': 0, 'uss': 0, 'shared': 0}
+    fields = {
+        'Rss:': 'rss', 'Pss:': 'pss',
+        'Private_Clean:': 'uss', 'Private_Dirty:': 'uss',
+        'Shared_Clean:': 'shared', 'Shared_Dirty:': 'shared',
+    }
+    for line in lines:
+        parts = line.split()
+        key = fields.get(parts[0]) if parts else None
+        if key is not None:
+            usage[key] += int(parts[1]) * 1024
+    return usage
+
+
+def memory_usage(pid):
+    """Память процесса по /proc или None, если её не узнать"""
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            with open('/proc/%d/%s' % (pid, name)) as f:
+                return parse_smaps(f)
+        except (IOError, OSError):
+            continue
+    return None
+
+
+def _mb(value):
+    return value / 1024.0 / 1024.0
+
+
+def format_memory(usage_by_pid):
+    lines = []
+    for pid, usage in sorted(usage_by_pid.items()):
+        if usage is None:
+            lines.append('%6d: n/a' % pid)
+        else:
+            lines.append('%6d: USS %7.1f MB, PSS %7.1f MB, RSS %7.1f MB' % (
+                pid, _mb(usage['uss']), _mb(usage['pss']), _mb(usage['rss'])))
+    return '\n'.join(lines)
+
+
+def fork_safe(environ=os.environ):
+    """Можно ли прогреть модель целиком до fork: артефакт numpy или pipeline без TensorFlow"""
+    from seabattle import dialog_manager as dm
+
+    if environ.get('NLU_ARTIFACT'):
+        return True
+    return not any(component.get('name') in TENSORFLOW_COMPONENTS
+                   for _, pipeline in dm.model_pipelines() for component in pipeline)
+
+
+def prepare_parent():
+    """Загружает до fork всё, что безопасно разделить; возвращает True, если воркерам нужно прогреться самим"""
+    from seabattle import dialog_manager as dm
+
+    if fork_safe():
+        dm.warmup()
+        return False
+    log.info('Pipeline uses TensorFlow: only spaCy is loaded before fork, workers load the rest themselves')
+    try:
+        dm.preload_spacy()
+    except Exception:
+        log.exception('Could not preload spaCy, workers will load the whole model')
+    return True
+
+
+def after_fork(slot=None, warmup=False):
+    """Приводит процесс, появившийся через fork, в рабочее состояние.
+
+    Свои генераторы случайных чисел (иначе все воркеры стреляют
+    одинаково), пулы полей, MicroBatcher, соединение с базой сессий и
+    блокировки. Воркер slot 0 чистит сессии, с warmup воркер сам
+    загружает и прогревает модель.
+    """
+    from seabattle import placement, session
+    from seabattle import dialog_manager as dm
+
+    random.seed()
+    placement.reset_pools()
+    dm.reset_after_fork()
+    if os.environ.get('SESSION_DB'):
+        session.reopen()
+        if slot == 0:
+            session.start_sweeper()
+    if warmup:
+        dm.warmup()
+
+
+def listen(host, port, backlog=128):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _serve(app, sock, threaded):
+    from werkzeug import serving
+
+    host, port = sock.getsockname()[:2]
+    server = serving.make_server(host, port, app, threaded=threaded, fd=sock.fileno())
+    server.serve_forever()
+
+
+class Arbiter(object):
+    """Запускает workers процессов с общим сокетом и перезапускает упавшие"""
+
+    def __init__(self, sock, app, workers=4, threaded=False, report_interval=DEFAULT_REPORT_INTERVAL,
+                 serve=_serve, warmup=False):
+        self.sock = sock
+        self.app = app
+        self.workers = workers
+        self.threaded = threaded
+        self.report_interval = report_interval
+        self.serve = serve
+        self.warmup = warmup
+        # номер места воркера: перезапущенный воркер занимает место упавшего
+        self.slots = {}
+        self._stopping = False
+
+    @property
+    def pids(self):
+        return set(self.slots)
+
+    def _free_slots(self):
+        taken = set(self.slots.values())
+        return [slot for slot in range(self.workers) if slot not in taken]
+
+    def spawn(self, slot=0):
+        pid = os.fork()
+        if pid:
+            self.slots[pid] = slot
+            return pid
+
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            after_fork(slot, self.warmup)
+            self.serve(self.app, self.sock, self.threaded)
+        except BaseException:
+            log.exception('Worker %d failed', os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def start(self):
+        # объекты, созданные до fork, сборщик мусора больше не обходит и не трогает их страницы;
+        # gc.freeze есть только с Python 3.7, на 2.7 сборщик по-прежнему пачкает общие страницы
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+        for slot in self._free_slots():
+            self.spawn(slot)
+        log.info('Started %d workers: %s', len(self.pids), ', '.join('%d' % pid for pid in sorted(self.pids)))
+
+    def reap(self):
+        """Забирает завершившиеся воркеры и запускает новые на их место"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            if not pid:
+                break
+            if pid in self.slots:
+                del self.slots[pid]
+                if not self._stopping:
+                    log.warning('Worker %d exited with status %d, restarting', pid, status)
+        if not self._stopping:
+            for slot in self._free_slots():
+                self.spawn(slot)
+
+    def memory(self):
+        return dict((pid, memory_usage(pid)) for pid in self.pids | {os.getpid()})
+
+    def stop(self, timeout=10):
+        self._stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.slots.pop(pid, None)
+        deadline = time.time() + timeout
+        while self.pids and time.time() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.pids):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.slots.pop(pid, None)
+
+    def run(self):
+        def _stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        self.start()
+        next_report = time.time()
+        while not self._stopping:
+            self.reap()
+            if self.report_interval and time.time() >= next_report:
+                log.info('Memory of parent %d and workers:\n%s', os.getpid(), format_memory(self.memory()))
+                next_report = time.time() + self.report_interval
+            time.sleep(0.5)
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Webhook навыка в нескольких процессах с общей моделью')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threaded', action='store_true', help='обрабатывать запросы в потоках внутри воркера')
+    parser.add_argument('--no-warmup', action='store_true', help='не загружать модель до fork')
+    parser.add_argument('--report-interval', type=float, default=DEFAULT_REPORT_INTERVAL,
+                        help='секунд между отчётами о памяти воркеров, 0 – не писать')
+    args = parser.parse_args(argv)
+
+    if not os.environ.get('SESSION_DB'):
+        parser.error('prefork needs SESSION_DB: memory sessions are not shared between processes')
+
+    # api не должен прогревать модель и чистить сессии в фоновых потоках: потоки не переживают fork
+    os.environ['NLU_WARMUP'] = '0'
+    os.environ['SESSION_SWEEPER'] = '0'
+    from seabattle import api
+
+    logging.getLogger().setLevel(logging.INFO)
+    worker_warmup = False
+    if not args.no_warmup:
+        worker_warmup = prepare_parent()
+        log.info('Parent memory before fork:\n%s', format_memory({os.getpid(): memory_usage(os.getpid())}))
+
+    sock = listen(args.host, args.port)
+    log.info('Listening on %s:%d', args.host, args.port)
+    Arbiter(sock, api.app, args.workers, args.threaded, args.report_interval, warmup=worker_warmup).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,423 @@
 
 from __future__ import unicode_literals
 
+import collections
+import contextlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
 
-_sessions = {}
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
+from seabattle import metrics, snapshot
+from seabattle.game import DensityGame, EndgameGame, Game
 
-def get(user_id):
-    session_obj = _sessions.get(user_id)
-    if not session_obj:
-        session_obj = {
-            'game': None,
-            'last': None,
-            'opponent': None,
-        }
-        _sessions[user_id] = session_obj
+
+log = logging.getLogger(__name__)
+
+# сессия без активности дольше TTL считается брошенной
+DEFAULT_TTL = 24 * 60 * 60
+# закончившуюся партию держим недолго, чтобы успеть ответить на повторные запросы
+DEFAULT_FINISHED_TTL = 10 * 60
+DEFAULT_LOCK_STRIPES = 256
+# как часто пересчитывать число сессий в SQLite для метрик
+DEFAULT_SIZE_INTERVAL = 60
+
+LOCKS = metrics.Counter('seabattle_session_locks_total', 'Захваты блокировок сессий', ['result'])
+LOCK_WAIT = metrics.Histogram('seabattle_session_lock_wait_seconds', 'Ожидание занятой блокировки сессии')
+
+
+def new_session():
+    return {
+        'game': None,
+        'last': None,
+        'opponent': None,
+        # последний ответ: повтор запроса с тем же message_id получает его же, а ход не повторяется
+        'reply': None,
+    }
+
+
+def is_finished(session_obj):
+    # сессия без партии – пользователь ещё выбирает соперника, она живёт как брошенная, по TTL
+    game = session_obj.get('game')
+    return game is not None and game.is_end_game()
+
+
+def dumps(session_obj):
+    """Сериализует сессию; стандартные игры кодируются компактным snapshot"""
+    game = session_obj.get('game')
+    if type(game) in (Game, DensityGame, EndgameGame):
+        session_obj = dict(session_obj, game=None, game_snapshot=snapshot.to_bytes(game))
+    return pickle.dumps(session_obj, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    session_obj = pickle.loads(data)
+    game_snapshot = session_obj.pop('game_snapshot', None)
+    if game_snapshot is not None:
+        session_obj['game'] = snapshot.from_bytes(game_snapshot)
     return session_obj
+
+
+class SessionStore(object):
+    """Интерфейс хранилища сессий.
+
+    get возвращает сессию пользователя (создавая новую при необходимости),
+    save сохраняет её после обработки запроса, sweep удаляет закончившиеся
+    и брошенные партии. approximate_size – дешёвая оценка числа сессий для
+    метрик.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, finished_ttl=DEFAULT_FINISHED_TTL, clock=time.time):
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.clock = clock
+
+    def get(self, user_id):
+        raise NotImplementedError()
+
+    def save(self, user_id, session_obj):
+        raise NotImplementedError()
+
+    def delete(self, user_id):
+        raise NotImplementedError()
+
+    def sweep(self):
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def approximate_size(self):
+        return len(self)
+
+    def _is_expired(self, touched, finished, now):
+        return touched < now - self.ttl or finished and touched < now - self.finished_ttl
+
+
+class MemoryStore(SessionStore):
+    """Хранилище в памяти с вытеснением давно не использованных сессий"""
+
+    def __init__(self, max_size=100000, **kwargs):
+        super(MemoryStore, self).__init__(**kwargs)
+        self.max_size = max_size
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = self.clock()
+        with self._lock:
+            entry = self._sessions.pop(user_id, None)
+            if entry is None or self._is_expired(entry[1], is_finished(entry[0]), now):
+                entry = (new_session(), now)
+            self._sessions[user_id] = entry
+            self._evict()
+            return entry[0]
+
+    def save(self, user_id, session_obj):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+            self._sessions[user_id] = (session_obj, self.clock())
+            self._evict()
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def _evict(self):
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def sweep(self):
+        now = self.clock()
+        with self._lock:
+            expired = [
+                user_id for user_id, (session_obj, touched) in self._sessions.items()
+                if self._is_expired(touched, is_finished(session_obj), now)
+            ]
+            for user_id in expired:
+                del self._sessions[user_id]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteStore(SessionStore):
+    """Хранилище в SQLite, переживающее перезапуск процесса.
+
+    Изменённые сессии копятся в памяти и пишутся пачкой, когда их набирается
+    batch_size или с прошлой записи прошло flush_interval секунд.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, size_interval=DEFAULT_SIZE_INTERVAL, **kwargs):
+        super(SQLiteStore, self).__init__(**kwargs)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.size_interval = size_interval
+        self._size = None
+        self._size_counted = None
+
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._last_flush = self.clock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'user_id TEXT PRIMARY KEY, data BLOB NOT NULL, touched REAL NOT NULL, finished INTEGER NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)')
+        self._connection.commit()
+
+    def get(self, user_id):
+        key = '%s' % user_id
+        now = self.clock()
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key][0]
+
+            row = self._connection.execute(
+                'SELECT data, touched, finished FROM sessions WHERE user_id = ?', (key,)
+            ).fetchone()
+            if row is None or self._is_expired(row[1], row[2], now):
+                return new_session()
+            return loads(bytes(row[0]))
+
+    def save(self, user_id, session_obj):
+        with self._lock:
+            self._pending['%s' % user_id] = (session_obj, self.clock())
+            if (len(self._pending) >= self.batch_size
+                    or self.clock() - self._last_flush >= self.flush_interval):
+                self.flush()
+
+    def delete(self, user_id):
+        key = '%s' % user_id
+        with self._lock:
+            self._pending.pop(key, None)
+            self._connection.execute('DELETE FROM sessions WHERE user_id = ?', (key,))
+            self._connection.commit()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = self.clock()
+            if not self._pending:
+                return
+            rows = [
+                (key, sqlite3.Binary(dumps(session_obj)),
+                 touched, int(is_finished(session_obj)))
+                for key, (session_obj, touched) in self._pending.items()
+            ]
+            self._pending.clear()
+            with self._connection:
+                self._connection.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)', rows)
+
+    def sweep(self):
+        now = self.clock()
+        with self._lock:
+            self.flush()
+            with self._connection:
+                cursor = self._connection.execute(
+                    'DELETE FROM sessions WHERE touched < ? OR finished AND touched < ?',
+                    (now - self.ttl, now - self.finished_ttl),
+                )
+            self._count(now)
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self._count(self.clock())
+
+    def _count(self, now):
+        self._size = self._connection.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        self._size_counted = now
+        return self._size
+
+    def approximate_size(self):
+        """Число сессий в базе без сброса накопленных записей; COUNT(*) не чаще раза в size_interval секунд"""
+        now = self.clock()
+        with self._lock:
+            if self._size_counted is None or now - self._size_counted >= self.size_interval:
+                self._count(now)
+            return self._size
+
+
+class LockStripes(object):
+    """Блокировки пользователей, разложенные по stripes полосам.
+
+    Запросы одного пользователя (повторы Алисы, двойные нажатия) проходят
+    чтение сессии, ход и сохранение по очереди; разные пользователи почти
+    всегда попадают в разные полосы. С path полоса дополнительно
+    блокируется байтом в файле через fcntl, чтобы исключить гонку между
+    процессами, которые работают с одной базой SQLite.
+    """
+
+    def __init__(self, stripes=DEFAULT_LOCK_STRIPES, path=None):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._file = open(path, 'ab') if path is not None and fcntl is not None else None
+
+    def index(self, user_id):
+        # crc32, а не hash: номер полосы должен совпадать во всех процессах
+        return (zlib.crc32(('%s' % user_id).encode('utf-8')) & 0xffffffff) % len(self._locks)
+
+    @contextlib.contextmanager
+    def lock(self, user_id):
+        index = self.index(user_id)
+        lock = self._locks[index]
+        started = time.time()
+        contended = not lock.acquire(False)
+        if contended:
+            lock.acquire()
+        try:
+            if self._file is not None:
+                try:
+                    fcntl.lockf(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, index)
+                except (IOError, OSError):
+                    contended = True
+                    fcntl.lockf(self._file, fcntl.LOCK_EX, 1, index)
+            if contended:
+                LOCKS.inc(['contended'])
+                LOCK_WAIT.observe(time.time() - started)
+            else:
+                LOCKS.inc(['free'])
+            try:
+                yield
+            finally:
+                if self._file is not None:
+                    fcntl.lockf(self._file, fcntl.LOCK_UN, 1, index)
+        finally:
+            lock.release()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class Sweeper(threading.Thread):
+    """Фоновый поток, который периодически чистит хранилище"""
+
+    def __init__(self, store, interval=60):
+        super(Sweeper, self).__init__(name='session-sweeper')
+        self.daemon = True
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                removed = self.store.sweep()
+                if removed:
+                    log.info('Swept %d sessions', removed)
+            except Exception:
+                log.exception('Session sweep failed')
+
+    def stop(self):
+        self._stopped.set()
+
+
+def from_env(environ=os.environ):
+    """Создаёт хранилище по переменным окружения.
+
+    SESSION_DB – путь к базе SQLite (без него сессии живут в памяти),
+    SESSION_MAX_SIZE – предельное число сессий в памяти,
+    SESSION_TTL – время жизни брошенной сессии в секундах.
+    """
+    ttl = int(environ.get('SESSION_TTL', DEFAULT_TTL))
+    if environ.get('SESSION_DB'):
+        return SQLiteStore(environ['SESSION_DB'], ttl=ttl)
+    return MemoryStore(max_size=int(environ.get('SESSION_MAX_SIZE', 100000)), ttl=ttl)
+
+
+def locks_from_env(environ=os.environ):
+    """Блокировки сессий: SESSION_LOCK_STRIPES полос, с SESSION_DB – ещё и между процессами"""
+    stripes = int(environ.get('SESSION_LOCK_STRIPES', DEFAULT_LOCK_STRIPES))
+    path = environ['SESSION_DB'] + '.lock' if environ.get('SESSION_DB') else None
+    return LockStripes(stripes, path)
+
+
+# хранилище и блокировки создаются при первом запросе: импорт не должен открывать базу
+_store = None
+_locks = None
+_sweeper = None
+_init_lock = threading.Lock()
+
+
+def configure(store, locks=None):
+    global _store, _locks
+    _store = store
+    if locks is not None:
+        _locks = locks
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _init_lock:
+            if _store is None:
+                _store = from_env()
+    return _store
+
+
+def get_locks():
+    global _locks
+    if _locks is None:
+        with _init_lock:
+            if _locks is None:
+                _locks = locks_from_env()
+    return _locks
+
+
+def reopen(environ=os.environ):
+    """Новые соединение с SQLite и блокировки в процессе, появившемся через fork.
+
+    Соединение родителя нельзя использовать после fork, а его блокировки
+    могли быть захвачены в момент fork. Запись без накопления, чтобы
+    изменения сразу видели другие процессы.
+    """
+    global _sweeper
+    configure(SQLiteStore(environ['SESSION_DB'], batch_size=1), locks_from_env(environ))
+    # поток чистки родителя в дочернем процессе не существует
+    _sweeper = None
+
+
+def start_sweeper(interval=60):
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = Sweeper(get_store(), interval)
+        _sweeper.start()
+    return _sweeper
+
+
+def locked(user_id):
+    """Контекст, внутри которого сессию пользователя читают, меняют и сохраняют"""
+    return get_locks().lock(user_id)
+
+
+def get(user_id):
+    return get_store().get(user_id)
+
+
+def save(user_id, session_obj):
+    get_store().save(user_id, session_obj)
@@ -1,82 +1,270 @@
 # coding: utf-8
-import sys
+"""Турнир между двумя реализациями игры.
+
+Пример запуска:
+
+    python -m seabattle.simulate seabattle.game mybot.game:Game --games 2000 --processes 4
+
+Каждый сид даёт пару полей A и B, и оба игрока стреляют по обоим полям
+(дублированные доски), поэтому удача с расстановкой не влияет на сравнение.
+Из числа промахов получается исход двух партий: в первой первым ходит
+первый игрок и стреляет по A, во второй первым ходит второй игрок.
+"""
+
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import collections
 import importlib
 import logging
+import math
+import multiprocessing
+import random
+import time
+
+from seabattle import placement
+from seabattle.game import BaseGame
+
+
+log = logging.getLogger(__name__)
+
+SeedResult = collections.namedtuple('SeedResult', ['seed', 'shots', 'wins', 'errors'])
+
+_players_cache = {}
+
+
+def load_player(spec):
+    """Загружает класс игры по строке вида `module` или `module:Class`"""
+    game_class = _players_cache.get(spec)
+    if game_class is None:
+        module_name, _, class_name = spec.partition(':')
+        game_class = getattr(importlib.import_module(module_name), class_name or 'Game')
+        _players_cache[spec] = game_class
+    return game_class
+
+
+def shots_to_win(game_class, target_field, own_field, size, ships):
+    """Сколько выстрелов нужно игроку, чтобы потопить все корабли на поле.
+
+    Возвращает пару (выстрелы, промахи) или None, если игрок сломался или
+    не справился за разумное число ходов.
+    """
+    referee = BaseGame()
+    referee.start_new_game(size, list(target_field), ships)
+
+    player = game_class()
+    player.start_new_game(size, list(own_field), ships, numbers=True)
+
+    shots = misses = 0
+    try:
+        while not player.is_victory():
+            if shots >= 2 * size ** 2:
+                return None
+            position = player.convert_to_position(player.do_shot().replace(',', ''))
+            result = referee.handle_enemy_shot(position)
+            player.handle_enemy_reply(result)
+            shots += 1
+            if result == 'miss':
+                misses += 1
+    except Exception:
+        log.exception('Player %s crashed', game_class)
+        return None
+    return shots, misses
+
+
+def _winner(first, second):
+    """Номер победителя (0 – ходивший первым, 1 – вторым) по результатам стрельбы.
+
+    Ход передаётся после каждого промаха, поэтому первый игрок успевает
+    закончить раньше, если ему понадобилось не больше промахов, чем второму.
+    """
+    if first is None:
+        return 1 if second is not None else None
+    if second is None:
+        return 0
+    return 0 if first[1] <= second[1] else 1
+
+
+def play_seed(args):
+    seed, specs, size, ships = args
+    players = [load_player(spec) for spec in specs]
+
+    random.seed(seed)
+    fields = [placement.generate_field(size, ships), placement.generate_field(size, ships)]
+
+    # results[p][f] – результат игрока p на поле f
+    results = [[None, None], [None, None]]
+    for p, game_class in enumerate(players):
+        for f in range(2):
+            random.seed('%s-%s-%s' % (seed, p, f))
+            results[p][f] = shots_to_win(game_class, fields[f], fields[1 - f], size, ships)
+
+    wins = [0, 0]
+    # партия 1: первый игрок ходит первым и стреляет по A, второй – по B
+    winner = _winner(results[0][0], results[1][1])
+    if winner is not None:
+        wins[winner] += 1
+    # партия 2: второй игрок ходит первым и стреляет по A, первый – по B
+    winner = _winner(results[1][0], results[0][1])
+    if winner is not None:
+        wins[1 - winner] += 1
+
+    shots = [[r[0] for r in player_results if r is not None] for player_results in results]
+    errors = [sum(r is None for r in player_results) for player_results in results]
+    return SeedResult(seed, shots, wins, errors)
+
+
+def norm_ppf(p):
+    """Квантиль стандартного нормального распределения (бисекция по erf)"""
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        mid = (low + high) / 2
+        if 0.5 * (1 + math.erf(mid / math.sqrt(2))) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
 
+def wilson_interval(successes, total, z=1.96):
+    if not total:
+        return 0.0, 1.0
+    p = successes / total
+    denominator = 1 + z ** 2 / total
+    center = (p + z ** 2 / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z ** 2 / (4 * total ** 2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
 
-logging.basicConfig(format='%(message)s', level=logging.INFO)
 
+class TournamentStats(object):
+    def __init__(self):
+        self.shots = [[], []]
+        self.wins = [0, 0]
+        self.errors = [0, 0]
+        self.diffs = []
+        self.seeds = 0
 
-player_1 = importlib.import_module(sys.argv[1])
-player_2 = importlib.import_module(sys.argv[2])
+    def add(self, result):
+        self.seeds += 1
+        for p in range(2):
+            self.shots[p].extend(result.shots[p])
+            self.wins[p] += result.wins[p]
+            self.errors[p] += result.errors[p]
+        if all(len(s) == 2 for s in result.shots):
+            self.diffs.append(sum(result.shots[0]) - sum(result.shots[1]))
 
-game_1 = player_1.Game()
-game_2 = player_2.Game()
+    @property
+    def games(self):
+        return sum(self.wins)
 
-game_1.start_new_game()
-game_2.start_new_game()
+    def z_score(self):
+        """z-статистика парной разницы выстрелов между игроками на одних и тех же полях"""
+        n = len(self.diffs)
+        if n < 2:
+            return 0.0
+        mean = sum(self.diffs) / n
+        variance = sum((d - mean) ** 2 for d in self.diffs) / (n - 1)
+        if not variance:
+            return 0.0 if not mean else math.copysign(float('inf'), mean)
+        return mean / math.sqrt(variance / n)
 
-print 'Player 1 field:'
-game_1.print_field()
-print 'Player 2 field:'
-game_2.print_field()
 
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
 
-def get_name(game):
-    if game is game_1:
-        return 'Player 1'
-    else:
-        return 'Player 2'
 
+def format_histogram(values, width=40, bucket=5):
+    if not values:
+        return ['  нет данных']
+    counts = collections.Counter(v // bucket * bucket for v in values)
+    top = max(counts.values())
+    lines = []
+    for start in range(min(counts), max(counts) + 1, bucket):
+        count = counts.get(start, 0)
+        bar = '#' * int(round(width * count / top))
+        lines.append('  %3d-%-3d %6d %s' % (start, start + bucket - 1, count, bar))
+    return lines
 
-def prepare_text_coords(coords):
-    return coords.replace(',', '')
 
+def report(stats, specs, elapsed, z_crit):
+    lines = []
+    for p, spec in enumerate(specs):
+        shots = stats.shots[p]
+        mean = sum(shots) / len(shots) if shots else float('nan')
+        lines.append('Player %d (%s)' % (p + 1, spec))
+        lines.append('  shots to win: mean %.2f, p50 %s, p90 %s, min %s, max %s, errors %d' % (
+            mean, percentile(shots, 0.5), percentile(shots, 0.9),
+            min(shots) if shots else '-', max(shots) if shots else '-', stats.errors[p]))
+        lines.extend(format_histogram(shots))
 
-active = game_1
-passive = game_2
+    low, high = wilson_interval(stats.wins[0], stats.games)
+    lines.append('Player 1 win rate: %.3f (95%% CI %.3f-%.3f) over %d games' % (
+        stats.wins[0] / stats.games if stats.games else float('nan'), low, high, stats.games))
+    lines.append('Paired shots difference z = %.2f (stop threshold %.2f)' % (stats.z_score(), z_crit))
+    lines.append('%d seeds in %.1fs, %.1f games/sec' % (
+        stats.seeds, elapsed, stats.games / elapsed if elapsed else float('nan')))
+    return '\n'.join(lines)
 
 
-# MAIN LOOP
-while True:
-    coords = active.convert_to_position(prepare_text_coords(active.do_shot()))
-    print '{}: MOVE {}-{}'.format(get_name(active), coords[0], coords[1])
-    result = passive.handle_enemy_shot(coords)
-    print '{}: {}'.format(get_name(passive), result.upper())
-    active.handle_enemy_reply(result)
+def run_tournament(specs, games=1000, processes=None, seed=0, size=10, ships=None,
+                   alpha=0.05, min_games=200, check_every=50):
+    """Играет до `games` партий (по две на сид) и возвращает (статистика, время, порог z).
 
-    if result == 'miss':
-        active, passive = passive, active
+    Если alpha задана, турнир останавливается раньше, как только разница
+    между игроками становится значимой. Порог z поправлен по Бонферрони на
+    число проверок, чтобы многократные проверки не завышали ошибку первого рода.
+    """
+    ships = ships or BaseGame.default_ships
+    seeds = range(seed, seed + int(math.ceil(games / 2)))
+    looks = max(1, int(math.ceil(len(seeds) / check_every)))
+    z_crit = norm_ppf(1 - alpha / (2 * looks)) if alpha else float('inf')
 
-    should_exit = False
+    stats = TournamentStats()
+    started = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        tasks = ((s, specs, size, ships) for s in seeds)
+        for result in pool.imap_unordered(play_seed, tasks, chunksize=4):
+            stats.add(result)
+            if (stats.games >= min_games and stats.seeds % check_every == 0
+                    and abs(stats.z_score()) > z_crit):
+                log.info('Difference is significant after %d games, stopping', stats.games)
+                pool.terminate()
+                break
+        else:
+            pool.close()
+    finally:
+        pool.join()
+    return stats, time.time() - started, z_crit
 
-    if game_1.is_victory():
-        print 'Player 1: VICTORY'
-        should_exit = True
-    elif game_1.is_defeat():
-        print 'Player 1: DEFEAT'
-        should_exit = True
 
-    if game_2.is_victory():
-        print 'Player 2: VICTORY'
-        should_exit = True
-    elif game_2.is_defeat():
-        print 'Player 2: DEFEAT'
-        should_exit = True
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Турнир между двумя реализациями Game')
+    parser.add_argument('player_1', help='module или module:Class')
+    parser.add_argument('player_2', help='module или module:Class')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='уровень значимости для ранней остановки, 0 – играть все партии')
+    parser.add_argument('--min-games', type=int, default=200)
+    parser.add_argument('--check-every', type=int, default=50, help='проверять значимость каждые N сидов')
+    args = parser.parse_args(argv)
 
-    if should_exit:
-        break
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    # ходы игроков логируются на уровне INFO и в турнире только мешают
+    logging.getLogger('seabattle.game').setLevel(logging.WARNING)
 
+    specs = [args.player_1, args.player_2]
+    stats, elapsed, z_crit = run_tournament(
+        specs, games=args.games, processes=args.processes, seed=args.seed,
+        alpha=args.alpha, min_games=args.min_games, check_every=args.check_every,
+    )
+    print(report(stats, specs, elapsed, z_crit))
 
-print '=' * 50
-print 'Player 1 field:'
-print 'His POV:'
-game_1.print_field()
-print 'Opponents POV:'
-game_2.print_enemy_field()
 
-print 'Player 2 field:'
-print 'His POV:'
-game_2.print_field()
-print 'Opponents POV:'
-game_1.print_enemy_field()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# coding: utf-8
+"""Компактный двоичный формат состояния игры.
+
+    data = snapshot.to_bytes(game)
+    game = snapshot.from_bytes(data)
+
+Поля упакованы по две клетки в байт, шахматные стратегии хранятся своими
+случайными параметрами и числом оставшихся выстрелов, карта вероятностей
+DensityStrategy восстанавливается по полю противника. Стандартная партия
+занимает около двухсот байт.
+"""
+
+from __future__ import unicode_literals
+
+import struct
+from array import array
+
+from seabattle.bitboard import BitField
+from seabattle.game import Game
+from seabattle.strategy import DamagedShipStrategy, Point, Strategy
+
+
+MAGIC = b'SB'
+VERSION = 2
+# версия 1 хранила ещё и кандидатов DamagedShipStrategy, теперь они берутся из индекса свободных клеток
+SUPPORTED_VERSIONS = (1, VERSION)
+
+_FLAG_NUMBERS = 1
+_FLAG_BITBOARD = 2
+_FLAG_DENSITY = 4
+_FLAG_DAMAGED = 8
+_FLAG_ENDGAME = 16
+
+# какой из объектов стратегий сейчас активен
+_CURRENT_INITIAL = 0
+_CURRENT_FOUR = 1
+_CURRENT_THREE = 2
+_CURRENT_TWO = 3
+_CURRENT_RANDOM = 4
+_CURRENT_DAMAGED = 5
+_CURRENT_DENSITY = 6
+
+_DIMENSIONS = [None, 'x', 'y']
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class _Writer(object):
+    def __init__(self):
+        self.chunks = []
+
+    def pack(self, fmt, *values):
+        self.chunks.append(struct.pack(str('>' + fmt), *values))
+
+    def raw(self, data):
+        self.chunks.append(bytes(data))
+
+    def blob(self, data):
+        self.pack('B', len(data))
+        self.raw(data)
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+
+class _Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        fmt = str('>' + fmt)
+        try:
+            values = struct.unpack_from(fmt, self.data, self.offset)
+        except struct.error as e:
+            raise SnapshotError('Truncated snapshot: %s' % e)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def raw(self, length):
+        if self.offset + length > len(self.data):
+            raise SnapshotError('Truncated snapshot')
+        data = bytearray(self.data[self.offset:self.offset + length])
+        self.offset += length
+        return data
+
+    def blob(self):
+        length, = self.unpack('B')
+        return self.raw(length)
+
+
+def _pack_cells(values):
+    packed = bytearray((len(values) + 1) // 2)
+    for i, value in enumerate(values):
+        packed[i // 2] |= value << (4 * (i % 2))
+    return packed
+
+
+def _unpack_cells(packed, count):
+    return [packed[i // 2] >> (4 * (i % 2)) & 0xF for i in range(count)]
+
+
+def _pack_point(point):
+    return (0, 0) if point is None else tuple(point)
+
+
+def _unpack_point(x, y):
+    return None if (x, y) == (0, 0) else Point(x, y)
+
+
+def _write_strategy(writer, strategy):
+    if strategy is None:
+        writer.pack('B', 0)
+        return
+    writer.pack('BBBB', strategy.region_size, strategy.start_x, strategy.start_y, strategy.remaining)
+    writer.blob(bytearray(strategy.order))
+
+
+def _read_strategy(reader, size):
+    region_size, = reader.unpack('B')
+    if not region_size:
+        return None
+    start_x, start_y, remaining = reader.unpack('BBB')
+    order = reader.blob()
+    return Strategy(size, region_size, start_x, start_y, list(order), remaining)
+
+
+def _write_points(writer, points):
+    writer.pack('B', len(points))
+    for x, y in points:
+        writer.pack('bb', x, y)
+
+
+def _read_points(reader):
+    count, = reader.unpack('B')
+    return [Point(*reader.unpack('bb')) for _ in range(count)]
+
+
+def _current_strategy(game):
+    candidates = [
+        (game.damaged_ship_strategy, _CURRENT_DAMAGED),
+        (game.density_strategy, _CURRENT_DENSITY),
+        (game.four_decker_strategy, _CURRENT_FOUR),
+        (game.three_decker_strategy, _CURRENT_THREE),
+        (game.two_decker_strategy, _CURRENT_TWO),
+        (game.one_decker_strategy, _CURRENT_RANDOM),
+    ]
+    for strategy, code in candidates:
+        if strategy is not None and game.strategy is strategy:
+            return code
+    return _CURRENT_INITIAL
+
+
+def to_bytes(game):
+    """Сериализует Game в байты"""
+    writer = _Writer()
+    flags = 0
+    if game.numbers:
+        flags |= _FLAG_NUMBERS
+    if isinstance(game.field, BitField):
+        flags |= _FLAG_BITBOARD
+    if game.density_strategy is not None:
+        flags |= _FLAG_DENSITY
+    if game.damaged_ship_strategy is not None:
+        flags |= _FLAG_DAMAGED
+    if game.endgame_strategy is not None:
+        flags |= _FLAG_ENDGAME
+
+    writer.raw(MAGIC)
+    writer.pack('BBB', VERSION, flags, game.size)
+    writer.blob(bytearray(game.ships))
+    writer.pack('BB', game.ships_count, game.enemy_ships_count)
+    writer.pack('BBBB', game.four_decker_count, game.three_decker_count,
+                game.two_decker_count, game.one_decker_count)
+    writer.pack('bbbb', *(_pack_point(game.last_shot_position) + _pack_point(game.last_enemy_shot_position)))
+    writer.raw(_pack_cells(list(game.field)))
+    writer.raw(_pack_cells(list(game.enemy_field)))
+
+    writer.pack('B', _current_strategy(game))
+    initial = game.strategy if _current_strategy(game) == _CURRENT_INITIAL else None
+    for strategy in (initial, game.four_decker_strategy, game.three_decker_strategy, game.two_decker_strategy):
+        _write_strategy(writer, strategy)
+
+    if game.damaged_ship_strategy is not None:
+        damaged = game.damaged_ship_strategy
+        writer.pack('Bb', _DIMENSIONS.index(damaged.dimension), damaged.index or 0)
+        _write_points(writer, damaged.ship)
+
+    if game.density_strategy is not None:
+        weights = sorted(game.density_strategy.weights.items())
+        writer.pack('B', len(weights))
+        for length, count in weights:
+            writer.pack('BB', length, count)
+
+    return writer.getvalue()
+
+
+def from_bytes(data):
+    """Восстанавливает Game из байтов, полученных to_bytes"""
+    reader = _Reader(data)
+    if bytes(reader.raw(len(MAGIC))) != MAGIC:
+        raise SnapshotError('Not a game snapshot')
+    version, flags, size = reader.unpack('BBB')
+    if version not in SUPPORTED_VERSIONS:
+        raise SnapshotError('Unsupported snapshot version: %s' % version)
+
+    game = Game(density=bool(flags & _FLAG_DENSITY), endgame=bool(flags & _FLAG_ENDGAME))
+    game.size = size
+    game.numbers = bool(flags & _FLAG_NUMBERS)
+    game.bitboard = bool(flags & _FLAG_BITBOARD)
+    game.ships = list(reader.blob())
+    game.ships_count, game.enemy_ships_count = reader.unpack('BB')
+    (game.four_decker_count, game.three_decker_count,
+     game.two_decker_count, game.one_decker_count) = reader.unpack('BBBB')
+    x, y, enemy_x, enemy_y = reader.unpack('bbbb')
+    game.last_shot_position = _unpack_point(x, y)
+    game.last_enemy_shot_position = _unpack_point(enemy_x, enemy_y)
+
+    packed_size = (size ** 2 + 1) // 2
+    field = _unpack_cells(reader.raw(packed_size), size ** 2)
+    enemy_field = _unpack_cells(reader.raw(packed_size), size ** 2)
+    if game.bitboard:
+        game.field = BitField.from_list(size, field)
+        game.enemy_field = BitField.from_list(size, enemy_field)
+    else:
+        game.field = array('b', field)
+        game.enemy_field = array('b', enemy_field)
+
+    current, = reader.unpack('B')
+    initial = _read_strategy(reader, size)
+    game.four_decker_strategy = _read_strategy(reader, size)
+    game.three_decker_strategy = _read_strategy(reader, size)
+    game.two_decker_strategy = _read_strategy(reader, size)
+
+    if flags & _FLAG_DAMAGED:
+        dimension, index = reader.unpack('Bb')
+        damaged = DamagedShipStrategy()
+        damaged.dimension = _DIMENSIONS[dimension]
+        damaged.index = index if damaged.dimension is not None else None
+        damaged.ship = _read_points(reader)
+        if version == 1:
+            _read_points(reader)
+        game.damaged_ship_strategy = damaged
+
+    if game.density_strategy is not None:
+        count, = reader.unpack('B')
+        weights = dict(reader.unpack('BB') for _ in range(count))
+        game.density_strategy.restore(weights)
+
+    game.strategy = {
+        _CURRENT_INITIAL: initial,
+        _CURRENT_FOUR: game.four_decker_strategy,
+        _CURRENT_THREE: game.three_decker_strategy,
+        _CURRENT_TWO: game.two_decker_strategy,
+        _CURRENT_RANDOM: game.one_decker_strategy,
+        _CURRENT_DAMAGED: game.damaged_ship_strategy,
+        _CURRENT_DENSITY: game.density_strategy,
+    }[current]
+    if game.strategy is None:
+        raise SnapshotError('Snapshot has no active strategy')
+    return game
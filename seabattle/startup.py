@@ -0,0 +1,69 @@
+# coding: utf-8
+"""Замер времени запуска по фазам: импорты тяжёлых библиотек, загрузка модели, прогрев.
+
+    with startup.timer.phase('load model'):
+        ...
+    startup.timer.report()
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import importlib
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class StartupTimer(object):
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.ready_at = None
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self._lock:
+                self.phases.append((name, elapsed))
+            log.info('Startup phase "%s" took %.3fs', name, elapsed)
+
+    def import_module(self, name, optional=False):
+        """Импортирует модуль, записывая время импорта отдельной фазой"""
+        try:
+            with self.phase('import %s' % name):
+                return importlib.import_module(name)
+        except ImportError:
+            if not optional:
+                raise
+            log.info('Optional module %s is not installed', name)
+            return None
+
+    def mark_ready(self):
+        self.ready_at = self.clock()
+        log.info('Ready in %.3fs since start', self.ready_at - self.started)
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def report(self):
+        with self._lock:
+            phases = [{'name': name, 'seconds': round(seconds, 4)} for name, seconds in self.phases]
+        return {
+            'ready': self.ready,
+            'total': round((self.ready_at or self.clock()) - self.started, 4),
+            'phases': phases,
+        }
+
+
+timer = StartupTimer()
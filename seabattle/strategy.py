@@ -1,43 +1,153 @@
 # coding: utf-8
 import random
-from collections import namedtuple
+from array import array
+from collections import Counter, namedtuple
 
-Region = namedtuple('Point', ['start_x', 'start_y', 'end_x', 'end_y'])
+from seabattle.bitboard import iter_bits
+from seabattle.placement import get_placements
+
+Region = namedtuple('Region', ['start_x', 'start_y', 'end_x', 'end_y'])
 
 
 class AbstractStrategy(object):
-    def get_shoot_point(self):
+    __slots__ = ()
+
+    def get_shoot_point(self, free=None, min_length=1):
+        """Следующая клетка для выстрела или None.
+
+        free – индекс непростреленных клеток (FreeCells); если он передан,
+        стратегия не предлагает уже простреленные клетки. min_length –
+        длина самого короткого из оставшихся кораблей: клетки, через которые
+        не проходит свободный отрезок такой длины, стратегия может пропускать.
+        """
         raise NotImplementedError
 
 
+_shot_plans = {}
+_plan_ranks = {}
+
+
+def shot_plan(size, region_size, start_x, start_y, order):
+    """Порядок стрельбы Strategy индексами клеток, общий для всех партий процесса.
+
+    Кортеж неизменяемый, выстрелы забираются с конца.
+    """
+    key = (size, region_size, start_x, start_y, tuple(order))
+    plan = _shot_plans.get(key)
+    if plan is None:
+        strategy = Strategy.__new__(Strategy)
+        strategy.size, strategy.region_size, strategy.start_x, strategy.start_y, strategy.order = key
+        plan = _shot_plans[key] = tuple((p.y - 1) * size + p.x - 1 for p in strategy.get_shooting_field())
+    return plan
+
+
+def plan_ranks(size, plan):
+    """Номер каждой клетки поля в плане shot_plan или -1, общий для всех партий с этим планом"""
+    ranks = _plan_ranks.get((size, plan))
+    if ranks is None:
+        ranks = _plan_ranks[(size, plan)] = array('h', [-1]) * size ** 2
+        for rank, index in enumerate(plan):
+            ranks[index] = rank
+    return ranks
+
+
 class Strategy(AbstractStrategy):
-    def __init__(self, size=10, region_size=4):
+    """Шахматный порядок стрельбы для поиска кораблей длины region_size.
+
+    Хранит только случайные параметры порядка (смещения областей и
+    перестановку combination), ссылки на общий план из shot_plan и номера
+    его клеток и число оставшихся в нём выстрелов. free_order – свободные
+    клетки плана из индекса FreeCells, в snapshot не пишется.
+    """
+
+    __slots__ = ('size', 'region_size', 'start_x', 'start_y', 'order', 'plan', 'ranks', 'remaining', 'free_order')
+
+    def __init__(self, size=10, region_size=4, start_x=None, start_y=None, order=None, remaining=None):
         self.size = size
         self.region_size = region_size
-        self.regions = self.get_regions()
-        self.combination = self.get_combination()
-        self.shooting_field = self.get_shooting_field()
 
-    def get_shoot_point(self):
-        return self.shooting_field.pop()
+        delta = self.size % self.region_size
+        self.start_x = start_x if start_x is not None else random.randint(1, delta + 1)
+        self.start_y = start_y if start_y is not None else random.randint(1, delta + 1)
+        if order is None:
+            order = list(range(self.region_size))
+            random.shuffle(order)
+        self.order = tuple(order)
+
+        self.plan = shot_plan(self.size, self.region_size, self.start_x, self.start_y, self.order)
+        self.ranks = plan_ranks(self.size, self.plan)
+        self.remaining = min(remaining, len(self.plan)) if remaining is not None else len(self.plan)
+        self.free_order = None
+
+    @property
+    def regions(self):
+        return self.get_regions()
+
+    @property
+    def combination(self):
+        return self.get_combination()
+
+    @property
+    def shots(self):
+        """Оставшиеся выстрелы индексами клеток"""
+        return self.plan[:self.remaining]
+
+    @property
+    def shooting_field(self):
+        return [Point(i % self.size + 1, i // self.size + 1) for i in self.shots]
+
+    def get_shoot_point(self, free=None, min_length=1):
+        """Клетка плана с наибольшим номером меньше remaining.
+
+        С индексом free следующая клетка плана сверяется с ним, а если она
+        прострелена, свободная клетка плана берётся из индекса (FreeOrder),
+        так что простреленные не попадаются; пропускаются клетки, через
+        которые не проходит свободный отрезок длины min_length. Без индекса –
+        просто следующая клетка плана.
+        """
+        if free is None:
+            if not self.remaining:
+                return None
+            self.remaining -= 1
+            index = self.plan[self.remaining]
+            return Point(index % self.size + 1, index // self.size + 1)
+
+        while True:
+            rank = self.remaining - 1
+            if rank < 0 or self.plan[rank] not in free:
+                # следующая клетка плана прострелена: ищем в индексе свободную перед ней
+                rank = self._free_order(free).last_before(self.remaining)
+                if rank < 0:
+                    self.remaining = 0
+                    return None
+            self.remaining = rank
+            index = self.plan[rank]
+            # однопалубный корабль помещается в любую свободную клетку
+            if min_length == 1 or free.max_run(index) >= min_length:
+                return free.point(index)
+
+    def _free_order(self, free):
+        order = self.free_order
+        if order is None or order.flags is not free.flags:
+            order = self.free_order = free.ordered(self.plan, self.ranks)
+        return order
 
     def get_combination(self):
         combination = []
-        lst = [x for x in range(self.region_size)]
-        random.shuffle(lst)
-        for i in lst:
+        for i in self.order:
             row = [0 if x != i else 1 for x in range(self.region_size)]
             combination.append(row)
         return combination
 
     def get_shooting_field(self):
+        combination = self.get_combination()
         shooting_field = []
-        for region in self.regions:
+        for region in self.get_regions():
             for x in range(region.start_x, region.end_x + 1):
                 local_x = x - region.start_x
                 for y in range(region.start_y, region.end_y + 1):
                     local_y = y - region.start_y
-                    if self.combination[local_y][local_x] == 1:
+                    if combination[local_y][local_x] == 1:
                         shooting_field.append(Point(x, y))
         return shooting_field
 
@@ -49,9 +159,8 @@ class Strategy(AbstractStrategy):
         def get_end_coord(coord):
             end_coord = coord + self.region_size-1
             return end_coord if end_coord < self.size else self.size
-        delta = self.size % self.region_size
-        x_points = get_points(random.randint(1, delta+1))
-        y_points = get_points(random.randint(1, delta+1))
+        x_points = get_points(self.start_x)
+        y_points = get_points(self.start_y)
 
         regions = []
         for start_x, end_x in x_points:
@@ -64,25 +173,82 @@ Point = namedtuple('Point', ['x', 'y'])
 
 
 class DamagedShipStrategy(AbstractStrategy):
-    def get_shoot_point(self):
-        print(self.shoot_field)
-        return self.shoot_field.pop()
+    """Добивает раненый корабль выстрелами по продолжению его линии.
+
+    Кандидаты берутся из индекса свободных клеток, поэтому free обязателен.
+    """
+
+    __slots__ = ('ship', 'dimension', 'index')
+
+    def get_shoot_point(self, free=None, min_length=1):
+        for vertical in self._directions():
+            ends = self._line_ends(free, vertical, min_length)
+            if ends:
+                return free.point(ends[0])
+        return None
 
     def __init__(self):
         self.ship = []
-        self.shoot_field = []
         self.dimension = None
         self.index = None
 
     def add_ship_point(self, point):
         self.ship.append(point)
-        nearby_points = self.get_nearby_line_points(point)
-        self.shoot_field += nearby_points
         if len(self.ship) == 1:
             return
         if self.dimension is None:
             self.get_ship_dimension()
-        self.shoot_field = [point for point in self.shoot_field if getattr(point, self.dimension) == self.index]
+
+    def get_candidates(self, free, min_length=1):
+        """Непростреленные клетки у концов корабля.
+
+        Направление пропускается, если корабль вместе со свободными
+        отрезками за его концами короче min_length. Пока подбита одна
+        клетка, проверяются оба направления, сначала вертикальное.
+        """
+        candidates = []
+        for vertical in self._directions():
+            candidates += [free.point(index) for index in self._line_ends(free, vertical, min_length)]
+        return candidates
+
+    def _directions(self):
+        # dimension 'x' – у клеток корабля общий x, то есть он вертикальный
+        if self.dimension is not None:
+            return (self.dimension == 'x',)
+        return (True, False)
+
+    def _line_ends(self, free, vertical, min_length):
+        # индексы клеток, а не Point: на каждом выстреле это заметно дешевле
+        ship, size = self.ship, free.size
+        if vertical:
+            x, first = ship[0]
+            last = first
+            if len(ship) > 1:
+                first, last = min(p.y for p in ship), max(p.y for p in ship)
+            before = (first - 2) * size + x - 1 if first > 1 else None
+            after = last * size + x - 1 if last < size else None
+            run = free.col_run
+        else:
+            first, y = ship[0]
+            last = first
+            if len(ship) > 1:
+                first, last = min(p.x for p in ship), max(p.x for p in ship)
+            before = (y - 1) * size + first - 2 if first > 1 else None
+            after = (y - 1) * size + last if last < size else None
+            run = free.row_run
+
+        flags = free.flags
+        ends = [index for index in (before, after) if index is not None and flags[index]]
+        length = last - first + 1
+        if length < min_length:
+            # корабль может продолжиться только в свободные отрезки за концами
+            if ends and ends[0] == before:
+                length += first - run(before)[0]
+            if ends and ends[-1] == after:
+                length += run(after)[1] - last
+            if length < min_length:
+                return []
+        return ends
 
     def get_ship_dimension(self):
         first = self.ship[0]
@@ -124,13 +290,153 @@ class DamagedShipStrategy(AbstractStrategy):
 
 
 class RandomStrategy(AbstractStrategy):
+    __slots__ = ('game',)
 
     def __init__(self, game):
         self.game = game
 
-    def get_shoot_point(self):
-        index = random.choice([i for i, v in enumerate(self.game.enemy_field) if v == 0])
-        return self.game.calc_position(index)
+    def get_shoot_point(self, free=None, min_length=1):
+        free = free if free is not None else self.game.free_cells
+        if not free:
+            return None
+        return free.point(free.choice())
+
+
+_density_tables_cache = {}
+
+
+def _density_tables(size, lengths):
+    """Общие для всех партий таблицы положений: (placements, ranges, cell_placements)"""
+    key = (size, lengths)
+    tables = _density_tables_cache.get(key)
+    if tables is None:
+        placements = []
+        ranges = {}
+        cell_placements = [[] for _ in range(size ** 2)]
+        for length in lengths:
+            start = len(placements)
+            for placement in get_placements(size, length):
+                cells = tuple(iter_bits(placement.ship))
+                for cell in cells:
+                    cell_placements[cell].append(len(placements))
+                placements.append((length, cells))
+            ranges[length] = (start, len(placements))
+        tables = _density_tables_cache[key] = (
+            tuple(placements), ranges, tuple(tuple(pids) for pids in cell_placements))
+    return tables
+
+
+class DensityStrategy(AbstractStrategy):
+    """Стреляет в клетку, через которую проходит больше всего возможных положений кораблей.
+
+    Карта вероятностей не пересчитывается заново: после промаха вычитаются
+    положения, проходящие через клетку, после убийства – положения,
+    задевающие корабль и его соседей, и один экземпляр корабля этой длины.
+    """
+
+    __slots__ = ('game', 'size', 'placements', 'ranges', 'cell_placements', 'valid', 'weights', 'heat')
+
+    def __init__(self, game):
+        self.game = game
+        self.size = None
+        self.placements = None
+        self.ranges = None
+        self.cell_placements = None
+        self.valid = None
+        self.weights = None
+        self.heat = None
+
+    def reset(self):
+        self.size = self.game.size
+        self.weights = Counter(self.game.ships)
+        self.placements, self.ranges, self.cell_placements = _density_tables(self.size, tuple(sorted(self.weights)))
+        self.valid = bytearray([1]) * len(self.placements)
+        self._recompute_heat()
+
+    def restore(self, weights):
+        """Восстанавливает карту по полю противника и числу оставшихся кораблей.
+
+        Закрыты клетки промахов и клетки убитых кораблей, то есть подбитые
+        клетки, не принадлежащие раненому сейчас кораблю.
+        """
+        self.reset()
+        self.weights = Counter(weights)
+        damaged = self.game.damaged_ship_strategy
+        damaged_cells = set(self._index(p) for p in damaged.ship) if damaged is not None else set()
+        for index, value in enumerate(self.game.enemy_field):
+            if value != 0 and index not in damaged_cells:
+                for pid in self.cell_placements[index]:
+                    self.valid[pid] = 0
+        self._recompute_heat()
+
+    def _recompute_heat(self):
+        self.heat = array('i', [0]) * self.size ** 2
+        for pid, (length, cells) in enumerate(self.placements):
+            if self.valid[pid]:
+                for cell in cells:
+                    self.heat[cell] += self.weights[length]
+
+    def _ensure_ready(self):
+        if self.heat is None or self.size != self.game.size:
+            self.reset()
+
+    def _invalidate(self, pid):
+        if not self.valid[pid]:
+            return
+        self.valid[pid] = 0
+        length, cells = self.placements[pid]
+        weight = self.weights[length]
+        for cell in cells:
+            self.heat[cell] -= weight
+
+    def _index(self, point):
+        return (point[1] - 1) * self.size + point[0] - 1
+
+    def mark_miss(self, point):
+        self._ensure_ready()
+        for pid in self.cell_placements[self._index(point)]:
+            self._invalidate(pid)
+
+    def mark_kill(self, points):
+        self._ensure_ready()
+        length = len(points)
+
+        # через убитый корабль и соседние с ним клетки другие корабли не проходят
+        closed = set()
+        for x, y in points:
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    if 1 <= x + dx <= self.size and 1 <= y + dy <= self.size:
+                        closed.add(self._index((x + dx, y + dy)))
+        for cell in closed:
+            for pid in self.cell_placements[cell]:
+                self._invalidate(pid)
+
+        if self.weights[length] > 0:
+            for pid in range(*self.ranges[length]):
+                if self.valid[pid]:
+                    for cell in self.placements[pid][1]:
+                        self.heat[cell] -= 1
+            self.weights[length] -= 1
+
+    def get_shoot_point(self, free=None, min_length=1):
+        # положения, которые не помещаются в свободные клетки, уже вычтены из heat
+        self._ensure_ready()
+        free = free if free is not None else self.game.free_cells
+        best = 0
+        candidates = []
+        for index in free:
+            if self.heat[index] < best:
+                continue
+            if self.heat[index] > best:
+                best = self.heat[index]
+                candidates = []
+            candidates.append(index)
+
+        if not best:
+            return None
+        index = random.choice(candidates)
+        return Point(index % self.size + 1, index // self.size + 1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,429 @@
+# coding: utf-8
+"""Инкрементальное обучение модели NLU.
+
+    python -m seabattle.train --config config/nlu_config.yml --data config/intents_config.json --path mldata/
+
+Делает то же, что python -m rasa_nlu.train, но не пересобирает всё с нуля.
+У каждого компонента pipeline есть отпечаток: его настройки, примеры,
+которые он видит (классификаторы намерений – текст и намерение, извлечение
+сущностей – текст и сущности), и отпечатки компонентов, чьи свойства он
+использует. Компонент с тем же отпечатком, что и в предыдущей модели, не
+обучается: его файлы копируются из неё. --keep оставляет компонент из
+предыдущей модели, даже если его примеры изменились (удобно, пока правятся
+фразы для CRF, а классификатор на TensorFlow подождёт).
+
+Свойства примеров, которые компоненты передают дальше (документ spaCy,
+токены, признаки), кэшируются в SQLite по отпечатку компонента и тексту,
+поэтому spaCy разбирает только новые фразы. В конце печатается время
+каждого компонента.
+
+Использует внутренности rasa_nlu 0.12: Trainer.pipeline, persist и load
+компонентов, Metadata.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import copy
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'train_manifest.json'
+DEFAULT_PROJECT = 'default'
+
+# компоненты, которые ничему не учатся: train размечает примеры так же, как process
+STATELESS = frozenset(['nlp_spacy', 'tokenizer_spacy', 'tokenizer_whitespace', 'intent_featurizer_spacy'])
+# итоговые свойства разбора, дальше по pipeline они не нужны и не кэшируются
+OUTPUT_PROPERTIES = frozenset(['intent', 'intent_ranking', 'entities'])
+# библиотеки, с новой версией которых старые компоненты и документы spaCy из кэша непригодны
+VERSIONED_LIBRARIES = ('rasa_nlu', 'spacy', 'tensorflow', 'sklearn', 'sklearn_crfsuite', 'numpy')
+
+TRAINED = 'trained'
+REUSED = 'reused'
+KEPT = 'kept'
+PROCESSED = 'processed'
+
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=repr).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def library_versions(names=VERSIONED_LIBRARIES):
+    """{библиотека: версия}; None, если библиотеки нет или она не сообщает версию"""
+    versions = {}
+    for name in names:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            versions[name] = None
+            continue
+        version = getattr(module, '__version__', None)
+        if version is None:
+            version = getattr(getattr(module, 'about', None), '__version__', None)
+        versions[name] = version
+    return versions
+
+
+def _model_meta(component):
+    """Язык, имя и версия модели spaCy, если компонент её загрузил"""
+    meta = getattr(getattr(component, 'nlp', None), 'meta', None)
+    if not meta:
+        return None
+    return [meta.get('lang'), meta.get('name'), meta.get('version'), meta.get('spacy_version')]
+
+
+def _view(component):
+    """Какие поля примеров влияют на обучение компонента"""
+    provides = set(component.provides)
+    if 'entities' in provides:
+        return 'entities'
+    if provides & set(['intent', 'text_features']):
+        return 'intent'
+    return 'all'
+
+
+def _data_digest(training_data, view):
+    if view == 'entities':
+        examples = [(m.text, m.get('entities') or []) for m in training_data.entity_examples]
+    elif view == 'intent':
+        examples = [(m.text, m.get('intent')) for m in training_data.intent_examples]
+    else:
+        examples = [(m.text, m.get('intent'), m.get('entities') or []) for m in training_data.training_examples]
+    return _digest(sorted(_digest(example) for example in examples),
+                   training_data.regex_features, training_data.entity_synonyms)
+
+
+def _key(position, component):
+    return '%d:%s' % (position, component.name)
+
+
+def plan(pipeline, training_data, previous=None, keep=(), language=None, versions=None):
+    """Что делать с каждым компонентом: [(действие, отпечаток, отпечаток без примеров)].
+
+    Действие – processed, reused, kept или trained. Отпечаток складывается
+    из версий библиотек (versions) и модели spaCy, настроек компонента, его
+    примеров и отпечатков компонентов, чьи свойства он получает. Отпечаток
+    без примеров нужен для --keep: старый компонент можно оставить, только
+    если его настройки и всё, что он получает от предыдущих компонентов, не
+    изменились.
+    """
+    previous = previous or {}
+    providers = {}
+    result = []
+    for position, component in enumerate(pipeline):
+        inputs = set(component.requires) | set(component.provides)
+        upstream = sorted(set(providers[p] for p in inputs if p in providers))
+        structure = _digest(language, versions, component.name, component.component_config,
+                            _model_meta(component), upstream)
+        entry = previous.get(_key(position, component))
+
+        if component.name in STATELESS:
+            action, fingerprint = PROCESSED, structure
+        else:
+            fingerprint = _digest(structure, _data_digest(training_data, _view(component)))
+            if entry is not None and entry['fingerprint'] == fingerprint:
+                action = REUSED
+            elif entry is not None and component.name in keep and entry['structure'] == structure:
+                # дальше по pipeline видно то, что осталось от старой модели
+                action, fingerprint = KEPT, entry['fingerprint']
+            else:
+                if component.name in keep:
+                    log.warning('Can\'t keep %s: its settings or inputs changed', component.name)
+                action = TRAINED
+
+        result.append((action, fingerprint, structure))
+        for prop in component.provides:
+            providers[prop] = fingerprint
+    return result
+
+
+def _encode(prop, value):
+    if prop == 'spacy_doc':
+        return value.to_bytes()
+    return value
+
+
+def _decode(prop, value, context):
+    if prop == 'spacy_doc':
+        from spacy.tokens import Doc
+        return Doc(context['spacy_nlp'].vocab).from_bytes(value)
+    return value
+
+
+class FeatureCache(object):
+    """Свойства примеров по отпечатку компонента и тексту в SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+        self._connection.commit()
+
+    @staticmethod
+    def key(fingerprint, text):
+        return hashlib.sha1(('%s\0%s' % (fingerprint, text)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        row = self._connection.execute('SELECT value FROM features WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0]))
+
+    def put_many(self, items):
+        rows = [(key, sqlite3.Binary(pickle.dumps(value, 2))) for key, value in items]
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO features VALUES (?, ?)', rows)
+
+    def close(self):
+        self._connection.close()
+
+
+class ComponentReport(object):
+    __slots__ = ('name', 'action', 'seconds', 'hits', 'misses')
+
+    def __init__(self, name, action):
+        self.name = name
+        self.action = action
+        self.seconds = 0.0
+        self.hits = 0
+        self.misses = 0
+
+
+def _load_component(component, model_dir, context):
+    from rasa_nlu.model import Metadata
+
+    metadata = Metadata.load(model_dir)
+    return type(component).load(model_dir=model_dir, model_metadata=metadata, cached_component=None, **context)
+
+
+def _write_metadata(metadata, model_dir):
+    from rasa_nlu.model import Metadata
+
+    Metadata(metadata, model_dir).persist(model_dir)
+
+
+def _class_path(component):
+    return '%s.%s' % (type(component).__module__, type(component).__name__)
+
+
+class IncrementalTrainer(object):
+    """Обучает pipeline rasa, переиспользуя компоненты и свойства примеров предыдущего обучения.
+
+    previous_dir – каталог предыдущей модели с train_manifest.json или None.
+    """
+
+    def __init__(self, pipeline, config, cache, previous_dir=None, keep=(), clock=time.time, versions=None):
+        self.pipeline = pipeline
+        self.config = config
+        self.cache = cache
+        self.previous_dir = previous_dir
+        self.previous = read_manifest(previous_dir) if previous_dir else {}
+        self.keep = set(keep)
+        self.clock = clock
+        self.versions = library_versions() if versions is None else versions
+        self.context = {}
+        self.plan = None
+        self.reports = []
+        self.training_data = None
+
+    def train(self, training_data):
+        # как Trainer.train: компоненты размечают копию, а в модель сохраняются исходные примеры
+        self.training_data = training_data
+        training_data = copy.deepcopy(training_data)
+        for component in self.pipeline:
+            updates = component.provide_context()
+            if updates:
+                self.context.update(updates)
+
+        self.plan = plan(self.pipeline, training_data, self.previous, self.keep, self.config.get('language'),
+                         self.versions)
+        actions = [action for action, _, _ in self.plan]
+        examples = training_data.training_examples
+
+        for position, component in enumerate(self.pipeline):
+            action = actions[position]
+            report = ComponentReport(component.name, action)
+            started = self.clock()
+            component.prepare_partial_processing(self.pipeline[:position], self.context)
+            properties = [p for p in component.provides if p not in OUTPUT_PROPERTIES]
+
+            if action == TRAINED:
+                component.train(training_data, self.config, **self.context)
+                self._store(position, component, properties, examples)
+            elif properties and TRAINED in actions[position + 1:]:
+                # свойства нужны только компонентам, которые будут обучаться
+                missing = self._restore(position, properties, examples, report)
+                if missing:
+                    if action != PROCESSED:
+                        component = self.pipeline[position] = _load_component(
+                            component, self.previous_dir, self.context)
+                    for message in missing:
+                        component.process(message, **self.context)
+                    self._store(position, component, properties, missing)
+
+            report.seconds = self.clock() - started
+            self.reports.append(report)
+        return self.reports
+
+    def _restore(self, position, properties, examples, report):
+        """Восстанавливает свойства из кэша; возвращает примеры, которых в нём нет"""
+        missing = []
+        for message in examples:
+            values = self.cache.get(FeatureCache.key(self.plan[position][1], message.text))
+            if values is None:
+                missing.append(message)
+                continue
+            for prop in properties:
+                message.set(prop, _decode(prop, values[prop], self.context))
+        report.hits = len(examples) - len(missing)
+        report.misses = len(missing)
+        return missing
+
+    def _store(self, position, component, properties, examples):
+        if not properties:
+            return
+        fingerprint = self.plan[position][1]
+        self.cache.put_many(
+            (FeatureCache.key(fingerprint, message.text),
+             dict((prop, _encode(prop, message.get(prop))) for prop in properties))
+            for message in examples
+        )
+
+    def persist(self, path, project_name=None, fixed_model_name=None):
+        """Сохраняет модель как Trainer.persist; возвращает её каталог"""
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        model_name = fixed_model_name or 'model_' + timestamp
+        model_dir = os.path.join(os.path.abspath(path), project_name or DEFAULT_PROJECT, model_name)
+        # модель собирается рядом и подменяет старую целиком: предыдущая может лежать в том же каталоге
+        build_dir = model_dir + '.building'
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        os.makedirs(build_dir)
+
+        metadata = {'language': self.config.get('language'), 'pipeline': []}
+        metadata.update(self.training_data.persist(build_dir) or {})
+        manifest = {}
+        for position, component in enumerate(self.pipeline):
+            key = _key(position, component)
+            action, fingerprint, structure = self.plan[position]
+            if action in (REUSED, KEPT):
+                entry = dict(self.previous[key])
+                for name in entry['files']:
+                    shutil.copy2(os.path.join(self.previous_dir, name), os.path.join(build_dir, name))
+            else:
+                before = set(os.listdir(build_dir))
+                update = component.persist(build_dir)
+                component_meta = dict(component.component_config)
+                component_meta.update(update or {})
+                component_meta['class'] = _class_path(component)
+                entry = {
+                    'fingerprint': fingerprint,
+                    'metadata': component_meta,
+                    'files': sorted(set(os.listdir(build_dir)) - before),
+                }
+            entry['structure'] = structure
+            metadata['pipeline'].append(entry['metadata'])
+            manifest[key] = entry
+
+        _write_metadata(metadata, build_dir)
+        with io.open(os.path.join(build_dir, MANIFEST), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(manifest, indent=2, sort_keys=True, ensure_ascii=False))
+        if os.path.exists(model_dir):
+            shutil.rmtree(model_dir)
+        os.rename(build_dir, model_dir)
+        return model_dir
+
+
+def read_manifest(model_dir):
+    try:
+        with io.open(os.path.join(model_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def latest_model(path, project_name=None):
+    """Последняя модель проекта, обученная через seabattle.train, или None"""
+    project_dir = os.path.join(path, project_name or DEFAULT_PROJECT)
+    if not os.path.isdir(project_dir):
+        return None
+    candidates = []
+    for name in os.listdir(project_dir):
+        manifest = os.path.join(project_dir, name, MANIFEST)
+        if os.path.isfile(manifest):
+            candidates.append((os.path.getmtime(manifest), os.path.join(project_dir, name)))
+    return max(candidates)[1] if candidates else None
+
+
+def report(reports, total):
+    lines = ['%-42s %-9s %9s %13s' % ('component', 'action', 'seconds', 'cache hit/miss')]
+    for item in reports:
+        cache = '%d/%d' % (item.hits, item.misses) if item.hits or item.misses else ''
+        lines.append('%-42s %-9s %9.2f %13s' % (item.name, item.action, item.seconds, cache))
+    lines.append('%-42s %-9s %9.2f' % ('total', '', total))
+    return '\n'.join(lines)
+
+
+def train_model(config_path, data_path, path, project=DEFAULT_PROJECT, fixed_model_name=None, cache_path=None,
+                keep=(), full=False):
+    """Обучает модель по конфигу rasa и данным; возвращает отчёты компонентов и каталог модели"""
+    from rasa_nlu import config as rasa_config
+    from rasa_nlu.model import Trainer
+    from rasa_nlu.training_data import load_data
+
+    cfg = rasa_config.load(config_path)
+    trainer = Trainer(cfg)
+    training_data = load_data(data_path, cfg.get('language'))
+
+    previous_dir = None if full else latest_model(path, project)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    cache = FeatureCache(cache_path or os.path.join(path, '.train_cache.db'))
+    try:
+        incremental = IncrementalTrainer(trainer.pipeline, cfg, cache, previous_dir, keep)
+        reports = incremental.train(training_data)
+        model_dir = incremental.persist(path, project, fixed_model_name)
+    finally:
+        cache.close()
+    return reports, model_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Инкрементальное обучение модели NLU')
+    parser.add_argument('--config', default='config/nlu_config.yml')
+    parser.add_argument('--data', default='config/intents_config.json')
+    parser.add_argument('--path', default='mldata/')
+    parser.add_argument('--project', default=DEFAULT_PROJECT)
+    parser.add_argument('--fixed-model-name', default=None)
+    parser.add_argument('--cache', default=None, help='файл кэша свойств примеров, по умолчанию <path>/.train_cache.db')
+    parser.add_argument('--keep', action='append', default=[],
+                        help='оставить компонент из предыдущей модели, даже если его примеры изменились')
+    parser.add_argument('--full', action='store_true', help='обучить все компоненты заново')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.time()
+    reports, model_dir = train_model(args.config, args.data, args.path, args.project, args.fixed_model_name,
+                                     args.cache, args.keep, args.full)
+    log.info('Model saved to %s', model_dir)
+    print(report(reports, time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+
+from seabattle import startup
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('NLU_WARMUP', '0')
+    monkeypatch.setattr(startup, 'timer', startup.StartupTimer())
+    from seabattle import api
+    return api.app.test_client()
+
+
+def _request(command, user_id='api-user', message_id=1):
+    return {
+        'version': '1.0',
+        'session': {'user_id': user_id, 'session_id': '1', 'message_id': message_id},
+        'request': {'command': command, 'original_utterance': command},
+    }
+
+
+def test_ready(client):
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert json.loads(response.get_data(as_text=True))['ready'] is False
+
+    startup.timer.mark_ready()
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True))['ready'] is True
+
+
+def test_newgame(client):
+    response = client.post('/', data=json.dumps(_request('новая игра')), content_type='application/json')
+    body = json.loads(response.get_data(as_text=True))
+    assert body['response']['text'] == 'Инициализирована новая игра c Алиса'
+    assert body['session']['user_id'] == 'api-user'
+
+
+def test_retry_replays_response(client):
+    def post(command, message_id):
+        response = client.post('/', data=json.dumps(_request(command, 'retry-user', message_id)),
+                               content_type='application/json')
+        return json.loads(response.get_data(as_text=True))['response']['text']
+
+    first = post('новая игра', 1)
+    # повтор того же сообщения не обрабатывается заново, даже если текст другой
+    assert post('начинай', 1) == first
+    shot = post('начинай', 2)
+    assert shot != first
+    # повтор после таймаута получает тот же выстрел, а не новый
+    assert post('начинай', 2) == shot
+
+
+def test_metrics(client):
+    client.post('/', data=json.dumps(_request('новая игра')), content_type='application/json')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'seabattle_intents_total{intent="newgame",source="fastpath"}' in text
+    assert 'seabattle_stage_seconds_count{stage="request"}' in text
+    assert 'seabattle_sessions ' in text
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import functools
+import io
+import json
+import pickle
+from concurrent import futures
+
+import pytest
+from twisted.internet import task
+from twisted.web.test.requesthelper import DummyRequest
+
+from seabattle import startup
+
+
+class Reactor(task.Clock):
+    """Часы Twisted, которые выполняют callFromThread сразу"""
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class PendingExecutor(object):
+    """Пул, который не выполняет задачи, пока тест не попросит"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        future = futures.Future()
+        self.tasks.append((future, fn, args))
+        return future
+
+    def run_all(self):
+        for future, fn, args in self.tasks:
+            if future.set_running_or_notify_cancel():
+                future.set_result(fn(*args))
+        self.tasks = []
+
+
+@pytest.fixture
+def async_api(monkeypatch):
+    monkeypatch.setenv('NLU_WARMUP', '0')
+    monkeypatch.setattr(startup, 'timer', startup.StartupTimer())
+    from seabattle import async_api
+    return async_api
+
+
+def _post(webhook, body):
+    request = DummyRequest([b''])
+    request.method = b'POST'
+    request.content = io.BytesIO(json.dumps(body).encode('utf-8'))
+    request.render(webhook)
+    return request
+
+
+def _body(request):
+    return json.loads(b''.join(request.written).decode('utf-8'))
+
+
+def _handler(json_body):
+    return {'response': {'text': json_body['request']['command']}}
+
+
+def _message(command):
+    return {'request': {'command': command}}
+
+
+def test_post(async_api):
+    executor = futures.ThreadPoolExecutor(2)
+    reactor = Reactor()
+    webhook = async_api.WebhookResource(executor, reactor, _handler)
+
+    request = _post(webhook, _message('попала'))
+    executor.shutdown(wait=True)
+    assert request.finished
+    assert request.responseCode == 200
+    assert _body(request)['response']['text'] == 'попала'
+
+
+def test_concurrency_limit_and_timeout(async_api):
+    executor = PendingExecutor()
+    reactor = Reactor()
+    webhook = async_api.WebhookResource(executor, reactor, _handler, timeout=1, max_concurrency=1, max_pending=1)
+
+    running = _post(webhook, _message('убила'))
+    waiting = _post(webhook, _message('мимо б 5'))
+    rejected = _post(webhook, _message('ранила'))
+    assert len(executor.tasks) == 1
+    assert rejected.responseCode == 503
+
+    reactor.advance(1)
+    assert running.responseCode == waiting.responseCode == 504
+    assert not webhook.semaphore.waiting
+
+    # поздний результат уже отменённого запроса не ломает reactor
+    executor.run_all()
+    assert _post(webhook, _message('ранила')).responseCode is None
+    executor.run_all()
+
+
+def test_ready(async_api):
+    webhook = async_api.WebhookResource(PendingExecutor(), Reactor())
+    request = DummyRequest([b'ready'])
+    request.render(webhook)
+    assert request.responseCode == 503
+
+    startup.timer.mark_ready()
+    request = DummyRequest([b'ready'])
+    request.render(webhook)
+    assert request.responseCode == 200
+    assert _body(request)['ready'] is True
+
+
+def test_process_handler_is_picklable(async_api):
+    handler = pickle.loads(pickle.dumps(functools.partial(async_api._handle_in_process, warmup=True)))
+    assert handler.func is async_api._handle_in_process and handler.keywords == {'warmup': True}
@@ -0,0 +1,63 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import numpy as np
+
+from seabattle import batch
+from seabattle.game import BaseGame
+from seabattle.strategy import Strategy
+
+
+def test_generate_fields():
+    ship_ids, _ = batch.generate_fields(200, rng=np.random.RandomState(1))
+
+    assert ((ship_ids >= 0).sum(axis=1) == sum(BaseGame.default_ships)).all()
+    for k, length in enumerate(sorted(BaseGame.default_ships, reverse=True)):
+        assert ((ship_ids == k).sum(axis=1) == length).all()
+
+
+def _strategy_params(strategy):
+    def _start(starts):
+        starts = sorted(set(starts))
+        return 1 if len(starts) < 2 or starts[1] - starts[0] == strategy.region_size else starts[1]
+
+    return (
+        _start(r.start_x for r in strategy.regions),
+        _start(r.start_y for r in strategy.regions),
+        [row.index(1) for row in strategy.combination],
+    )
+
+
+def test_shooting_ranks_match_strategy():
+    for region_size in (4, 3, 2):
+        strategies = [Strategy(region_size=region_size) for _ in range(20)]
+        params = [_strategy_params(s) for s in strategies]
+        ranks = batch.ranks_for(
+            [p[0] for p in params], [p[1] for p in params], np.array([p[2] for p in params]),
+            region_size=region_size,
+        )
+
+        for strategy, row in zip(strategies, ranks):
+            expected = [(p.y - 1) * 10 + p.x - 1 for p in reversed(strategy.shooting_field)]
+            assert list(np.argsort(row)[:len(expected)]) == expected
+            assert np.isfinite(row).sum() == len(expected)
+
+
+def test_simulator_follows_base_game_rules():
+    simulator = batch.BatchSimulator(50, seed=3)
+    referee = BaseGame()
+    referee.start_new_game(field=[int(v) for v in simulator.field[0]])
+
+    kills = 0
+    while not simulator.done.all():
+        active = not simulator.done[0]
+        cells, hit, killed = simulator.step()
+        if active:
+            answer = referee.handle_enemy_shot(referee.calc_position(int(cells[0])))
+            expected = 'kill' if killed[0] else 'hit' if hit[0] else 'miss'
+            assert answer == expected
+            kills += answer == 'kill'
+
+    assert kills == len(BaseGame.default_ships)
+    assert referee.is_defeat()
+    assert (simulator.shots >= 20).all() and (simulator.shots <= 100).all()
@@ -0,0 +1,36 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+from seabattle import benchmark
+from seabattle import dialog_manager as dm
+
+
+def test_run(monkeypatch, tmpdir):
+    router, cache = object(), object()
+    monkeypatch.setattr(dm, '_router', router)
+    monkeypatch.setattr(dm, 'parse_cache', cache)
+
+    results = benchmark.run(['convert_to_position', 'do_shot_*', 'handle_message_router'], min_time=0.001, repeat=2)
+    assert list(results) == ['convert_to_position', 'do_shot_strategy', 'do_shot_damaged',
+                             'do_shot_random', 'do_shot_density', 'do_shot_late', 'handle_message_router']
+    for result in results.values():
+        assert result['ops_per_sec'] > 0
+        assert result['memory']['kind'] in ('tracemalloc_bytes', 'gc_objects')
+    # заглушка роутера действует только на время бенчмарка
+    assert dm._router is router and dm.parse_cache is cache
+
+    path = str(tmpdir.join('baseline.json'))
+    benchmark.save(path, results)
+    assert benchmark.load(path)['results']['do_shot_density']['ops'] == results['do_shot_density']['ops']
+
+
+def test_compare():
+    baseline = {'results': {'a': {'ops_per_sec': 1000.0}, 'b': {'ops_per_sec': 1000.0}}}
+    results = {'a': {'ops_per_sec': 850.0}, 'b': {'ops_per_sec': 850.0}, 'c': {'ops_per_sec': 1.0}}
+
+    lines, regressions = benchmark.compare(baseline, results, threshold=0.1, thresholds={'b': 0.2})
+    assert regressions == ['a']
+    assert len(lines) == 3
+
+    assert benchmark._parse_thresholds(['0.05', 'b=0.3']) == (0.05, {'b': 0.3})
@@ -0,0 +1,29 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from seabattle.bitboard import BitField, get_masks, iter_bits
+
+
+def test_masks():
+    masks = get_masks(3)
+
+    assert list(iter_bits(masks.rows[1])) == [3, 4, 5]
+    assert list(iter_bits(masks.cols[2])) == [2, 5, 8]
+    assert list(iter_bits(masks.neighbours[0])) == [1, 3, 4]
+    assert list(iter_bits(masks.line_neighbours[4])) == [1, 3, 5, 7]
+    assert get_masks(3) is masks
+
+
+def test_bit_field():
+    values = [0, 1, 0, 3, 0, 4, 0, 0, 2]
+    field = BitField.from_list(3, values)
+
+    assert list(field) == values
+    assert field[3:6] == [3, 0, 4]
+    assert field[-1] == 2
+
+    copy = field.copy()
+    copy[1] = 3
+    assert copy[1] == 3
+    assert field[1] == 1
+    assert copy.plane(1) == 0
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import json
+import threading
+
+import pytest
+from twisted.web.test.requesthelper import DummyRequest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from seabattle import bot_webhook, session
+
+
+class FakeTelegram(object):
+    """Локальный Bot API: запоминает вызовы и отвечает ok"""
+
+    def __init__(self):
+        self.calls = []
+        self.connections = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                fake.calls.append((self.path, json.loads(body.decode('utf-8'))))
+                fake.connections.add(self.client_address)
+                payload = json.dumps({'ok': True, 'result': True}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def telegram():
+    fake = FakeTelegram()
+    yield fake
+    fake.stop()
+
+
+def _post(webhook, update, path=b'secret'):
+    request = DummyRequest([path])
+    request.method = b'POST'
+    request.content = io.BytesIO(json.dumps(update).encode('utf-8'))
+    request.render(webhook)
+    return request
+
+
+def _update(chat_id, text):
+    return {'update_id': 1, 'message': {'message_id': 1, 'chat': {'id': chat_id}, 'text': text}}
+
+
+def test_client_reuses_connection(telegram):
+    client = bot_webhook.TelegramClient('TOKEN', telegram.url, pool_size=2)
+    client.send_message(1, 'раз')
+    client.send_message(1, 'два')
+    client.close()
+
+    assert [path for path, _ in telegram.calls] == ['/botTOKEN/sendMessage'] * 2
+    assert telegram.calls[1][1] == {'chat_id': 1, 'text': 'два'}
+    assert len(telegram.connections) == 1
+
+
+class FakeDispatcher(object):
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, chat_id, item):
+        self.submitted.append((chat_id, item))
+
+
+def test_webhook_ignores_edited_messages(telegram):
+    client = bot_webhook.TelegramClient('TOKEN', telegram.url)
+    client.set_webhook('https://example.com/secret')
+    client.close()
+    assert telegram.calls[0][0] == '/botTOKEN/setWebhook'
+    assert telegram.calls[0][1]['allowed_updates'] == ['message']
+
+    dispatcher = FakeDispatcher()
+    webhook = bot_webhook.WebhookResource(dispatcher, 'secret', clock=lambda: 0)
+    edited = _update(42, 'убил')
+    edited['edited_message'] = edited.pop('message')
+    assert _post(webhook, edited).responseCode is None
+    assert dispatcher.submitted == []
+
+    _post(webhook, _update(42, 'ранил'))
+    assert [chat_id for chat_id, _ in dispatcher.submitted] == [42]
+
+
+def test_dispatcher_keeps_chat_order():
+    handled = []
+    release = threading.Event()
+
+    def handler(chat_id, item):
+        if chat_id == 'slow':
+            release.wait(5)
+        handled.append((chat_id, item))
+
+    dispatcher = bot_webhook.ChatDispatcher(handler, workers=4)
+    for i in range(3):
+        dispatcher.submit('slow', i)
+    for i in range(20):
+        dispatcher.submit('fast-%d' % (i % 2), i)
+
+    # медленный чат занимает один поток, остальные чаты продолжают работать
+    for _ in range(500):
+        if len(handled) == 20:
+            break
+        threading.Event().wait(0.01)
+    assert len(handled) == 20
+    release.set()
+    dispatcher.shutdown()
+
+    assert len(handled) == 23
+    for chat_id in ('slow', 'fast-0', 'fast-1'):
+        items = [item for chat, item in handled if chat == chat_id]
+        assert items == sorted(items)
+    assert dispatcher.pending() == 0
+
+
+def test_webhook_replies_through_api(telegram, monkeypatch):
+    monkeypatch.setattr(session, '_store', session.MemoryStore())
+    client = bot_webhook.TelegramClient('TOKEN', telegram.url)
+    dispatcher = bot_webhook.ChatDispatcher(bot_webhook.make_handler(client), workers=2)
+    webhook = bot_webhook.WebhookResource(dispatcher, 'secret')
+
+    assert _post(webhook, _update(42, 'новая игра')).responseCode is None
+    assert _post(webhook, {'update_id': 2, 'edited_channel_post': {}}).responseCode is None
+    assert _post(webhook, _update(42, 'новая игра'), path=b'other').responseCode == 404
+    dispatcher.shutdown()
+    client.close()
+
+    assert len(telegram.calls) == 1
+    path, params = telegram.calls[0]
+    assert path == '/botTOKEN/sendMessage'
+    assert params['chat_id'] == 42
+    assert params['text'].startswith('Инициализирована новая игра')
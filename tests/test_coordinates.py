@@ -0,0 +1,60 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from seabattle.coordinates import LEXICON, Lexicon, get_lexicon
+
+
+@pytest.mark.parametrize('text, position', [
+    ('б 5', (2, 5)),
+    ('к десять', (10, 10)),
+    ('бэ 3', (2, 3)),
+    ('ка 1', (10, 1)),
+    ('zh 2', (7, 2)),
+    ('Д5', (5, 5)),
+    ('трень трень', (3, 3)),
+    ('две одна', (2, 1)),
+    ('5  7', (5, 7)),
+])
+def test_parse(text, position):
+    assert LEXICON.parse(text) == position
+
+
+@pytest.mark.parametrize('text, position', [
+    ('чатыре пять', (4, 5)),
+    ('д пят', (5, 5)),
+    ('восем девять', (8, 9)),
+    ('а дивять', (1, 9)),
+])
+def test_parse_fuzzy(text, position):
+    assert LEXICON.parse(text) == position
+
+
+@pytest.mark.parametrize('text', ['т 5', 'д б', 'д 11', 'д пятнадцать', 'пять', 'а 1 2', 'ф 3'])
+def test_parse_errors(text):
+    with pytest.raises(ValueError):
+        LEXICON.parse(text)
+
+
+def test_render():
+    assert LEXICON.render((2, 7)) == 'б, 7'
+    assert LEXICON.render((2, 7), numbers=True) == '2, 7'
+    assert LEXICON.render_tts('2, 7') == '2 - - - - 7'
+    with pytest.raises(ValueError):
+        LEXICON.render((11, 1))
+
+
+def test_small_size():
+    lexicon = Lexicon(size=5)
+    assert lexicon.parse('д 5') == (5, 5)
+    with pytest.raises(ValueError):
+        lexicon.parse('е 5')
+    with pytest.raises(ValueError):
+        lexicon.parse('5 шесть')
+
+
+def test_get_lexicon():
+    assert get_lexicon() is LEXICON
+    assert get_lexicon(5) is get_lexicon(5)
+    assert get_lexicon(5).size == 5
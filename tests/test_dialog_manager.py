@@ -44,6 +44,11 @@ def opponent(name):
     return '%s, ' % name
 
 
+class ScriptedGame(gm.Game):
+    """Game с подменяемыми ходами: у Game нет __dict__, поэтому атрибуты объявлены здесь"""
+    __slots__ = ('do_shot', 'repeat')
+
+
 def test_game_1():
     assert say('начни новую игру соперник яндекс') == newgame('яндекс')
 
@@ -57,7 +62,7 @@ def test_game_1():
 
     shots = ['1, 1', '1, 2', '2, 3', '3, 3', '1, 3']
 
-    game = gm.Game()
+    game = ScriptedGame()
     game.start_new_game(3, field, [2, 1])
     game.do_shot = mock.Mock(side_effect=shots)
     game.repeat = mock.Mock(return_value='2, 3')
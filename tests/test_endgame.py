@@ -0,0 +1,67 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import random
+
+from seabattle import endgame, placement
+from seabattle.game import BaseGame, EndgameGame
+from seabattle.strategy import Point
+
+
+def _mask(cells):
+    return sum(1 << cell for cell in cells)
+
+
+def test_configurations():
+    # два однопалубника на поле 3×3 не касаются друг друга
+    configs = endgame.configurations(3, _mask(range(9)), 0, (1, 1))
+    expected = [(a, b) for a in range(9) for b in range(a + 1, 9)
+                if abs(a % 3 - b % 3) > 1 or abs(a // 3 - b // 3) > 1]
+    assert sorted(ships for ships, _ in configs) == sorted(_mask(pair) for pair in expected)
+
+    # раненая клетка 4 покрыта двухпалубником, целиком подбитых кораблей нет
+    configs = endgame.configurations(3, _mask([1, 3, 5, 7]), _mask([4]), (2,))
+    assert sorted(ships for ships, _ in configs) == sorted(_mask(p) for p in ([1, 4], [3, 4], [4, 5], [4, 7]))
+
+    assert endgame.configurations(10, _mask(range(100)), 0, (4, 3, 3, 2), limit=1000) is None
+
+
+def test_solver_expected_shots():
+    # один однопалубник среди n клеток: в среднем (n + 1) / 2 выстрела
+    unknown = _mask([0, 2, 6, 8])
+    configs = endgame.configurations(3, unknown, 0, (1,))
+    value, cell, exact = endgame.Solver(3).solve(unknown, 0, (1,), configs, 10)
+    assert exact and value == 2.5 and cell in (0, 2, 6, 8)
+
+    # двухпалубник в строке из трёх клеток: средняя клетка всегда попадает,
+    # потом одна или две попытки с краю
+    unknown = _mask([0, 1, 2])
+    configs = endgame.configurations(3, unknown, 0, (2,))
+    value, cell, exact = endgame.Solver(3).solve(unknown, 0, (2,), configs, 10)
+    assert exact and cell == 1 and value == 2.5
+
+
+def test_solver_falls_back_to_most_likely_cell():
+    unknown = (1 << 16) - 1
+    configs = endgame.configurations(4, unknown, 0, (2, 1))
+    counts = endgame._hit_counts(configs, unknown)
+    cell = endgame.Solver(4).choose(unknown, 0, (2, 1), configs, budget=0)
+    assert counts[cell] == max(counts.values())
+
+
+def test_endgame_game_finishes():
+    random.seed(4)
+    referee = BaseGame()
+    referee.start_new_game(field=placement.generate_field(10, BaseGame.default_ships))
+    game = EndgameGame()
+    game.start_new_game(numbers=True)
+
+    shots = set()
+    while not referee.is_defeat():
+        game.do_shot()
+        point = tuple(game.last_shot_position)
+        assert point not in shots
+        shots.add(point)
+        game.handle_enemy_reply(referee.handle_enemy_shot(Point(*point)))
+    assert len(shots) < 100
+    assert game.remaining_enemy_ships() == ()
@@ -0,0 +1,79 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from seabattle import evaluate
+
+
+class Message(object):
+    def __init__(self, text, intent, entities=None):
+        self.text = text
+        self.data = {'intent': intent, 'entities': entities or []}
+
+    def get(self, prop, default=None):
+        return self.data.get(prop, default)
+
+
+def _examples():
+    examples = [Message('мимо %d' % i, 'miss') for i in range(6)]
+    examples += [Message('убил %d' % i, 'kill') for i in range(3)]
+    examples += [Message('я хожу а %d' % i, 'hit', [{'entity': 'hit_entity', 'start': 7, 'end': 10}])
+                 for i in range(3)]
+    return examples
+
+
+def test_stratified_folds():
+    examples = _examples()
+    folds = evaluate.stratified_folds(examples, 3, seed=1)
+    assert len(folds) == 3
+    assert sorted(m.text for _, test in folds for m in test) == sorted(m.text for m in examples)
+    for train, test in folds:
+        assert len(train) + len(test) == len(examples)
+        assert sorted(m.get('intent') for m in test) == ['hit', 'kill', 'miss', 'miss']
+    assert [[m.text for m in test] for _, test in folds] == \
+        [[m.text for m in test] for _, test in evaluate.stratified_folds(_examples(), 3, seed=1)]
+
+
+def test_scores():
+    scores = evaluate.Scores(threshold=0.8)
+    gold = [{'entity': 'hit_entity', 'start': 7, 'end': 10}]
+    scores.add('hit', gold, {'intent': {'name': 'hit', 'confidence': 0.9}, 'entities': gold})
+    scores.add('hit', gold, {'intent': {'name': 'miss', 'confidence': 0.5},
+                             'entities': [{'entity': 'hit_entity', 'start': 7, 'end': 9}]})
+    scores.add('miss', [], {'intent': {'name': 'miss', 'confidence': 0.95}, 'entities': []})
+
+    assert scores.total == 3
+    assert abs(scores.accuracy() - 2 / 3.0) < 1e-9
+    assert scores.intent_accuracy() == {'hit': 0.5, 'miss': 1.0}
+    assert abs(scores.unsure_rate() - 1 / 3.0) < 1e-9
+    per_entity, micro = scores.entity_scores()
+    assert per_entity['hit_entity'] == micro == (0.5, 0.5, 0.5)
+
+
+def test_evaluate_profile():
+    trained = []
+
+    def train(config, examples):
+        trained.append(len(examples))
+        # «модель» запоминает намерения обучающих фраз по первому слову
+        return dict((m.text.split()[0], m.get('intent')) for m in examples)
+
+    def parse_batch(interpreter, texts, timer=None):
+        timer('tokenizer', 0.002 * len(texts), len(texts))
+        timer('classifier', 0.001 * len(texts), len(texts))
+        return [{'intent': {'name': interpreter.get(t.split()[0]), 'confidence': 1.0}, 'entities': []}
+                for t in texts]
+
+    folds = evaluate.stratified_folds(_examples(), 3)
+    result = evaluate.evaluate_profile('fake', 'fake.yml', folds, train, batch_size=2, workers=2,
+                                       parse_batch=parse_batch)
+    assert trained == [8, 8, 8]
+    assert result.scores.accuracy() == 1.0
+    assert result.scores.entity_scores()[1] == (0.0, 0.0, 0.0)
+    assert result.latencies.order[:2] == ['tokenizer', 'classifier']
+    assert len(result.latencies.samples['classifier']) == 12
+    assert abs(result.latencies.percentiles('tokenizer')[0] - 0.002) < 1e-9
+
+    text = evaluate.format_result(result)
+    assert 'fake' in text and 'tokenizer' in text and evaluate.TOTAL in text
+    assert 'fake' in evaluate.format_comparison([result])
+    assert evaluate.profile_name('config/nlu_config_lite.yml') == 'lite'
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import pytest
+
+from seabattle import fastpath
+
+
+def _intent(message):
+    response = fastpath.parse(message)
+    return response['intent']['name'] if response is not None else None
+
+
+def _shot(message):
+    entities = fastpath.parse(message)['entities']
+    assert [e['entity'] for e in entities] == ['hit_entity']
+    return entities[0]['value']
+
+
+@pytest.mark.parametrize('message, intent', [
+    ('Попала', 'hit'),
+    ('ты ранила!', 'hit'),
+    ('убила', 'kill'),
+    ('Корабль утонул.', 'kill'),
+    ('начинай', 'letsstart'),
+    ('я не понял', 'dontunderstand'),
+    ('Ура, победа!', 'victory'),
+    ('я проиграла', 'defeat'),
+])
+def test_phrases(message, intent):
+    assert _intent(message) == intent
+
+
+def test_miss():
+    assert _shot('мимо б 5') == 'б 5'
+    assert _shot('Мимо. Я хожу 2 2') == '2 2'
+    assert _shot('я ухожу в 7 9') == '7 9'
+    assert _shot('я хожу в 5') == 'в 5'
+    assert _shot('мимо, я хожу а10') == 'а10'
+    assert _shot('я хожу семь четыре') == 'семь четыре'
+    assert _shot('мимо я хожу трень трень') == 'трень трень'
+
+
+def test_newgame():
+    response = fastpath.parse('Начни новую игру, соперник Яндекс')
+    assert response['intent']['name'] == 'newgame'
+    entity, = response['entities']
+    assert entity['entity'] == 'opponent_entity'
+    assert entity['value'] == 'яндекс'
+    assert response['text'][entity['start']:entity['end']] == 'яндекс'
+
+    assert fastpath.parse('новая игра')['entities'] == []
+
+
+@pytest.mark.parametrize('message', [
+    'мимо',
+    'б 5',
+    'я хожу куда-нибудь туда',
+    'новая игра c алисой',
+    'ты попала но не убила',
+    '',
+])
+def test_fallback(message):
+    assert fastpath.parse(message) is None
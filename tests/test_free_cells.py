@@ -0,0 +1,95 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import random
+
+from seabattle.free_cells import FreeCells
+from seabattle.game import Game, MISS
+from seabattle.strategy import Point
+
+
+def test_discard_and_select():
+    free = FreeCells(4)
+    assert len(free) == 16
+    assert free.discard(5)
+    assert not free.discard(5)
+    free.discard(0)
+    free.discard(15)
+
+    assert 5 not in free and 6 in free
+    assert list(free) == [i for i in range(16) if i not in (0, 5, 15)]
+    assert [free.select(k) for k in range(len(free))] == list(free)
+    assert free.has_point(Point(3, 2))
+    assert not free.has_point(Point(2, 2))
+    assert not free.has_point(Point(5, 1))
+
+    rng = random.Random(1)
+    assert all(free.choice(rng) in free for _ in range(50))
+
+
+def test_runs():
+    free = FreeCells(10)
+    # строка 3: закрыты x = 2 и x = 7
+    free.discard(2 * 10 + 1)
+    free.discard(2 * 10 + 6)
+    # столбец 5: закрыт y = 1
+    free.discard(4)
+
+    assert free.row_run(2 * 10 + 4) == (3, 6)
+    assert free.row_run(2 * 10 + 0) == (1, 1)
+    assert free.row_run(2 * 10 + 1) is None
+    assert free.col_run(2 * 10 + 4) == (2, 10)
+    assert free.max_run(2 * 10 + 4) == 9
+    assert free.max_run(2 * 10 + 1) == 0
+
+    # поле с выстрелами даёт те же отрезки, что и discard по одному
+    field = [0] * 100
+    for index in (21, 26, 4):
+        field[index] = MISS
+    rebuilt = FreeCells(10, field)
+    assert [rebuilt.row_run(i) for i in range(100)] == [free.row_run(i) for i in range(100)]
+    assert [rebuilt.col_run(i) for i in range(100)] == [free.col_run(i) for i in range(100)]
+
+
+def test_ordered():
+    free = FreeCells(4)
+    free.discard(7)
+    order = (3, 7, 12, 0, 9)
+    ranks = [-1] * 16
+    for rank, index in enumerate(order):
+        ranks[index] = rank
+    view = free.ordered(order, ranks)
+
+    assert view.last_before(5) == 4
+    free.discard(9)
+    free.discard(0)
+    assert view.last_before(5) == 2
+    # клетка 7 была прострелена ещё до того, как построили порядок
+    assert view.last_before(2) == 0
+    free.discard(3)
+    assert view.last_before(2) == -1
+
+
+def test_game_never_repeats_shots():
+    game = Game()
+    game.start_new_game(numbers=True)
+    shots = set()
+    for _ in range(100):
+        game.do_shot()
+        point = tuple(game.last_shot_position)
+        assert point not in shots
+        shots.add(point)
+        game.handle_enemy_reply('miss')
+    assert len(game.free_cells) == 0
+    assert all(value == MISS for value in game.enemy_field)
+
+
+def test_index_follows_replaced_field():
+    game = Game()
+    game.start_new_game(numbers=True)
+    game.do_shot()
+    game.handle_enemy_reply('miss')
+    assert len(game.free_cells) == 99
+
+    game.start_new_game(numbers=True)
+    assert len(game.free_cells) == 100
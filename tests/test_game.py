@@ -1,6 +1,6 @@
 # coding: utf-8
 from __future__ import unicode_literals
-from seabattle.game import Game
+from seabattle.game import BaseGame, Game
 
 import pytest
 
@@ -38,17 +38,17 @@ def test_helper_functions(game):
 
     assert game.calc_position(63) == (4, 7)
 
-    # assert game.convert_to_position('a10') == (1, 10)
-    # assert game.convert_to_position('d 7') == (5, 7)
-    # assert game.convert_to_position('д 5') == (5, 5)
-    # assert game.convert_to_position('g 3') == (4, 3)
+    assert game.convert_to_position('a10') == (1, 10)
+    assert game.convert_to_position('d 7') == (5, 7)
+    assert game.convert_to_position('д 5') == (5, 5)
+    assert game.convert_to_position('g 3') == (4, 3)
 
-    # assert game.convert_to_position('k 1') == (10, 1)
-    # assert game.convert_to_position('k 2') == (10, 2)
-    # assert game.convert_to_position('k 10') == (10, 10)
-    # assert game.convert_to_position('k два') == (10, 2)
+    assert game.convert_to_position('k 1') == (10, 1)
+    assert game.convert_to_position('k 2') == (10, 2)
+    assert game.convert_to_position('k 10') == (10, 10)
+    assert game.convert_to_position('k два') == (10, 2)
 
-    # assert game.convert_to_position('d пять') == (5, 5)
+    assert game.convert_to_position('d пять') == (5, 5)
 
     assert game.convert_to_position('10 10') == (10, 10)
     assert game.convert_to_position('1 10') == (1, 10)
@@ -57,24 +57,34 @@ def test_helper_functions(game):
     assert game.convert_to_position('8 4') == (8, 4)
     assert game.convert_to_position('восемь четыре') == (8, 4)
 
-    # assert game.convert_to_position('уже 4') == (7, 4)
-    # assert game.convert_to_position('the 4') == (8, 4)
-    # assert game.convert_to_position('за 4') == (8, 4)
+    assert game.convert_to_position('уже 4') == (7, 4)
+    assert game.convert_to_position('the 4') == (8, 4)
+    assert game.convert_to_position('за 4') == (8, 4)
 
     with pytest.raises(ValueError):
         assert game.convert_to_position('1') == (1, 1)
 
-    # with pytest.raises(ValueError):
-    #    game.convert_to_position('т шесть')
+    with pytest.raises(ValueError):
+        game.convert_to_position('т шесть')
 
-    # with pytest.raises(ValueError):
-    #    game.convert_to_position('д пятнадцать')
+    with pytest.raises(ValueError):
+        game.convert_to_position('д пятнадцать')
 
-    # assert game.convert_from_position((1, 1)) == 'а, 1'
-    # assert game.convert_from_position((6, 5)) == 'е, 5'
+    assert game.convert_from_position((1, 1)) == 'а, 1'
+    assert game.convert_from_position((6, 5)) == 'е, 5'
     assert game.convert_from_position((6, 5), numbers=True) == '6, 5'
 
 
+def test_positions_follow_field_size():
+    game = BaseGame()
+    game.start_new_game(5, field=[0] * 25)
+    assert game.convert_to_position('д 5') == (5, 5)
+    with pytest.raises(ValueError):
+        game.convert_to_position('е 5')
+    with pytest.raises(ValueError):
+        game.convert_from_position((6, 5))
+
+
 def test_shot(game_with_field):
     assert game_with_field.handle_enemy_shot((10, 1)) == 'hit'
     assert game_with_field.handle_enemy_shot((10, 2)) == 'kill'
@@ -139,3 +149,50 @@ def test_handle_enemy_reply(game):
 def test_handle_reply(game):
     game.do_shot()
     game.handle_enemy_reply('miss')
+
+
+@pytest.fixture
+def bitboard_game_with_field(game_with_field):
+    game_with_field.start_new_game(field=list(game_with_field.field), bitboard=True)
+
+    return game_with_field
+
+
+def test_bitboard_dead_ship(bitboard_game_with_field):
+    assert bitboard_game_with_field.handle_enemy_shot((7, 1)) == 'kill'
+
+    assert bitboard_game_with_field.handle_enemy_shot((1, 5)) == 'hit'
+    assert bitboard_game_with_field.handle_enemy_shot((2, 5)) == 'kill'
+
+    assert bitboard_game_with_field.handle_enemy_shot((1, 2)) == 'hit'
+    assert bitboard_game_with_field.handle_enemy_shot((3, 2)) == 'hit'
+    assert bitboard_game_with_field.handle_enemy_shot((2, 2)) == 'kill'
+
+    assert bitboard_game_with_field.handle_enemy_shot((4, 2)) == 'miss'
+    assert bitboard_game_with_field.ships_count == 7
+
+
+def test_bitboard_handle_enemy_reply():
+    games = [Game(), Game()]
+    games[0].start_new_game()
+    games[1].start_new_game(bitboard=True)
+
+    for game in games:
+        game.last_shot_position = Point(5, 5)
+        game.handle_enemy_reply('hit')
+        game.last_shot_position = Point(5, 6)
+        game.handle_enemy_reply('kill')
+        game.last_shot_position = Point(1, 1)
+        game.handle_enemy_reply('miss')
+
+    assert list(games[1].enemy_field) == list(games[0].enemy_field)
+    assert games[1].enemy_ships_count == games[0].enemy_ships_count
+    games[1].print_enemy_field()
+
+
+def test_games_have_no_instance_dict():
+    # состояние партии целиком в __slots__: словаря атрибутов у сессии нет
+    for game in (BaseGame(), Game(), Game(density=True)):
+        assert not hasattr(game, '__dict__')
+        with pytest.raises(AttributeError):
+            game.unknown_attribute = 1
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+
+from seabattle import loadtest, session, startup
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    monkeypatch.setenv('NLU_WARMUP', '0')
+    monkeypatch.setattr(startup, 'timer', startup.StartupTimer())
+    monkeypatch.setattr(session, '_store', session.MemoryStore())
+    return loadtest.LocalTransport()
+
+
+def test_full_games_and_replay(transport, tmpdir):
+    path = str(tmpdir.join('traffic.jsonl'))
+    recorder = loadtest._Recorder(path)
+    stats = loadtest.run_step(transport, concurrency=2, games=1, recorder=recorder, seed=1)
+    recorder.close()
+
+    result = stats.as_dict()
+    assert result['games'] == 2
+    assert result['error_rate'] == 0
+    assert result['dontunderstand_rate'] == 0
+    assert result['requests'] > 40
+    assert result['p99_ms'] >= result['p50_ms'] > 0
+
+    traffic = loadtest.load_traffic(path)
+    assert len(traffic) == 2
+    assert sum(len(requests) for requests in traffic) == result['requests']
+    assert traffic[0][0]['request']['command'] == 'новая игра'
+
+    replayed = loadtest.replay(transport, traffic, concurrency=2).as_dict()
+    assert replayed['requests'] == result['requests']
+
+
+def test_make_request():
+    body = loadtest.make_request('u', 's', 0, 'Мимо, я хожу 5 7')
+    assert body['request']['command'] == 'мимо я хожу 5 7'
+    assert body['request']['original_utterance'] == 'Мимо, я хожу 5 7'
+    assert body['session']['new'] is True
+    json.dumps(body)
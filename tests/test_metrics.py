@@ -0,0 +1,51 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+from seabattle import metrics
+
+
+def test_counter_and_gauge():
+    registry = metrics.Registry()
+    counter = metrics.Counter('intents_total', 'Интенты', ['intent'], registry=registry)
+    counter.inc(['hit'])
+    counter.inc(['hit'])
+    counter.inc(['say "hi"\n'])
+    metrics.Gauge('sessions', 'Сессии', lambda: 3, registry=registry)
+
+    text = registry.render()
+    assert '# TYPE intents_total counter' in text
+    assert 'intents_total{intent="hit"} 2' in text
+    assert 'intents_total{intent="say \\"hi\\"\\n"} 1' in text
+    assert 'sessions 3' in text
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('latency_seconds', 'Время', ['stage'], buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 0.5, 7):
+        histogram.observe(value, ['nlu'])
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{stage="nlu",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="nlu",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{stage="nlu",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{stage="nlu"} 8.05' in lines
+    assert 'latency_seconds_count{stage="nlu"} 4' in lines
+    assert histogram.count(['nlu']) == 4
+
+
+def test_span_and_disabled():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('stage_seconds', 'Время', ['stage'], registry=registry)
+    with metrics.span('game', histogram):
+        pass
+    assert histogram.count(['game']) == 1
+
+    registry.enabled = False
+    with metrics.span('game', histogram):
+        pass
+    counter = metrics.Counter('off_total', 'Выключено', registry=registry)
+    counter.inc()
+    assert histogram.count(['game']) == 1
+    assert counter.get() == 0
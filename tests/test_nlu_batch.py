@@ -0,0 +1,157 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import threading
+
+import pytest
+
+from seabattle import nlu_batch
+
+
+def test_micro_batcher():
+    batches = []
+    started = threading.Event()
+
+    def batch_parse(texts):
+        batches.append(list(texts))
+        started.wait()
+        return [{'text': text} for text in texts]
+
+    batcher = nlu_batch.MicroBatcher(batch_parse, max_batch_size=4, max_wait=0.05)
+    results = {}
+
+    def call(text):
+        results[text] = batcher.parse(text)['text']
+
+    threads = [threading.Thread(target=call, args=('phrase %d' % i,)) for i in range(9)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    batcher.stop()
+
+    assert results == dict(('phrase %d' % i, 'phrase %d' % i) for i in range(9))
+    assert sorted(sum(batches, [])) == sorted(results)
+    assert max(len(b) for b in batches) <= 4
+
+    stats = batcher.stats.as_dict()
+    assert stats['requests'] == 9
+    assert stats['batches'] == len(batches)
+    assert sum(size * count for size, count in stats['batch_sizes'].items()) == 9
+    assert stats['max_queue_delay'] >= stats['mean_queue_delay'] >= 0
+
+
+def test_micro_batcher_error():
+    def batch_parse(texts):
+        raise RuntimeError('model is broken')
+
+    batcher = nlu_batch.MicroBatcher(batch_parse, max_wait=0)
+    with pytest.raises(RuntimeError):
+        batcher.parse('попала')
+    batcher.stop()
+
+
+class Router(object):
+    def __init__(self):
+        self.project_store = {}
+        self.parsed = []
+
+    def extract(self, data):
+        return {'text': data['q']}
+
+    def parse(self, data):
+        self.parsed.append(data['text'])
+        return {'text': data['text']}
+
+
+def test_router_fallback_before_model_load():
+    router = Router()
+    assert nlu_batch.router_parse_batch(router, ['убила', 'ранила']) == [{'text': 'убила'}, {'text': 'ранила'}]
+    assert router.parsed == ['убила', 'ранила']
+
+
+class Project(object):
+    pass
+
+
+def test_router_fallback_without_rasa_internals():
+    router = Router()
+    # у проекта другой версии rasa нет _models
+    router.project_store['default'] = Project()
+    assert nlu_batch.router_parse_batch(router, ['убила']) == [{'text': 'убила'}]
+    del router.project_store
+    assert nlu_batch.router_parse_batch(router, ['ранила']) == [{'text': 'ранила'}]
+    assert router.parsed == ['убила', 'ранила']
+
+
+class Embedding(object):
+    """intent_classifier_tensorflow_embedding без similarity_op и intent_placeholder"""
+    name = 'intent_classifier_tensorflow_embedding'
+    session = object()
+    embedding_placeholder = object()
+    inv_intent_dict = {0: 'hit'}
+
+    def process(self, message, **kwargs):
+        message.set('intent', {'name': 'hit', 'confidence': 1.0}, add_to_output=True)
+
+
+class Sklearn(object):
+    name = 'intent_classifier_sklearn'
+    clf = None
+
+    def predict_prob(self, X):
+        pass
+
+    def transform_labels_num2str(self, y):
+        pass
+
+
+class Spacy(object):
+    name = 'nlp_spacy'
+    component_config = {}
+    nlp = object()
+
+
+def test_batch_processor_needs_rasa_internals():
+    assert nlu_batch.batch_processor(Sklearn()) is nlu_batch._process_sklearn
+    assert nlu_batch.batch_processor(Embedding()) is None
+    assert nlu_batch.batch_processor(Spacy()) is None
+    assert nlu_batch.batch_processor(LengthClassifier()) is None
+
+
+class LengthClassifier(object):
+    name = 'intent_classifier_length'
+
+    def process(self, message, **kwargs):
+        message.set('intent', {'name': 'len%d' % len(message.text), 'confidence': 1.0}, add_to_output=True)
+
+
+class Interpreter(object):
+    pipeline = [LengthClassifier()]
+    context = {}
+
+    @staticmethod
+    def default_output_attributes():
+        return {'intent': {'name': '', 'confidence': 0.0}, 'entities': []}
+
+
+def test_interpreter_parse_batch():
+    pytest.importorskip('rasa_nlu')
+    timings = []
+    outputs = nlu_batch.interpreter_parse_batch(Interpreter(), ['убила', '', 'ты попала'],
+                                                timer=lambda *args: timings.append(args))
+    assert [o['intent']['name'] for o in outputs] == ['len5', '', 'len9']
+    assert [o['text'] for o in outputs] == ['убила', '', 'ты попала']
+    assert [(name, count) for name, _, count in timings] == [('intent_classifier_length', 2)]
+
+
+class EmbeddingInterpreter(Interpreter):
+    pipeline = [Embedding()]
+
+
+def test_interpreter_parse_batch_falls_back():
+    pytest.importorskip('rasa_nlu')
+    outputs = nlu_batch.interpreter_parse_batch(EmbeddingInterpreter(), ['убила', 'ты попала'])
+    assert [o['intent']['name'] for o in outputs] == ['hit', 'hit']
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from seabattle import nlu_cache
+
+
+@pytest.fixture
+def model_dir(tmpdir):
+    model = tmpdir.mkdir('mldata').join('model.bin')
+    model.write('v1')
+    return str(tmpdir.join('mldata'))
+
+
+def _parser(calls):
+    def parse(message):
+        calls.append(message)
+        return {'text': message, 'intent': {'name': 'hit', 'confidence': 0.9}, 'entities': []}
+    return parse
+
+
+def test_lru_and_counters():
+    cache = nlu_cache.NLUCache(max_size=2)
+    calls = []
+    parse = _parser(calls)
+
+    assert cache.parse('Ты  попала!', parse)['text'] == 'ты попала'
+    assert cache.parse('ты попала', parse)['intent']['name'] == 'hit'
+    cache.parse('ранила', parse)
+    cache.parse('ты попала', parse)
+    cache.parse('убила', parse)
+    # «ранила» вытеснена как давно не использованная
+    cache.parse('ранила', parse)
+
+    assert calls == ['ты попала', 'ранила', 'убила', 'ранила']
+    assert cache.hits == 2
+    assert cache.misses == 4
+    assert len(cache) == 2
+
+
+def test_returns_copies():
+    cache = nlu_cache.NLUCache()
+    cache.parse('попала', _parser([]))
+    cache.get('попала')['entities'].append('junk')
+    assert cache.get('попала')['entities'] == []
+
+
+def test_persistence(tmpdir, model_dir):
+    path = str(tmpdir.join('cache.json'))
+    cache = nlu_cache.NLUCache(model_dir=model_dir, path=path)
+    cache.parse('я хожу 2 2', _parser([]))
+    cache.save()
+
+    restored = nlu_cache.NLUCache(model_dir=model_dir, path=path)
+    assert restored.get('Я хожу 2 2')['text'] == 'я хожу 2 2'
+
+    with open(os.path.join(model_dir, 'model.bin'), 'w') as f:
+        f.write('v2, retrained')
+    assert len(nlu_cache.NLUCache(model_dir=model_dir, path=path)) == 0
+
+
+def test_from_env(model_dir):
+    assert nlu_cache.from_env(model_dir, {'NLU_CACHE_SIZE': '0'}) is None
+    assert nlu_cache.from_env(model_dir, {}).max_size == nlu_cache.DEFAULT_MAX_SIZE
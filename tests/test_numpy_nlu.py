@@ -0,0 +1,187 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import itertools
+import json
+import os
+
+import numpy as np
+
+from seabattle import dialog_manager as dm
+from seabattle import nlu_batch, nlu_export, numpy_nlu
+
+
+LABELS = ['O', 'U-hit_entity', 'B-hit_entity', 'L-hit_entity']
+FEATURES = [['low', 'title'], ['upper', 'bias', 'word3'], ['upper', 'pos', 'pos2']]
+
+
+def _brute_marginals(state, transitions):
+    length, count = state.shape
+    marginals = np.zeros_like(state)
+    for labels in itertools.product(range(count), repeat=length):
+        score = sum(state[t, l] for t, l in enumerate(labels))
+        score += sum(transitions[a, b] for a, b in zip(labels, labels[1:]))
+        for t, l in enumerate(labels):
+            marginals[t, l] += np.exp(score)
+    return marginals / marginals[0].sum()
+
+
+def test_tokenize():
+    assert numpy_nlu.tokenize('мимо, я хожу а5') == [('мимо', 0), (',', 4), ('я', 6), ('хожу', 8), ('а5', 13)]
+    assert numpy_nlu.tokenize('7-10 северо-запад') == [('7', 0), ('-', 1), ('10', 2), ('северо', 5), ('-', 11),
+                                                       ('запад', 12)]
+    assert numpy_nlu.tokenize('') == []
+
+
+def test_crf_marginals():
+    rng = np.random.RandomState(3)
+    state, transitions = rng.normal(size=(4, 3)), rng.normal(size=(3, 3))
+    assert np.allclose(numpy_nlu.crf_marginals(state, transitions), _brute_marginals(state, transitions))
+    assert np.allclose(numpy_nlu.crf_marginals(state[:1], transitions), _brute_marginals(state[:1], transitions))
+
+
+def test_bilou_entities():
+    marginals = np.array([
+        [0.9, 0.05, 0.05, 0.0],
+        [0.1, 0.1, 0.7, 0.1],
+        [0.2, 0.0, 0.2, 0.6],
+        [0.1, 0.8, 0.0, 0.1],
+        [0.2, 0.0, 0.8, 0.0],
+    ])
+    spans = numpy_nlu.bilou_entities(LABELS, marginals)
+    assert [(first, last, entity) for first, last, entity, _ in spans] == [
+        (1, 2, 'hit_entity'), (3, 3, 'hit_entity'), (4, 4, 'hit_entity')]
+    # уверенность – минимум сумм по меткам сущности, у незакрытой сущности – 0
+    assert [round(c, 6) for _, _, _, c in spans] == [0.8, 0.9, 0.0]
+
+
+class Token(object):
+    def __init__(self, text, idx):
+        self.text = text
+        self.idx = idx
+        self.tag_ = ''
+
+
+class Nlp(object):
+    name = 'nlp_spacy'
+    component_config = {'case_sensitive': False}
+
+    def nlp(self, text):
+        return [Token(text, idx) for text, idx in numpy_nlu.tokenize(text)]
+
+
+class Tagger(object):
+    classes_ = LABELS
+    state_features_ = {
+        ('0:bias:bias', 'O'): 2.0,
+        ('0:word3:5', 'U-hit_entity'): 6.0,
+        ('0:low:а', 'B-hit_entity'): 5.0,
+        ('-1:low:а', 'L-hit_entity'): 8.0,
+        ('EOS', 'O'): 0.5,
+    }
+    transition_features_ = {('B-hit_entity', 'L-hit_entity'): 3.0, ('O', 'L-hit_entity'): -5.0}
+
+
+class Crf(object):
+    name = 'ner_crf'
+    component_config = {'features': FEATURES, 'BILOU_flag': True}
+    ent_tagger = Tagger()
+
+
+INTENTS = {'мимо': 'miss', 'попала': 'hit', 'убила': 'kill', 'игра': 'newgame'}
+
+
+class Interpreter(object):
+    """Модель-учитель: намерение по ключевому слову, сущности – перебором всех разметок CRF"""
+
+    pipeline = [Nlp(), Crf()]
+
+    def __init__(self, extra_entity=False):
+        self.extra_entity = extra_entity
+
+    def parse(self, text):
+        lowered = text.lower()
+        tokens = numpy_nlu.tokenize(lowered)
+        scores = dict((name, 0.1) for name in INTENTS.values())
+        for word, name in INTENTS.items():
+            if word in lowered:
+                scores[name] = 0.95 if len(tokens) < 4 else 0.6
+        ranking = [{'name': name, 'confidence': scores[name]} for name in sorted(scores, key=lambda n: -scores[n])]
+        return {'text': text, 'intent': ranking[0], 'intent_ranking': ranking,
+                'entities': self._entities(lowered, tokens)}
+
+    def _entities(self, text, tokens):
+        if not tokens:
+            return []
+        state = np.zeros((len(tokens), len(LABELS)))
+        for t, attributes in enumerate(numpy_nlu.crf_attributes([(w, '') for w, _ in tokens], FEATURES)):
+            for attribute, value in attributes:
+                for label in LABELS:
+                    state[t, LABELS.index(label)] += value * Tagger.state_features_.get((attribute, label), 0.0)
+        transitions = np.zeros((len(LABELS), len(LABELS)))
+        for (a, b), weight in Tagger.transition_features_.items():
+            transitions[LABELS.index(a), LABELS.index(b)] = weight
+
+        entities = []
+        for first, last, entity, confidence in numpy_nlu.bilou_entities(LABELS, _brute_marginals(state, transitions)):
+            start, end = tokens[first][1], tokens[last][1] + len(tokens[last][0])
+            entities.append({'start': start, 'end': end, 'value': text[start:end], 'entity': entity,
+                             'confidence': confidence, 'extractor': 'ner_crf'})
+        if self.extra_entity and 'алиса' in text:
+            entities.append({'start': 0, 'end': 5, 'value': 'алиса', 'entity': 'opponent_entity'})
+        return entities
+
+
+TEXTS = ['мимо я хожу а 5', 'мимо', 'Ты попала', 'убила', 'новая игра', 'новая игра с алиса', 'я хожу 3 5',
+         'мимо, а я хожу б 7']
+
+
+def test_export_and_parse(tmpdir, monkeypatch):
+    out = os.path.join(str(tmpdir), 'numpy')
+    result = nlu_export.export(Interpreter(), TEXTS, out, 'model_1', folds=2, min_agreement=0.0)
+    assert result.problems == {} and result.saved
+    assert sorted(os.listdir(out)) == ['crf_state.npy', 'crf_transitions.npy', 'intent_bias.npy',
+                                       'intent_weights.npy', 'meta.json']
+    with io.open(os.path.join(out, 'meta.json'), encoding='utf-8') as f:
+        validation = json.load(f)['validation']
+    assert validation['heldout_texts'] == len(TEXTS)
+    assert result.agreement is not None and validation['heldout_agreement'] == result.agreement
+
+    router = numpy_nlu.NumpyRouter(out)
+    assert isinstance(router.model.intent_weights, np.memmap)
+    response = router.parse(router.extract({'q': 'мимо я хожу а 5'}))
+    assert response['intent']['name'] == 'miss' and response['model'] == 'model_1'
+    assert [(e['entity'], e['value']) for e in response['entities']] == [('hit_entity', 'а 5')]
+    assert [r['intent']['name'] for r in nlu_batch.router_parse_batch(router, ['убила', 'Ты попала'])] == [
+        'kill', 'hit']
+
+    monkeypatch.setattr(dm, 'NLU_ARTIFACT', out)
+    monkeypatch.setattr(dm, '_router', None)
+    assert isinstance(dm.get_router(), numpy_nlu.NumpyRouter)
+    assert dm._router_parse('новая игра')['intent']['name'] == 'newgame'
+
+
+def test_export_refuses_mismatch(tmpdir):
+    out = os.path.join(str(tmpdir), 'numpy')
+    result = nlu_export.export(Interpreter(extra_entity=True), TEXTS, out, min_agreement=0.0)
+    assert list(result.problems) == ['новая игра с алиса'] and not result.saved
+    assert not os.path.exists(out) and not os.path.exists(out + '.building')
+
+    result = nlu_export.export(Interpreter(extra_entity=True), TEXTS, out, force=True, min_agreement=0.0)
+    assert list(result.problems) == ['новая игра с алиса'] and result.saved
+    assert os.path.exists(os.path.join(out, 'meta.json'))
+
+
+def test_export_gates_on_heldout(tmpdir):
+    out = os.path.join(str(tmpdir), 'numpy')
+    # по одной-две фразы на намерение: без своей части модель их не узнаёт, хотя на обучении всё совпадает
+    result = nlu_export.export(Interpreter(), TEXTS, out, folds=2, holdout=['мимо я хожу в 3', 'мимо'])
+    assert result.problems == {} and not result.saved
+    assert result.heldout_total == len(TEXTS) + 1
+    assert 'убила' in result.heldout and result.agreement < nlu_export.DEFAULT_MIN_AGREEMENT
+    assert not os.path.exists(out) and not os.path.exists(out + '.building')
+
+    # без отложенных фраз проверить обобщение нечем
+    result = nlu_export.export(Interpreter(), TEXTS, out, folds=1, min_agreement=0.0)
+    assert result.agreement is None and not result.saved
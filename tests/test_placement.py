@@ -0,0 +1,41 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from seabattle import placement
+from seabattle.bitboard import get_masks, iter_bits
+from seabattle.game import Game
+
+
+def test_placements_count():
+    assert len(placement.get_placements(10, 1)) == 100
+    assert len(placement.get_placements(10, 4)) == 2 * 7 * 10
+    assert len(placement.get_placements(3, 3)) == 6
+
+
+def test_generate_field():
+    masks = get_masks(10)
+    for _ in range(50):
+        field = placement.generate_field(10, Game.default_ships)
+        ships_mask = sum(1 << i for i, v in enumerate(field) if v)
+
+        assert sum(field) == sum(Game.default_ships)
+        # корабли не касаются друг друга даже углами: у клетки не может быть
+        # соседей-кораблей по диагонали
+        for index in iter_bits(ships_mask):
+            diagonal = masks.neighbours[index] & ~masks.line_neighbours[index]
+            assert not diagonal & ships_mask
+
+
+def test_field_pool():
+    pool = placement.FieldPool(3, [2, 1], capacity=2)
+
+    fields = [pool.take() for _ in range(5)]
+    assert all(sum(field) == 3 for field in fields)
+    assert fields[0] is not fields[1]
+
+
+def test_empty_field_pool():
+    pool = placement.FieldPool(3, [2, 1], capacity=0)
+
+    assert sum(pool.take()) == 3
+    assert pool.qsize() == 0
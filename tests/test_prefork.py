@@ -0,0 +1,173 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import signal
+import time
+
+import pytest
+
+try:
+    from http import client as http_client
+except ImportError:
+    import httplib as http_client
+
+from seabattle import prefork
+
+
+SMAPS = """\
+00400000-00452000 r-xp 00000000 08:02 173521      /usr/bin/python
+Rss:                 300 kB
+Pss:                 100 kB
+Shared_Clean:        240 kB
+Shared_Dirty:          0 kB
+Private_Clean:        40 kB
+Private_Dirty:        20 kB
+7f0000000000-7f0000001000 rw-p 00000000 00:00 0
+Rss:                   4 kB
+Pss:                   4 kB
+Private_Dirty:         4 kB
+"""
+
+
+def test_parse_smaps():
+    usage = prefork.parse_smaps(SMAPS.splitlines())
+    assert usage == {'rss': 304 * 1024, 'pss': 104 * 1024, 'uss': 64 * 1024, 'shared': 240 * 1024}
+
+
+def test_memory_usage():
+    usage = prefork.memory_usage(os.getpid())
+    if usage is None:
+        pytest.skip('no /proc smaps')
+    assert 0 < usage['uss'] <= usage['pss'] <= usage['rss']
+    assert prefork.memory_usage(2 ** 22 + 1) is None
+
+
+def _app(environ, start_response):
+    start_response(str('200 OK'), [(str('Content-Type'), str('text/plain'))])
+    return [('%d' % os.getpid()).encode('ascii')]
+
+
+def _get(port):
+    connection = http_client.HTTPConnection('127.0.0.1', port, timeout=5)
+    connection.request('GET', '/')
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return int(body)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_arbiter_restarts_workers():
+    sock = prefork.listen('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    arbiter = prefork.Arbiter(sock, _app, workers=2, report_interval=0)
+    arbiter.start()
+    try:
+        first = set(arbiter.pids)
+        assert len(first) == 2
+        assert _get(port) in first
+
+        victim = sorted(first)[0]
+        os.kill(victim, signal.SIGKILL)
+        for _ in range(100):
+            arbiter.reap()
+            if victim not in arbiter.pids and len(arbiter.pids) == 2:
+                break
+            time.sleep(0.05)
+        assert victim not in arbiter.pids
+        assert len(arbiter.pids) == 2
+        assert _get(port) in arbiter.pids
+        assert set(arbiter.memory()) == arbiter.pids | {os.getpid()}
+    finally:
+        arbiter.stop()
+        sock.close()
+    assert not arbiter.pids
+
+
+class Router(object):
+    def __init__(self):
+        self.pid = os.getpid()
+
+    def extract(self, data):
+        return {'text': data['q']}
+
+    def parse(self, data):
+        return {'intent': {'name': 'miss', 'confidence': 1.0}, 'entities': [], 'router_pid': self.pid}
+
+
+def _forked_workers(tmpdir, **kwargs):
+    """Запускает воркеры, каждый из которых разбирает фразу и записывает, чей router он использовал"""
+    from seabattle import dialog_manager as dm
+    from seabattle import session
+
+    def serve(app, sock, threaded):
+        response = dm._router_parse('мимо')
+        with open(os.path.join(str(tmpdir), '%d' % os.getpid()), 'w') as f:
+            f.write('%d %d %d' % (response['router_pid'], dm.is_ready(), session._sweeper is not None))
+
+    sock = prefork.listen('127.0.0.1', 0)
+    arbiter = prefork.Arbiter(sock, None, workers=2, report_interval=0, serve=serve, **kwargs)
+    arbiter.start()
+    try:
+        pids = set(arbiter.pids)
+        deadline = time.time() + 10
+        while time.time() < deadline and len(os.listdir(str(tmpdir))) < 2:
+            time.sleep(0.05)
+    finally:
+        arbiter.stop()
+        sock.close()
+    results = {}
+    for pid in pids:
+        with open(os.path.join(str(tmpdir), '%d' % pid)) as f:
+            results[pid] = tuple(int(v) for v in f.read().split())
+    return results
+
+
+@pytest.fixture
+def fake_router(monkeypatch):
+    from seabattle import dialog_manager as dm
+
+    monkeypatch.setattr(dm, '_router', None)
+    monkeypatch.setattr(dm, 'get_router', lambda: dm._router or _set_router(dm))
+    monkeypatch.setattr(dm, 'BATCH_SIZE', 1)
+    monkeypatch.setattr(dm.startup, 'timer', dm.startup.StartupTimer())
+    return dm
+
+
+def _set_router(dm):
+    dm._router = Router()
+    return dm._router
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_fork_after_warmup(tmpdir, fake_router):
+    fake_router.warmup()
+    results = _forked_workers(tmpdir)
+    # воркеры разбирают фразы моделью, загруженной в родителе
+    assert [(router_pid, ready) for router_pid, ready, _ in results.values()] == [(os.getpid(), 1)] * 2
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_workers_warm_up_themselves(tmpdir, fake_router, monkeypatch):
+    monkeypatch.setenv('SESSION_DB', os.path.join(str(tmpdir), 'sessions.db'))
+    results_dir = tmpdir.mkdir('results')
+    results = _forked_workers(results_dir, warmup=True)
+    assert all(router_pid == pid and ready for pid, (router_pid, ready, _) in results.items())
+    # сессии чистит ровно один воркер
+    assert sorted(sweeper for _, _, sweeper in results.values()) == [0, 1]
+
+
+def test_fork_safe(tmpdir, monkeypatch):
+    from seabattle import dialog_manager as dm
+
+    model_dir = tmpdir.mkdir('default').mkdir('model_1')
+    metadata = model_dir.join('metadata.json')
+    monkeypatch.setattr(dm, 'MODEL_DIR', str(tmpdir))
+
+    metadata.write('{"pipeline": [{"name": "nlp_spacy"}, {"name": "intent_classifier_sklearn"}]}')
+    assert prefork.fork_safe({})
+    metadata.write('{"pipeline": [{"name": "nlp_spacy"}, {"name": "intent_classifier_tensorflow_embedding"}]}')
+    assert not prefork.fork_safe({})
+    assert prefork.fork_safe({'NLU_ARTIFACT': 'mldata/numpy/'})
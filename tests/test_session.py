@@ -0,0 +1,190 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+import pytest
+
+from seabattle import session
+from seabattle.game import Game
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def _game_session():
+    session_obj = session.new_session()
+    session_obj['game'] = Game()
+    session_obj['game'].start_new_game()
+    session_obj['opponent'] = 'яндекс'
+    return session_obj
+
+
+def _finished_session():
+    session_obj = _game_session()
+    session_obj['game'].ships_count = 0
+    return session_obj
+
+
+def test_is_finished():
+    assert not session.is_finished(session.new_session())
+    assert not session.is_finished(_game_session())
+    assert session.is_finished(_finished_session())
+
+
+def test_memory_store_lru(clock):
+    store = session.MemoryStore(max_size=2, clock=clock)
+    first = store.get('a')
+    store.get('b')
+    assert store.get('a') is first
+
+    store.get('c')
+    assert len(store) == 2
+    # 'b' дольше всех не использовался и был вытеснен
+    assert store.get('a') is first
+    assert store.get('b') is not None and len(store) == 2
+
+
+def test_memory_store_sweep(clock):
+    store = session.MemoryStore(ttl=100, finished_ttl=10, clock=clock)
+    store.save('playing', _game_session())
+    store.save('choosing', session.new_session())
+    store.save('finished', _finished_session())
+
+    clock.now += 50
+    assert store.sweep() == 1
+    assert len(store) == 2
+
+    clock.now += 100
+    assert store.sweep() == 2
+    assert len(store) == 0
+
+
+def test_sqlite_store(tmpdir, clock):
+    path = str(tmpdir.join('sessions.db'))
+    store = session.SQLiteStore(path, batch_size=2, flush_interval=60, clock=clock)
+
+    store.save('user1', _game_session())
+    # запись ещё не сброшена в базу, но сессия уже доступна
+    assert store.get('user1')['opponent'] == 'яндекс'
+    store.save(42, _finished_session())
+    store.close()
+
+    store = session.SQLiteStore(path, clock=clock)
+    restored = store.get('user1')
+    assert restored['opponent'] == 'яндекс'
+    assert sum(restored['game'].field) == 20
+    assert restored['game'].do_shot()
+    assert store.get(42)['game'].is_end_game()
+    assert len(store) == 2
+
+    clock.now += session.DEFAULT_FINISHED_TTL + 1
+    assert store.sweep() == 1
+    assert len(store) == 1
+    store.close()
+
+
+def test_sqlite_approximate_size(tmpdir, clock):
+    store = session.SQLiteStore(str(tmpdir.join('sessions.db')), batch_size=100, flush_interval=60,
+                                size_interval=10, clock=clock)
+    store.save('user1', _game_session())
+    assert store.approximate_size() == 0
+    store.save('user2', _game_session())
+    # запись не сброшена, а число ещё не пересчитывалось
+    assert store.approximate_size() == 0
+
+    clock.now += 10
+    store.flush()
+    assert store.approximate_size() == 2
+
+    store.save('user3', _finished_session())
+    clock.now += session.DEFAULT_FINISHED_TTL + 1
+    # чистка пересчитывает число сама
+    assert store.sweep() == 1
+    assert store.approximate_size() == 2
+    store.close()
+
+
+@pytest.mark.parametrize('with_file', [False, True])
+def test_lock_stripes(tmpdir, with_file):
+    locks = session.LockStripes(4, str(tmpdir.join('sessions.lock')) if with_file else None)
+    assert locks.index('user1') == locks.index('user1')
+    assert 0 <= locks.index(42) < 4
+
+    contended = session.LOCKS.get(['contended'])
+    counter = {'value': 0}
+
+    def increment():
+        with locks.lock('user1'):
+            value = counter['value']
+            time.sleep(0.01)
+            counter['value'] = value + 1
+
+    threads = [threading.Thread(target=increment) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    locks.close()
+
+    assert counter['value'] == 5
+    assert session.LOCKS.get(['contended']) > contended
+
+
+def test_store_is_created_lazily(tmpdir, monkeypatch):
+    path = str(tmpdir.join('sessions.db'))
+    monkeypatch.setenv('SESSION_DB', path)
+    monkeypatch.setattr(session, '_store', None)
+    monkeypatch.setattr(session, '_locks', None)
+    assert not os.path.exists(path)
+    with session.locked('user1'):
+        session.save('user1', _game_session())
+    assert isinstance(session.get_store(), session.SQLiteStore) and session.get_store().path == path
+    assert session.get('user1')['opponent'] == 'яндекс'
+    session.get_store().close()
+    session.get_locks().close()
+
+
+def test_locked(monkeypatch):
+    monkeypatch.setattr(session, '_store', session.MemoryStore())
+    monkeypatch.setattr(session, '_locks', session.LockStripes(1))
+    with session.locked('user1'):
+        session_obj = session.get('user1')
+        session_obj['opponent'] = 'яндекс'
+        session.save('user1', session_obj)
+    assert session.get('user1')['opponent'] == 'яндекс'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork') or session.fcntl is None, reason='needs fork and fcntl')
+def test_lock_stripes_between_processes(tmpdir):
+    path = str(tmpdir.join('sessions.lock'))
+    locks = session.LockStripes(4, path)
+    read_fd, write_fd = os.pipe()
+    with locks.lock('user1'):
+        pid = os.fork()
+        if pid == 0:
+            # в дочернем процессе полоса занята родителем
+            try:
+                child_locks = session.LockStripes(4, path)
+                started = time.time()
+                with child_locks.lock('user1'):
+                    os.write(write_fd, ('%d' % ((time.time() - started) * 1000)).encode('ascii'))
+            finally:
+                os._exit(0)
+        time.sleep(0.2)
+    waited = int(os.read(read_fd, 16))
+    os.waitpid(pid, 0)
+    locks.close()
+    assert waited >= 100
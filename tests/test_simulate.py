@@ -0,0 +1,42 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from seabattle import simulate
+
+
+def test_play_seed_is_reproducible():
+    specs = ['seabattle.game', 'seabattle.game:Game']
+    first = simulate.play_seed((7, specs, 10, [4, 3, 3, 2, 2, 2, 1, 1, 1, 1]))
+    second = simulate.play_seed((7, specs, 10, [4, 3, 3, 2, 2, 2, 1, 1, 1, 1]))
+
+    assert first == second
+    assert first.errors == [0, 0]
+    assert sum(first.wins) == 2
+    assert all(20 <= shots <= 100 for player_shots in first.shots for shots in player_shots)
+
+
+def test_winner():
+    assert simulate._winner((30, 10), (30, 10)) == 0
+    assert simulate._winner((30, 11), (30, 10)) == 1
+    assert simulate._winner(None, (30, 10)) == 1
+    assert simulate._winner(None, None) is None
+
+
+def test_statistics():
+    assert simulate.norm_ppf(0.975) == pytest.approx(1.96, abs=1e-3)
+
+    low, high = simulate.wilson_interval(50, 100)
+    assert low < 0.5 < high
+    assert simulate.wilson_interval(0, 0) == (0.0, 1.0)
+
+
+def test_run_tournament():
+    stats, elapsed, z_crit = simulate.run_tournament(
+        ['seabattle.game', 'seabattle.game'], games=8, processes=2, alpha=0)
+
+    assert stats.games == 8
+    assert stats.errors == [0, 0]
+    assert z_crit == float('inf')
+    assert 'games/sec' in simulate.report(stats, ['a', 'b'], elapsed, z_crit)
@@ -0,0 +1,77 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import random
+
+import pytest
+
+from seabattle import placement, snapshot
+from seabattle.game import BaseGame, Game
+from seabattle.strategy import Point
+
+
+def _play(game, referee, shots):
+    answers = []
+    for _ in range(shots):
+        if game.is_victory():
+            break
+        game.do_shot()
+        answer = referee.handle_enemy_shot(game.last_shot_position)
+        game.handle_enemy_reply(answer)
+        answers.append((tuple(game.last_shot_position), answer))
+    return answers
+
+
+@pytest.mark.parametrize('density', [False, True])
+@pytest.mark.parametrize('bitboard', [False, True])
+def test_roundtrip_continues_the_same_game(density, bitboard):
+    for seed in range(10):
+        random.seed(seed)
+        referee = BaseGame()
+        referee.start_new_game(field=placement.generate_field(10, BaseGame.default_ships))
+        game = Game(density=density)
+        game.start_new_game(numbers=True, bitboard=bitboard)
+        _play(game, referee, random.randint(0, 60))
+
+        data = snapshot.to_bytes(game)
+        assert len(data) < 300
+        restored = snapshot.from_bytes(data)
+        assert list(restored.field) == list(game.field)
+        assert list(restored.enemy_field) == list(game.enemy_field)
+        assert type(restored.field) is type(game.field)
+        if density:
+            assert list(restored.density_strategy.heat) == list(game.density_strategy.heat)
+
+        restored_referee = BaseGame()
+        restored_referee.start_new_game(field=list(referee.field))
+        state = random.getstate()
+        expected = _play(game, referee, 100)
+        random.setstate(state)
+        assert _play(restored, restored_referee, 100) == expected
+
+
+def test_invalid_snapshot():
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.from_bytes(b'XX\x01')
+
+    data = snapshot.to_bytes(_new_game())
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.from_bytes(data[:-5])
+
+
+def test_reads_version_1():
+    game = _new_game()
+    game.last_shot_position = Point(5, 5)
+    game.handle_enemy_reply('hit')
+    data = bytearray(snapshot.to_bytes(game))
+    data[len(snapshot.MAGIC)] = 1
+    # версия 1 хранила после клеток раненого корабля ещё и его кандидатов
+    restored = snapshot.from_bytes(bytes(data) + b'\x01\x05\x04')
+    assert restored.damaged_ship_strategy.ship == [Point(5, 5)]
+    assert restored.do_shot() == game.do_shot()
+
+
+def _new_game():
+    game = Game()
+    game.start_new_game()
+    return game
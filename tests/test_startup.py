@@ -0,0 +1,47 @@
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import pytest
+
+from seabattle import startup
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_phases():
+    clock = Clock()
+    timer = startup.StartupTimer(clock=clock)
+
+    with timer.phase('import rasa_nlu'):
+        clock.now += 2
+    with pytest.raises(RuntimeError):
+        with timer.phase('load model'):
+            clock.now += 3
+            raise RuntimeError()
+
+    report = timer.report()
+    assert not report['ready']
+    assert report['phases'] == [{'name': 'import rasa_nlu', 'seconds': 2}, {'name': 'load model', 'seconds': 3}]
+
+    clock.now += 1
+    timer.mark_ready()
+    clock.now += 10
+    assert timer.report()['ready']
+    assert timer.report()['total'] == 6
+
+
+def test_import_module():
+    timer = startup.StartupTimer()
+    assert timer.import_module('json').dumps([]) == '[]'
+    assert timer.import_module('no_such_module_here', optional=True) is None
+    with pytest.raises(ImportError):
+        timer.import_module('no_such_module_here')
+    assert [p['name'] for p in timer.report()['phases']] == [
+        'import json', 'import no_such_module_here', 'import no_such_module_here']
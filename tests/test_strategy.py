@@ -1,7 +1,10 @@
 # coding: utf-8
 import pytest
 
-from seabattle.strategy import Strategy
+from seabattle.free_cells import FreeCells
+from seabattle.game import Game
+from seabattle.placement import get_placements
+from seabattle.strategy import DamagedShipStrategy, Point, Strategy
 
 
 @pytest.fixture
@@ -39,3 +42,104 @@ def test_strategy(four_decker_strategy, three_decker_strategy, two_decker_strate
     assert points_in_line_count(four_decker_strategy.shooting_field, 4)
     assert points_in_line_count(three_decker_strategy.shooting_field, 3)
     assert points_in_line_count(two_decker_strategy.shooting_field, 2)
+
+
+def _expected_heat(game, ships):
+    """Карта, посчитанная с нуля: положения оставшихся кораблей по неоткрытым клеткам"""
+    heat = [0] * game.size ** 2
+    closed = sum(1 << i for i, v in enumerate(game.enemy_field) if v != 0)
+    for length in set(ships):
+        for placement in get_placements(game.size, length):
+            if placement.ship & closed:
+                continue
+            for index in range(game.size ** 2):
+                if placement.ship >> index & 1:
+                    heat[index] += ships.count(length)
+    return heat
+
+
+def test_density_strategy_incremental_heat():
+    game = Game(density=True)
+    game.start_new_game(field=[0] * 100, ships=[3, 2, 1])
+    strategy = game.density_strategy
+
+    assert list(strategy.heat) == _expected_heat(game, [3, 2, 1])
+
+    game.last_shot_position = Point(5, 5)
+    game.handle_enemy_reply('miss')
+    assert list(strategy.heat) == _expected_heat(game, [3, 2, 1])
+
+    game.last_shot_position = Point(1, 1)
+    game.handle_enemy_reply('hit')
+    game.last_shot_position = Point(1, 2)
+    game.handle_enemy_reply('kill')
+    assert strategy.weights[2] == 0
+    free = [i for i, v in enumerate(game.enemy_field) if v == 0]
+    expected = _expected_heat(game, [3, 1])
+    assert [strategy.heat[i] for i in free] == [expected[i] for i in free]
+
+    point = game.strategy.get_shoot_point()
+    assert game.enemy_field[game.calc_index(point)] == 0
+    assert strategy.heat[game.calc_index(point)] == max(expected)
+
+
+def test_shot_plans_are_shared():
+    first = Strategy(region_size=3, start_x=2, start_y=1, order=[2, 0, 1])
+    second = Strategy(region_size=3, start_x=2, start_y=1, order=[2, 0, 1])
+    assert first.plan is second.plan
+
+    shots = len(first.plan)
+    point = first.get_shoot_point()
+    assert first.remaining == shots - 1 and second.remaining == shots
+    assert (point.y - 1) * 10 + point.x - 1 == first.plan[-1]
+    assert len(first.shooting_field) == shots - 1
+
+    restored = Strategy(region_size=3, start_x=2, start_y=1, order=[2, 0, 1], remaining=first.remaining)
+    assert restored.get_shoot_point() == first.get_shoot_point()
+
+
+def test_decker_strategies_are_built_lazily():
+    game = Game()
+    game.start_new_game(field=[0] * 100)
+    assert game.four_decker_strategy is None
+
+    game.last_shot_position = Point(1, 1)
+    game.handle_enemy_reply('kill')
+    assert game.strategy is game.four_decker_strategy
+    assert game.three_decker_strategy is None and game.two_decker_strategy is None
+
+
+def test_strategy_takes_cells_from_the_index():
+    strategy = Strategy(region_size=2, start_x=1, start_y=1, order=[0, 1])
+    free = FreeCells(10)
+    last, before_last = strategy.plan[-1], strategy.plan[-2]
+    free.discard(last)
+    # клетка, вокруг которой закрыты все соседи, не вмещает двухпалубный корабль
+    x, y = before_last % 10, before_last // 10
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        if 0 <= x + dx < 10 and 0 <= y + dy < 10:
+            free.discard((y + dy) * 10 + x + dx)
+
+    point = strategy.get_shoot_point(free, min_length=2)
+    index = free.index(point)
+    assert index in free and free.max_run(index) >= 2
+    assert index not in (last, before_last)
+    assert strategy.remaining == strategy.ranks[index]
+
+
+def test_damaged_ship_skips_short_directions():
+    free = FreeCells(10)
+    damaged = DamagedShipStrategy()
+    # раненая клетка (5, 1): по горизонтали вокруг неё закрыты (4, 1) и (7, 1)
+    for point in (Point(5, 1), Point(4, 1), Point(7, 1)):
+        free.discard(free.index(point))
+    damaged.add_ship_point(Point(5, 1))
+
+    assert damaged.get_candidates(free, 2) == [Point(5, 2), Point(6, 1)]
+    # корабль длины 3 по горизонтали не помещается: свободна только (6, 1)
+    assert damaged.get_candidates(free, 3) == [Point(5, 2)]
+
+    free.discard(free.index(Point(5, 2)))
+    damaged.add_ship_point(Point(5, 2))
+    assert damaged.dimension == 'x'
+    assert damaged.get_shoot_point(free, 3) == Point(5, 3)
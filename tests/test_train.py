@@ -0,0 +1,231 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+
+import pytest
+
+from seabattle import train
+
+
+class Message(object):
+    def __init__(self, text, intent=None, entities=None):
+        self.text = text
+        self.data = {'intent': intent, 'entities': entities or []}
+
+    def get(self, prop, default=None):
+        return self.data.get(prop, default)
+
+    def set(self, prop, value):
+        self.data[prop] = value
+
+
+class TrainingData(object):
+    regex_features = []
+    entity_synonyms = []
+
+    def __init__(self, examples):
+        self.training_examples = examples
+
+    @property
+    def intent_examples(self):
+        return [m for m in self.training_examples if m.get('intent')]
+
+    @property
+    def entity_examples(self):
+        return [m for m in self.training_examples if m.get('entities')]
+
+    def persist(self, model_dir):
+        return {'training_data': 'training_data.json'}
+
+
+class Component(object):
+    name = None
+    provides = []
+    requires = []
+
+    def __init__(self, component_config=None, calls=None):
+        self.component_config = dict(component_config or {}, name=self.name)
+        self.calls = calls if calls is not None else []
+
+    def provide_context(self):
+        return None
+
+    def prepare_partial_processing(self, pipeline, context):
+        pass
+
+    def train(self, training_data, config, **kwargs):
+        self.calls.append(('train', self.name))
+        for message in training_data.training_examples:
+            self.process(message)
+
+    def persist(self, model_dir):
+        path = os.path.join(model_dir, self.name + '.json')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.component_config, ensure_ascii=False))
+        return {'file': self.name + '.json'}
+
+
+class Nlp(Component):
+    name = 'nlp_spacy'
+    provides = ['tokens']
+
+    def process(self, message, **kwargs):
+        self.calls.append(('process', message.text))
+        message.set('tokens', message.text.split())
+
+    def persist(self, model_dir):
+        return None
+
+
+class Language(object):
+    def __init__(self, meta):
+        self.meta = meta
+
+
+class Featurizer(Component):
+    name = 'intent_featurizer_ngrams'
+    provides = ['text_features']
+    requires = ['tokens']
+
+    def process(self, message, **kwargs):
+        message.set('text_features', [len(t) for t in message.get('tokens')])
+
+
+class Classifier(Component):
+    name = 'intent_classifier_sklearn'
+    provides = ['intent', 'intent_ranking']
+    requires = ['text_features']
+
+    def train(self, training_data, config, **kwargs):
+        assert all(m.get('text_features') is not None for m in training_data.intent_examples)
+        super(Classifier, self).train(training_data, config, **kwargs)
+
+    def process(self, message, **kwargs):
+        pass
+
+
+class Crf(Component):
+    name = 'ner_crf'
+    provides = ['entities']
+    requires = ['tokens']
+
+    def process(self, message, **kwargs):
+        assert message.get('tokens') is not None
+
+
+def _pipeline(calls, max_iterations=50):
+    return [Nlp(calls=calls), Featurizer(calls=calls), Classifier(calls=calls),
+            Crf({'max_iterations': max_iterations}, calls=calls)]
+
+
+def _examples():
+    return [
+        Message('новая игра', 'newgame'),
+        Message('я хожу а пять', 'shot', [{'entity': 'shot', 'value': 'а 5'}]),
+        Message('мимо', 'miss'),
+    ]
+
+
+@pytest.fixture(autouse=True)
+def _metadata(monkeypatch):
+    def write(metadata, model_dir):
+        with io.open(os.path.join(model_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(metadata, ensure_ascii=False))
+    monkeypatch.setattr(train, '_write_metadata', write)
+
+
+def _train(tmpdir, examples, keep=(), **kwargs):
+    calls = []
+    path = str(tmpdir)
+    cache = train.FeatureCache(os.path.join(path, '.train_cache.db'))
+    trainer = train.IncrementalTrainer(_pipeline(calls, **kwargs), {'language': 'ru'}, cache,
+                                       train.latest_model(path), keep)
+    reports = trainer.train(TrainingData(examples))
+    model_dir = trainer.persist(path, fixed_model_name='current')
+    cache.close()
+    return dict((r.name, r.action) for r in reports), calls, model_dir
+
+
+def test_plan():
+    data = TrainingData(_examples())
+    first = train.plan(_pipeline([]), data)
+    assert [action for action, _, _ in first] == ['processed', 'trained', 'trained', 'trained']
+
+    previous = dict(('%d:%s' % (i, c.name), {'fingerprint': p[1], 'structure': p[2]})
+                    for i, (c, p) in enumerate(zip(_pipeline([]), first)))
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous)] == ['processed', 'reused', 'reused', 'reused']
+
+    # новая разметка сущностей меняет только CRF
+    data.training_examples[1].set('entities', [{'entity': 'shot', 'value': 'а5'}])
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous)] == ['processed', 'reused', 'reused', 'trained']
+
+    # новая фраза меняет классификаторы, а с keep остаются старые
+    data.training_examples.append(Message('ранил', 'hit'))
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous)] == ['processed', 'trained', 'trained', 'trained']
+    keep = ['intent_featurizer_ngrams', 'intent_classifier_sklearn']
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous, keep)] == ['processed', 'kept', 'kept', 'trained']
+    # классификатор нельзя оставить, если признаки для него пересчитаны
+    keep = ['intent_classifier_sklearn']
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous, keep)] == ['processed', 'trained', 'trained', 'trained']
+
+
+def test_plan_depends_on_versions():
+    data = TrainingData(_examples())
+    versions = {'rasa_nlu': '0.12.0', 'spacy': '2.0.11'}
+    first = train.plan(_pipeline([]), data, versions=versions)
+    previous = dict(('%d:%s' % (i, c.name), {'fingerprint': p[1], 'structure': p[2]})
+                    for i, (c, p) in enumerate(zip(_pipeline([]), first)))
+    assert [a for a, _, _ in train.plan(_pipeline([]), data, previous, versions=versions)] == [
+        'processed', 'reused', 'reused', 'reused']
+
+    # новая версия библиотеки: ничего не переиспользуется, и ключи кэша документов spaCy другие
+    upgraded = train.plan(_pipeline([]), data, previous, versions=dict(versions, spacy='2.0.12'))
+    assert [a for a, _, _ in upgraded] == ['processed', 'trained', 'trained', 'trained']
+    assert upgraded[0][1] != first[0][1]
+
+    # новая версия модели spaCy
+    pipeline = _pipeline([])
+    pipeline[0].nlp = Language({'lang': 'xx', 'name': 'ent_wiki_sm', 'version': '2.0.1'})
+    assert [a for a, _, _ in train.plan(pipeline, data, previous, versions=versions)] == [
+        'processed', 'trained', 'trained', 'trained']
+
+
+def test_incremental_training(tmpdir):
+    actions, calls, model_dir = _train(tmpdir, _examples())
+    assert actions == {'nlp_spacy': 'processed', 'intent_featurizer_ngrams': 'trained',
+                       'intent_classifier_sklearn': 'trained', 'ner_crf': 'trained'}
+    assert len([c for c in calls if c[0] == 'process']) == 3
+    assert sorted(os.listdir(model_dir)) == [
+        'intent_classifier_sklearn.json', 'intent_featurizer_ngrams.json', 'metadata.json',
+        'ner_crf.json', 'train_manifest.json']
+
+    # ничего не изменилось: ничего не обучается и spaCy не вызывается
+    actions, calls, _ = _train(tmpdir, _examples())
+    assert set(actions.values()) == {'processed', 'reused'}
+    assert calls == []
+
+    # новые настройки CRF: признаки и токены берутся из кэша
+    actions, calls, model_dir = _train(tmpdir, _examples(), max_iterations=100)
+    assert actions['ner_crf'] == 'trained' and actions['intent_classifier_sklearn'] == 'reused'
+    assert calls == [('train', 'ner_crf')]
+    with io.open(os.path.join(model_dir, 'metadata.json'), encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert [c['name'] for c in metadata['pipeline']] == ['nlp_spacy', 'intent_featurizer_ngrams',
+                                                         'intent_classifier_sklearn', 'ner_crf']
+    assert metadata['pipeline'][3]['max_iterations'] == 100
+
+    # новая фраза: spaCy разбирает только её
+    examples = _examples() + [Message('ранил', 'hit')]
+    actions, calls, _ = _train(tmpdir, examples, max_iterations=100)
+    assert ('process', 'ранил') in calls and len([c for c in calls if c[0] == 'process']) == 1
+    assert actions['ner_crf'] == 'reused' and actions['intent_classifier_sklearn'] == 'trained'
+
+
+def test_report():
+    item = train.ComponentReport('ner_crf', 'trained')
+    item.seconds = 1.5
+    text = train.report([item], 2.0)
+    assert 'ner_crf' in text and '1.50' in text and '2.00' in text
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""seabattle.train против настоящего rasa_nlu 0.12 и конфига навыка"""
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+
+import pytest
+
+from seabattle import train
+
+rasa_nlu = pytest.importorskip('rasa_nlu')
+if not rasa_nlu.__version__.startswith('0.12.'):
+    pytest.skip('seabattle.train uses rasa_nlu 0.12 internals', allow_module_level=True)
+# модель spaCy из config/nlu_config.yml
+pytest.importorskip('xx_ent_wiki_sm')
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+CONFIG = os.path.join(ROOT, 'config', 'nlu_config.yml')
+DATA = os.path.join(ROOT, 'config', 'intents_config.json')
+
+LEARNED = ['intent_featurizer_ngrams', 'intent_classifier_keyword', 'intent_classifier_sklearn',
+           'intent_classifier_tensorflow_embedding', 'ner_crf']
+
+
+def _load_data():
+    with io.open(DATA, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_data(tmpdir, data):
+    path = str(tmpdir.join('intents_config.json'))
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, ensure_ascii=False))
+    return path
+
+
+def _rephrase(data, old, new):
+    """Заменяет фразу с координатой хода на new; сущность – вся координата после «хожу»"""
+    for example in data['rasa_nlu_data']['common_examples']:
+        if example['text'] == old:
+            value = new.split('хожу ', 1)[1]
+            example['text'] = new
+            example['entities'] = [{'start': len(new) - len(value), 'end': len(new), 'value': value,
+                                    'entity': 'hit_entity'}]
+            return
+    raise AssertionError(old)
+
+
+def _train(path, data_path):
+    reports, model_dir = train.train_model(CONFIG, data_path, path, fixed_model_name='current')
+    return dict((r.name, r) for r in reports), model_dir
+
+
+def _parses(interpreter, data):
+    result = []
+    for example in data['rasa_nlu_data']['common_examples']:
+        parsed = interpreter.parse(example['text'])
+        entities = sorted((e['entity'], e['start'], e['end'], e['value']) for e in parsed['entities'])
+        result.append((example['text'], parsed['intent']['name'], entities))
+    return result
+
+
+def test_incremental_training_matches_full(tmpdir):
+    from rasa_nlu import config as rasa_config
+    from rasa_nlu.model import Interpreter, Trainer
+    from rasa_nlu.training_data import load_data
+
+    path = str(tmpdir.mkdir('models'))
+    data = _load_data()
+    examples = len(data['rasa_nlu_data']['common_examples'])
+    reports, _ = _train(path, _write_data(tmpdir, data))
+    assert [reports[name].action for name in LEARNED] == ['trained'] * len(LEARNED)
+
+    # другие значения координат при тех же фразах меняют примеры только у CRF
+    for example in data['rasa_nlu_data']['common_examples']:
+        for entity in example.get('entities', []):
+            if entity['value'] == 'семь четыре':
+                entity['value'] = '7 4'
+    reports, _ = _train(path, _write_data(tmpdir, data))
+    assert [reports[name].action for name in LEARNED] == ['reused'] * 4 + ['trained']
+    assert reports['nlp_spacy'].misses == 0 and reports['nlp_spacy'].hits == examples
+
+    # новые фразы с координатами: переобучается всё, что видит текст, spaCy разбирает только их
+    _rephrase(data, 'я хожу 1 2', 'я хожу один два')
+    _rephrase(data, 'я хожу 10 10', 'я хожу десять десять')
+    data_path = _write_data(tmpdir, data)
+    reports, model_dir = _train(path, data_path)
+    assert [reports[name].action for name in LEARNED] == ['trained'] * len(LEARNED)
+    assert reports['nlp_spacy'].action == 'processed' and reports['nlp_spacy'].misses == 2
+
+    cfg = rasa_config.load(CONFIG)
+    full = Trainer(cfg).train(load_data(data_path, cfg.get('language')))
+    assert _parses(Interpreter.load(model_dir), data) == _parses(full, data)